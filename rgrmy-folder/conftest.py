@@ -0,0 +1,72 @@
+# Lets the tests import the scr package without installing it. The tests
+# live in tests/; scr/load_test.py is a tool, not a test module.
+import pytest
+
+collect_ignore = ["scr"]
+
+
+class FakeCursor:
+    # records what runs on it; fetchone/fetchall answer with rows, and
+    # UPDATE/DELETE take their rowcount from counts in turn
+    def __init__(self, rows=(), counts=(), fail_on=None):
+        self.rows = list(rows)
+        self.counts = list(counts)
+        self.fail_on = fail_on
+        self.executed = []
+        self.rowcount = -1
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        if self.fail_on and self.fail_on in query:
+            raise RuntimeError("statement failed")
+        self.executed.append((query, params))
+        writes = query.lstrip().startswith(("UPDATE", "DELETE"))
+        self.rowcount = self.counts.pop(0) if writes and self.counts else -1
+
+    def copy_expert(self, query, file):
+        self.executed.append((query, file.read()))
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+    def fetchall(self):
+        return list(self.rows)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    # a psycopg2 connection with one cursor; calls lists commit, rollback
+    # and cancel in order
+    def __init__(self, cursor=None):
+        self.cur = cursor or FakeCursor()
+        self.calls = []
+        self.closed = 0
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+    def cancel(self):
+        self.calls.append("cancel")
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def fake_connection():
+    # fake_connection(rows=..., counts=..., fail_on=...) -> FakeConnection
+    return lambda **cursor: FakeConnection(FakeCursor(**cursor))
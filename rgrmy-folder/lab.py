@@ -1,6 +1,29 @@
-from scr.сontroller import Controller
-
-
-if __name__ == "__main__":
-    controller = Controller()
-    controller.run()
+import argparse
+
+from scr.mem_profile import MemoryProfiler
+from scr.slow_log import SlowQueryLog
+from scr.сontroller import Controller
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--slow-log", metavar="PATH", help="log slow statements to this JSON-lines file")
+    parser.add_argument("--slow-ms", type=float, default=200, help="slow statement threshold in ms")
+    parser.add_argument("--slow-redact", action="store_true", help="log parameter types instead of values")
+    parser.add_argument("--slow-explain", action="store_true", help="add the plan of every slow statement")
+    parser.add_argument("--lock-wait-ms", type=float, help="snapshot pg_locks when a write waits this long")
+    parser.add_argument("--mem-profile", action="store_true", help="report memory peaks of every action (tracemalloc)")
+    parser.add_argument("--mem-top", type=int, default=5, help="allocation sites shown per step")
+    parser.add_argument("--mem-log", metavar="PATH", help="append the memory reports to this JSON-lines file")
+    args = parser.parse_args()
+
+    slow_log = None
+    if args.slow_log:
+        slow_log = SlowQueryLog(args.slow_log, args.slow_ms, args.slow_redact, args.slow_explain)
+
+    profiler = None
+    if args.mem_profile or args.mem_log:
+        profiler = MemoryProfiler(args.mem_top, path=args.mem_log).start()
+
+    controller = Controller(slow_log=slow_log, lock_wait_ms=args.lock_wait_ms, profiler=profiler)
+    controller.run()
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+
+class BomCache:
+    # Per-product (total quantity, total cost, lines) aggregates kept in an
+    # LRU of at most max_entries products. Writes apply deltas to entries
+    # that are already cached; anything else is loaded on first use.
+    def __init__(self, loader, max_entries=10_000):
+        self.loader = loader
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, product_id):
+        with self._lock:
+            if product_id in self._entries:
+                self._entries.move_to_end(product_id)
+                self.hits += 1
+                return self._entries[product_id]
+            self.misses += 1
+        totals = self.loader(product_id)
+        with self._lock:
+            self._entries[product_id] = totals
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return totals
+
+    def apply(self, product_id, qty_delta, cost_delta, lines_delta):
+        with self._lock:
+            if product_id not in self._entries:
+                return
+            qty, cost, lines = self._entries[product_id]
+            self._entries[product_id] = (qty + qty_delta, cost + cost_delta, lines + lines_delta)
+
+    def invalidate(self, *product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._entries.pop(product_id, None)
+
+    def on_change(self, event):
+        # change feed subscriber; invalidation is idempotent, so events caused
+        # by this process's own writes are harmless
+        if event.op.startswith("BULK_") or (event.table == "material" and event.op == "UPDATE"):
+            self.clear()
+        elif event.table == "product":
+            self.invalidate(event.id)
+        elif event.table == "consumation":
+            self.invalidate(*{row["product1_id"] for row in (event.old, event.new) if row})
+
+    def cached_ids(self):
+        with self._lock:
+            return list(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
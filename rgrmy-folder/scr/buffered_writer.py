@@ -0,0 +1,138 @@
+import io
+import queue
+import threading
+import time
+from collections import deque
+
+from .partitioning import ConsumationPartitions
+
+
+class ConsumationWriter:
+    # Write-behind queue for consumation rows. put() may be called from any
+    # thread; a single background thread flushes batches with COPY on its own
+    # connection once batch_size rows are queued or flush_interval has passed.
+    def __init__(self, connection, batch_size=5000, flush_interval=1.0, max_queue=100_000, on_flush=None):
+        self.connection = connection
+        self.on_flush = on_flush
+        self.partitions = ConsumationPartitions(connection)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # a bounded queue is the backpressure: put() blocks while it is full
+        self.queue = queue.Queue(maxsize=max_queue)
+
+        self.rows_written = 0
+        self.rows_failed = 0
+        # rows of failed flushes, kept for take_failed() so they can be put again
+        self.failed_rows = []
+        self._in_flight = 0
+        self.flushes = 0
+        self.flush_latencies = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        # put() calls that passed the closed check and may still be enqueuing;
+        # close() waits for them before the flush thread may stop
+        self._puts = 0
+        self._puts_done = threading.Condition(self._lock)
+        self._closed = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="consumation-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, product_id, material_id, qty, timeout=None):
+        row = (int(product_id), int(material_id), int(qty))
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("writer is closed")
+            self._puts += 1
+        try:
+            self.queue.put(row, timeout=timeout)
+        finally:
+            with self._lock:
+                self._puts -= 1
+                if not self._puts:
+                    self._puts_done.notify_all()
+
+    def _run(self):
+        while not self._stop.is_set() or not self.queue.empty():
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+                if self._stop.is_set() and self.queue.empty():
+                    break
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch):
+        buf = io.StringIO("".join(f"{p}\t{m}\t{q}\n" for p, m, q in batch))
+        t0 = time.time()
+        self._in_flight = len(batch)
+        cur = self.connection.cursor()
+        try:
+            self.partitions.ensure_capacity(len(batch))
+            cur.copy_expert(
+                'COPY "Consumation"(product1_id, material_id, quatity) FROM STDIN',
+                buf
+            )
+            self.connection.commit()
+            with self._lock:
+                self.rows_written += len(batch)
+            if self.on_flush:
+                self.on_flush({p for p, _, _ in batch})
+        except Exception as e:
+            print("\nWRITER FLUSH ERROR:", e)
+            self.connection.rollback()
+            with self._lock:
+                self.rows_failed += len(batch)
+                self.failed_rows.extend(batch)
+        finally:
+            cur.close()
+            self._in_flight = 0
+            with self._lock:
+                self.flushes += 1
+                self.flush_latencies.append((time.time() - t0) * 1000)
+
+    def take_failed(self):
+        # -> [(product_id, material_id, qty)] of every failed flush since the
+        # last call; the writer forgets them
+        with self._lock:
+            rows, self.failed_rows = self.failed_rows, []
+            return rows
+
+    def metrics(self):
+        with self._lock:
+            latencies = sorted(self.flush_latencies)
+            return {
+                "queue_depth": self.queue.qsize(),
+                "rows_written": self.rows_written,
+                "rows_failed": self.rows_failed,
+                "rows_failed_pending": len(self.failed_rows),
+                "flushes": self.flushes,
+                "flush_ms_avg": sum(latencies) / len(latencies) if latencies else 0.0,
+                "flush_ms_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+                "flush_ms_max": latencies[-1] if latencies else 0.0,
+            }
+
+    def close(self, timeout=None):
+        # stop accepting rows, flush whatever is still queued, then disconnect.
+        # If the flush thread outlives timeout the connection stays open for
+        # the COPY in flight and TimeoutError says how many rows are not
+        # written yet; close() can be called again to keep waiting.
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            self._closed = True
+            if not self._puts_done.wait_for(lambda: not self._puts, timeout):
+                raise TimeoutError(f"writer still accepting: {self._puts} put() calls waiting for queue space")
+        self._stop.set()
+        self._thread.join(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            raise TimeoutError(
+                f"writer still flushing: {self._in_flight + self.queue.qsize()} rows not written yet"
+            )
+        if self.connection and self.connection.closed == 0:
+            self.connection.close()
@@ -0,0 +1,158 @@
+import json
+import select
+import threading
+from collections import namedtuple
+
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+
+
+CHANGE_CHANNEL = "data_change"
+
+# Statements touching more rows than this publish one BULK_<op> event with a
+# row count instead of one notification per row.
+BULK_THRESHOLD = 1000
+
+# A counter per table that notify_change bumps with every write statement,
+# in the writer's transaction. The HTTP service reads it as the ETag of the
+# whole table. Only the small reference tables have a row: the UPDATE holds
+# the row lock until commit, which would serialize "Consumation" writers.
+TABLE_VERSION_SQL = """
+    CREATE TABLE table_version
+    (
+        name text PRIMARY KEY,
+        version bigint NOT NULL DEFAULT 0
+    );
+    INSERT INTO table_version(name) VALUES ('product'), ('material');
+"""
+
+NOTIFY_FUNCTION_SQL = f"""
+    CREATE OR REPLACE FUNCTION notify_change() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        n bigint;
+        r record;
+    BEGIN
+        UPDATE table_version SET version = version + 1 WHERE name = TG_ARGV[0];
+
+        IF TG_OP = 'DELETE' THEN
+            SELECT count(*) INTO n FROM old_rows;
+        ELSE
+            SELECT count(*) INTO n FROM new_rows;
+        END IF;
+
+        IF n > {BULK_THRESHOLD} THEN
+            PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                'table', TG_ARGV[0], 'op', 'BULK_' || TG_OP, 'count', n)::text);
+        ELSIF TG_OP = 'INSERT' THEN
+            FOR r IN SELECT row_to_json(t) AS j FROM new_rows t LOOP
+                PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                    'table', TG_ARGV[0], 'op', TG_OP, 'new', r.j)::text);
+            END LOOP;
+        ELSIF TG_OP = 'UPDATE' THEN
+            FOR r IN
+                SELECT row_to_json(o) AS o, row_to_json(nw) AS nw
+                FROM old_rows o JOIN new_rows nw USING (id)
+            LOOP
+                PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                    'table', TG_ARGV[0], 'op', TG_OP, 'old', r.o, 'new', r.nw)::text);
+            END LOOP;
+        ELSE
+            FOR r IN SELECT row_to_json(t) AS j FROM old_rows t LOOP
+                PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                    'table', TG_ARGV[0], 'op', TG_OP, 'old', r.j)::text);
+            END LOOP;
+        END IF;
+        RETURN NULL;
+    END
+    $$;
+"""
+
+WATCHED_TABLES = {
+    "product": '"Product"',
+    "material": "material",
+    "consumation": '"Consumation"',
+}
+
+
+def change_triggers_sql(name):
+    # statement-level triggers with transition tables also work on the
+    # partitioned "Consumation" and fire once per statement, not per row
+    table = WATCHED_TABLES[name]
+    return f"""
+        CREATE TRIGGER {name}_notify_insert AFTER INSERT ON {table}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_change('{name}');
+        CREATE TRIGGER {name}_notify_update AFTER UPDATE ON {table}
+            REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_change('{name}');
+        CREATE TRIGGER {name}_notify_delete AFTER DELETE ON {table}
+            REFERENCING OLD TABLE AS old_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_change('{name}');
+    """
+
+
+# op is INSERT/UPDATE/DELETE or BULK_<op>; new/old are column dicts
+# (None where not applicable) and count is only set for BULK events.
+ChangeEvent = namedtuple("ChangeEvent", "table op id new old count pid")
+
+
+def parse_event(payload, pid=None):
+    data = json.loads(payload)
+    new, old = data.get("new"), data.get("old")
+    row = new or old or {}
+    return ChangeEvent(
+        table=data["table"],
+        op=data["op"],
+        id=row.get("id"),
+        new=new,
+        old=old,
+        count=data.get("count", 1),
+        pid=pid,
+    )
+
+
+class ChangeFeed:
+    # LISTENs on its own autocommit connection and hands every change to the
+    # subscribed callbacks from a background thread.
+    def __init__(self, connection, channel=CHANGE_CHANNEL, poll_interval=1.0):
+        self.connection = connection
+        self.channel = channel
+        self.poll_interval = poll_interval
+        self.subscribers = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback, tables=None):
+        self.subscribers.append((callback, set(tables) if tables else None))
+
+    def start(self):
+        self.connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        with self.connection.cursor() as cur:
+            cur.execute(f"LISTEN {self.channel}")
+        self._thread = threading.Thread(target=self._run, name="change-feed", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            if select.select([self.connection], [], [], self.poll_interval) == ([], [], []):
+                continue
+            self.connection.poll()
+            while self.connection.notifies:
+                notify = self.connection.notifies.pop(0)
+                self._dispatch(parse_event(notify.payload, notify.pid))
+
+    def _dispatch(self, event):
+        for callback, tables in self.subscribers:
+            if tables is None or event.table in tables:
+                try:
+                    callback(event)
+                except Exception as e:
+                    print("\nCHANGE FEED ERROR:", e)
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        if self.connection and self.connection.closed == 0:
+            self.connection.close()
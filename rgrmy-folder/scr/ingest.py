@@ -0,0 +1,112 @@
+import argparse
+import csv
+
+from psycopg2 import connect
+
+
+# Columns that identify a row from outside the database; migration 4 makes
+# them unique once dedupe has merged the duplicates already there.
+NATURAL_KEYS = {
+    "product": ('"Product"', ("name",)),
+    "material": ("material", ("name", "unit")),
+}
+
+
+def dedupe_steps(kind):
+    # (map, repoint, delete): the lowest id of every natural key survives,
+    # consumations of the other ids are moved to it before those are deleted
+    table, key = NATURAL_KEYS[kind]
+    column = "product1_id" if kind == "product" else "material_id"
+    return (
+        f"""
+        CREATE TEMP TABLE dedupe_{kind} ON COMMIT DROP AS
+        SELECT id, keep FROM (
+            SELECT id, min(id) OVER (PARTITION BY {", ".join(key)}) AS keep FROM {table}
+        ) t
+        WHERE id <> keep
+        """,
+        f"""
+        UPDATE "Consumation" c SET {column} = d.keep
+        FROM dedupe_{kind} d
+        WHERE c.{column} = d.id
+        """,
+        f"DELETE FROM {table} t USING dedupe_{kind} d WHERE t.id = d.id",
+    )
+
+
+def dedupe_sql(kind):
+    return ";\n".join(dedupe_steps(kind)) + ";\n"
+
+
+def dedupe(connection, dry_run=False):
+    # -> {kind: (duplicates removed, consumations repointed)}
+    result = {}
+    cur = connection.cursor()
+    try:
+        # writers wait until the merge commits, readers carry on
+        cur.execute('LOCK TABLE "Product", material, "Consumation" IN SHARE ROW EXCLUSIVE MODE')
+        for kind in NATURAL_KEYS:
+            map_sql, repoint_sql, delete_sql = dedupe_steps(kind)
+            cur.execute(map_sql)
+            cur.execute(repoint_sql)
+            repointed = cur.rowcount
+            cur.execute(delete_sql)
+            result[kind] = (cur.rowcount, repointed)
+        if dry_run:
+            connection.rollback()
+        else:
+            connection.commit()
+        return result
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        cur.close()
+
+
+def read_csv(path, columns):
+    with open(path, newline="", encoding="utf-8") as f:
+        for record in csv.DictReader(f):
+            yield tuple(record[column] for column in columns)
+
+
+def main(argv=None):
+    from .model import DB_CONFIG, Model
+
+    parser = argparse.ArgumentParser(prog="python -m scr.ingest")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for kind, columns in (("products", "name,description"), ("materials", "name,price_per_unit,unit")):
+        upsert = sub.add_parser(kind, help=f"upsert {kind} from a CSV file with columns {columns}")
+        upsert.add_argument("path")
+        upsert.add_argument("--batch", type=int, default=1000, help="rows per statement")
+        upsert.add_argument("--keep-existing", action="store_true",
+                            help="skip rows whose natural key exists instead of updating them")
+    merge = sub.add_parser("dedupe", help="merge duplicate products/materials, repointing consumations")
+    merge.add_argument("--dry-run", action="store_true", help="report what would be merged, change nothing")
+    args = parser.parse_args(argv)
+
+    if args.command == "dedupe":
+        connection = connect(**DB_CONFIG)
+        try:
+            for kind, (removed, repointed) in dedupe(connection, args.dry_run).items():
+                verb = "would merge" if args.dry_run else "merged"
+                print(f"[DEDUPE] {kind}: {verb} {removed} duplicates, {repointed} consumations repointed")
+        finally:
+            connection.close()
+        return
+
+    model = Model()
+    try:
+        if args.command == "products":
+            rows = read_csv(args.path, ("name", "description"))
+            inserted, updated, unchanged = model.upsert_products(rows, not args.keep_existing, args.batch)
+        else:
+            rows = read_csv(args.path, ("name", "price_per_unit", "unit"))
+            inserted, updated, unchanged = model.upsert_materials(rows, not args.keep_existing, args.batch)
+        print(f"[INGEST] inserted={inserted} updated={updated} unchanged={unchanged}")
+    finally:
+        model.disconnect()
+
+
+if __name__ == "__main__":
+    main()
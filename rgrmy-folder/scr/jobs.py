@@ -0,0 +1,136 @@
+import itertools
+import threading
+import time
+
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, job_id, name, action, result_table=None):
+        self.id = job_id
+        self.name = name
+        self.action = action
+        # View.table_headers key for row results, None for counts
+        self.result_table = result_table
+        self.status = self.QUEUED
+        self.done = 0
+        self.total = None
+        self.result = None
+        self.error = None
+        self.started = None
+        self.finished = None
+        self.seen = False
+        self.cancel_requested = False
+        self.model = None
+
+    def progress(self, done, total=None):
+        self.done = done
+        self.total = total
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def active(self):
+        return self.status in (self.QUEUED, self.RUNNING)
+
+
+class JobManager:
+    # Each job runs action(model, progress) on its own thread with its own
+    # Model, so its connection and transaction never mix with the menu's.
+    # progress(done, total) may be called with total=None when the row count
+    # is not known in advance.
+    def __init__(self, model_factory, on_finish=None):
+        self.model_factory = model_factory
+        self.on_finish = on_finish
+        self.jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, name, action, result_table=None):
+        job = Job(next(self._ids), name, action, result_table)
+        with self._lock:
+            self.jobs[job.id] = job
+        threading.Thread(target=self._run, args=(job,), name=f"job-{job.id}", daemon=True).start()
+        return job
+
+    def _run(self, job):
+        job.started = time.time()
+        try:
+            job.model = self.model_factory()
+            job.model.verbose = False
+            if job.cancel_requested:
+                job.model.cancel()
+            job.status = Job.RUNNING
+            job.result = job.action(job.model, job.progress)
+            if job.model.cancelled:
+                job.status = Job.CANCELLED
+            elif job.model.last_error is not None:
+                job.status = Job.FAILED
+                job.error = job.model.last_error
+            else:
+                job.status = Job.DONE
+        except Exception as e:
+            job.status = Job.FAILED
+            job.error = e
+        finally:
+            job.finished = time.time()
+            if job.model is not None:
+                job.model.disconnect()
+            if self.on_finish:
+                self.on_finish(job)
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise ValueError(f"No job #{job_id}")
+        return job
+
+    def list(self):
+        with self._lock:
+            return sorted(self.jobs.values(), key=lambda job: job.id)
+
+    def unseen_finished(self):
+        finished = [job for job in self.list() if not job.active and not job.seen]
+        for job in finished:
+            job.seen = True
+        return finished
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        job.cancel_requested = True
+        if job.active and job.model is not None:
+            job.model.cancel()
+        return job
+
+    def take_result(self, job_id):
+        # the result is handed out once, so big row sets do not pile up
+        job = self.get(job_id)
+        if job.active:
+            raise ValueError(f"Job #{job_id} is still {job.status}")
+        with self._lock:
+            self.jobs.pop(job_id)
+        return job
+
+    def close(self):
+        for job in self.list():
+            if job.active:
+                self.cancel(job.id)
+
+
+def collect_rows(rows, progress, every=1000):
+    # drains a Model.*_iter generator, reporting the rows fetched so far
+    result = []
+    for row in rows:
+        result.append(row)
+        if len(result) % every == 0:
+            progress(len(result))
+    progress(len(result), len(result))
+    return result
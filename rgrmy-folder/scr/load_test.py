@@ -0,0 +1,256 @@
+import argparse
+import random
+import string
+import threading
+import time
+from collections import defaultdict
+from multiprocessing import Pool
+
+from psycopg2 import connect
+from tabulate import tabulate
+
+from .model import DB_CONFIG, Model
+
+
+DEFAULT_MIX = {"create": 10, "read": 10, "update": 20, "delete": 5, "search": 55}
+
+
+def parse_mix(text):
+    # "create=10,read=10,search=80"
+    mix = {}
+    for part in text.split(","):
+        op, weight = part.split("=")
+        if op not in DEFAULT_MIX:
+            raise ValueError(f"Unknown operation {op}")
+        mix[op] = float(weight)
+    return mix
+
+
+def parse_ramp(text):
+    # "0:5,30:20,60:50" -> 5 users from t=0s, 20 from t=30s, 50 from t=60s
+    steps = []
+    for part in text.split(","):
+        at, users = part.split(":")
+        steps.append((float(at), int(users)))
+    return sorted(steps)
+
+
+class VirtualUser(threading.Thread):
+    def __init__(self, run, bounds, stop):
+        super().__init__(daemon=True)
+        self.run_state = run
+        self.bounds = bounds
+        self.stop = stop
+        self.model = Model()
+        self.model.verbose = False
+        self.pid = self.model.connection.get_backend_pid()
+        self.ops = list(run.mix)
+        self.weights = [run.mix[op] for op in self.ops]
+
+    def _random_id(self, table):
+        lo, hi = self.bounds[table]
+        return random.randint(lo, hi)
+
+    def _execute(self, op):
+        model = self.model
+        if op == "create":
+            return model.create_consumation(
+                self._random_id("product"), self._random_id("material"), random.randint(1, 20)
+            )
+        if op == "read":
+            return model.read(self.run_state.read_table)
+        if op == "update":
+            return model.update_field(
+                "consumation", self._random_id("consumation"), "quatity", random.randint(1, 20)
+            )
+        if op == "delete":
+            return model.delete("consumation", self._random_id("consumation"))
+        return model.search_consumation(random.choice(string.ascii_uppercase), "")
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                op = random.choices(self.ops, self.weights)[0]
+                self.model.last_error = None
+                self.run_state.current_op[self.pid] = op
+                t0 = time.time()
+                try:
+                    self._execute(op)
+                except Exception as e:
+                    self.model.last_error = e
+                ms = (time.time() - t0) * 1000
+                self.run_state.current_op.pop(self.pid, None)
+                self.run_state.record(op, ms, self.model.last_error)
+        finally:
+            self.model.disconnect()
+
+
+class LoadRun:
+    def __init__(self, mix, ramp, duration, read_table="material", sample_interval=0.5):
+        self.mix = mix
+        self.ramp = ramp
+        self.duration = duration
+        self.read_table = read_table
+        self.sample_interval = sample_interval
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.error_types = defaultdict(int)
+        self.lock_wait_samples = defaultdict(int)
+        self.current_op = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, ms, error):
+        with self._lock:
+            self.latencies[op].append(ms)
+            if error is not None:
+                self.errors[op] += 1
+                self.error_types[type(error).__name__] += 1
+
+    def _bounds(self):
+        connection = connect(**DB_CONFIG)
+        try:
+            bounds = {}
+            with connection.cursor() as cur:
+                for name, table in (("product", '"Product"'), ("material", "material"),
+                                    ("consumation", '"Consumation"')):
+                    cur.execute(f"SELECT coalesce(min(id), 1), coalesce(max(id), 1) FROM {table}")
+                    bounds[name] = cur.fetchone()
+            return bounds
+        finally:
+            connection.close()
+
+    def _monitor(self, stop):
+        # samples which of our backends are waiting on a lock right now;
+        # samples * interval approximates the lock wait time per operation
+        connection = connect(**DB_CONFIG)
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cur:
+                while not stop.wait(self.sample_interval):
+                    pids = list(self.current_op.copy())
+                    if not pids:
+                        continue
+                    cur.execute("""
+                        SELECT pid FROM pg_stat_activity
+                        WHERE wait_event_type = 'Lock' AND pid = ANY(%s)
+                    """, (pids,))
+                    for (pid,) in cur.fetchall():
+                        op = self.current_op.get(pid)
+                        if op:
+                            with self._lock:
+                                self.lock_wait_samples[op] += 1
+        finally:
+            connection.close()
+
+    def execute(self):
+        bounds = self._bounds()
+        stop = threading.Event()
+        monitor = threading.Thread(target=self._monitor, args=(stop,), daemon=True)
+        monitor.start()
+        users = []
+        t_start = time.time()
+        for at, target in self.ramp:
+            delay = t_start + at - time.time()
+            if delay > 0 and stop.wait(delay):
+                break
+            while len(users) < target:
+                user = VirtualUser(self, bounds, stop)
+                user.start()
+                users.append(user)
+            print(f"[LOAD] t={time.time() - t_start:6.1f}s  users={len(users)}")
+        remaining = t_start + self.duration - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        stop.set()
+        for user in users:
+            user.join()
+        monitor.join()
+        self.elapsed = time.time() - t_start
+        return self
+
+    def result(self):
+        return {
+            "elapsed": self.elapsed,
+            "latencies": dict(self.latencies),
+            "errors": dict(self.errors),
+            "error_types": dict(self.error_types),
+            "lock_wait_samples": dict(self.lock_wait_samples),
+            "sample_interval": self.sample_interval,
+        }
+
+
+def _run_process(args):
+    mix, ramp, duration, read_table = args
+    return LoadRun(mix, ramp, duration, read_table).execute().result()
+
+
+def merge_results(results):
+    merged = {
+        "elapsed": max(r["elapsed"] for r in results),
+        "latencies": defaultdict(list),
+        "errors": defaultdict(int),
+        "error_types": defaultdict(int),
+        "lock_wait_samples": defaultdict(int),
+        "sample_interval": results[0]["sample_interval"],
+    }
+    for r in results:
+        for op, values in r["latencies"].items():
+            merged["latencies"][op].extend(values)
+        for key in ("errors", "error_types", "lock_wait_samples"):
+            for op, value in r[key].items():
+                merged[key][op] += value
+    return merged
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+def report(result):
+    rows = []
+    for op, values in sorted(result["latencies"].items()):
+        values = sorted(values)
+        errors = result["errors"].get(op, 0)
+        rows.append([
+            op,
+            len(values),
+            f"{len(values) / result['elapsed']:.1f}",
+            f"{percentile(values, 50):.2f}",
+            f"{percentile(values, 95):.2f}",
+            f"{percentile(values, 99):.2f}",
+            f"{100 * errors / len(values):.2f}%",
+            f"{result['lock_wait_samples'].get(op, 0) * result['sample_interval']:.1f}",
+        ])
+    print(tabulate(rows, headers=("op", "count", "ops/s", "p50 ms", "p95 ms", "p99 ms", "errors", "lock wait s")))
+    if result["error_types"]:
+        print("\n[LOAD] Errors by type: " + ", ".join(f"{k}={v}" for k, v in result["error_types"].items()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.load_test")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX,
+                        help="operation weights, e.g. create=10,read=10,update=20,delete=5,search=55")
+    parser.add_argument("--ramp", type=parse_ramp, default=[(0, 10)],
+                        help="ramp-up schedule seconds:users, e.g. 0:5,30:20,60:50")
+    parser.add_argument("--duration", type=float, default=60, help="total run time in seconds")
+    parser.add_argument("--processes", type=int, default=1,
+                        help="split the users across this many processes")
+    parser.add_argument("--read-table", default="material", choices=("product", "material", "consumation"))
+    args = parser.parse_args(argv)
+
+    if args.processes == 1:
+        result = LoadRun(args.mix, args.ramp, args.duration, args.read_table).execute().result()
+    else:
+        ramp = [(at, max(1, users // args.processes)) for at, users in args.ramp]
+        with Pool(args.processes) as pool:
+            result = merge_results(pool.map(
+                _run_process,
+                [(args.mix, ramp, args.duration, args.read_table)] * args.processes
+            ))
+    report(result)
+
+
+if __name__ == "__main__":
+    main()
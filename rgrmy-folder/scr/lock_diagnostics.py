@@ -0,0 +1,165 @@
+import argparse
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from psycopg2 import connect
+from tabulate import tabulate
+
+
+# SQLSTATE -> kind of concurrency failure
+ERROR_KINDS = {
+    "40P01": "deadlock",
+    "40001": "serialization",
+    "55P03": "lock_timeout",
+    "57014": "query_canceled",
+}
+
+# A single-statement transaction that failed with one of these was rolled back
+# completely, so running it again is safe.
+RETRYABLE = {"deadlock", "serialization", "lock_timeout"}
+
+WAITERS_SQL = """
+    SELECT
+        a.pid,
+        pg_blocking_pids(a.pid) AS blocked_by,
+        a.wait_event_type,
+        a.wait_event,
+        round(extract(epoch FROM now() - a.query_start) * 1000) AS waiting_ms,
+        a.state,
+        left(a.query, 200) AS query
+    FROM pg_stat_activity a
+    WHERE a.pid = ANY(%s) OR a.pid = ANY(
+        SELECT unnest(pg_blocking_pids(p)) FROM unnest(%s::int[]) p
+    )
+"""
+
+ALL_WAITERS_SQL = """
+    SELECT
+        a.pid,
+        pg_blocking_pids(a.pid) AS blocked_by,
+        a.wait_event_type,
+        a.wait_event,
+        round(extract(epoch FROM now() - a.query_start) * 1000) AS waiting_ms,
+        a.state,
+        left(a.query, 200) AS query
+    FROM pg_stat_activity a
+    WHERE a.datname = current_database()
+      AND (a.wait_event_type = 'Lock' OR a.pid IN (
+          SELECT unnest(pg_blocking_pids(pid)) FROM pg_stat_activity
+      ))
+"""
+
+LOCKS_SQL = """
+    SELECT pid, locktype, relation::regclass::text, mode, granted
+    FROM pg_locks
+    WHERE pid = ANY(%s)
+    ORDER BY pid, granted DESC
+"""
+
+
+def classify(error):
+    return ERROR_KINDS.get(getattr(error, "pgcode", None))
+
+
+def is_retryable(error):
+    return classify(error) in RETRYABLE
+
+
+def snapshot(connection, pids=None):
+    with connection.cursor() as cur:
+        if pids:
+            cur.execute(WAITERS_SQL, (pids, pids))
+        else:
+            cur.execute(ALL_WAITERS_SQL)
+        activity = cur.fetchall()
+        involved = sorted({row[0] for row in activity} | {p for row in activity for p in row[1]})
+        cur.execute(LOCKS_SQL, (involved,))
+        locks = cur.fetchall()
+    return {
+        "ts": datetime.now(timezone.utc).isoformat(),
+        "activity": activity,
+        "locks": locks,
+    }
+
+
+class LockWatchdog:
+    # watch(pid) arms a timer around one statement; if the statement is still
+    # running after threshold_ms, pg_stat_activity / pg_locks for the backend
+    # and whoever blocks it are captured on a separate connection.
+    def __init__(self, connection_factory, threshold_ms=1000, keep=50, verbose=True):
+        self.connection_factory = connection_factory
+        self.threshold_ms = threshold_ms
+        self.verbose = verbose
+        self.snapshots = deque(maxlen=keep)
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _capture(self, pid):
+        with self._lock:
+            try:
+                if self._connection is None or self._connection.closed:
+                    self._connection = self.connection_factory()
+                    self._connection.autocommit = True
+                snap = snapshot(self._connection, [pid])
+            except Exception as e:
+                print("\nLOCK SNAPSHOT ERROR:", e)
+                return
+            self.snapshots.append(snap)
+        if self.verbose:
+            waiting = [row for row in snap["activity"] if row[0] == pid and row[1]]
+            if waiting:
+                print(f"\n[LOCK] backend {pid} waiting > {self.threshold_ms} ms, blocked by {waiting[0][1]}")
+
+    @contextmanager
+    def watch(self, pid):
+        timer = threading.Timer(self.threshold_ms / 1000, self._capture, args=(pid,))
+        timer.daemon = True
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+
+    def close(self):
+        with self._lock:
+            if self._connection and self._connection.closed == 0:
+                self._connection.close()
+
+
+def backoff_delays(retries, base=0.05, cap=2.0):
+    # full jitter keeps two retrying deadlock victims from colliding again
+    for attempt in range(retries):
+        yield random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def main(argv=None):
+    from .model import DB_CONFIG
+
+    parser = argparse.ArgumentParser(prog="python -m scr.lock_diagnostics")
+    parser.add_argument("--watch", type=float, default=0,
+                        help="repeat every N seconds instead of printing once")
+    args = parser.parse_args(argv)
+
+    connection = connect(**DB_CONFIG)
+    connection.autocommit = True
+    try:
+        while True:
+            snap = snapshot(connection)
+            print(f"\n[LOCK] {snap['ts']}")
+            print(tabulate(snap["activity"],
+                           headers=("pid", "blocked_by", "wait_type", "wait_event", "ms", "state", "query")))
+            print()
+            print(tabulate(snap["locks"], headers=("pid", "locktype", "relation", "mode", "granted")))
+            if not args.watch:
+                break
+            time.sleep(args.watch)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import argparse
+import json
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+from tabulate import tabulate
+
+
+class MemoryProfiler:
+    # operation() wraps one Controller action, step() the parts inside it
+    # (query fetch, row conversion, tabulate). Each reports the peak traced
+    # memory above where it started, what it still holds at the end and the
+    # source lines that allocated most. Reports are printed and, with path,
+    # appended as JSON lines for comparing benchmark runs. The operation
+    # figures include the snapshots its steps hold; step figures do not.
+    # tracemalloc counts the whole process and cannot tell threads apart, so
+    # a background job or writer running meanwhile adds its allocations;
+    # every report lists the threads seen alive in "other_threads".
+    def __init__(self, top=5, frames=1, path=None, verbose=True):
+        self.top = top
+        self.frames = frames
+        self.path = path
+        self.verbose = verbose
+        self._operation = None
+        self._filters = (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        )
+
+    def start(self):
+        tracemalloc.start(self.frames)
+        return self
+
+    def stop(self):
+        tracemalloc.stop()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(self._filters)
+
+    @staticmethod
+    def _other_threads():
+        # besides the measured one; the main thread only waits on it
+        skip = (threading.current_thread(), threading.main_thread())
+        return {thread.name for thread in threading.enumerate() if thread not in skip}
+
+    def _top_sites(self, before, after):
+        sites = []
+        for stat in after.compare_to(before, "lineno")[:self.top]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            sites.append((f"{os.path.relpath(frame.filename)}:{frame.lineno}", stat.size_diff, stat.count_diff))
+        return sites
+
+    def _note_peak(self):
+        # reset_peak() is global, so the running operation keeps the highest
+        # peak seen before any step reset it
+        if self._operation is not None:
+            self._operation["peak"] = max(self._operation["peak"], tracemalloc.get_traced_memory()[1])
+
+    @contextmanager
+    def _measure(self, name):
+        # the snapshots are traced too: the peak is reset after taking one,
+        # and start already includes the one held while measuring
+        self._note_peak()
+        before = self._snapshot()
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        result = {"name": name}
+        # sampled at both ends: a thread that started and ended in between
+        # is missed
+        others = self._other_threads()
+        try:
+            yield result
+        finally:
+            current, peak = tracemalloc.get_traced_memory()
+            self._note_peak()
+            result["peak_bytes"] = max(peak, result.pop("peak", 0)) - start
+            result["retained_bytes"] = current - start
+            result["other_threads"] = sorted(others | self._other_threads())
+            result["top"] = self._top_sites(before, self._snapshot())
+            del before
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def operation(self, name):
+        if not tracemalloc.is_tracing():
+            yield
+            return
+        with self._measure(name) as result:
+            result["steps"] = []
+            result["peak"] = 0
+            self._operation = result
+            try:
+                yield
+            finally:
+                self._operation = None
+        self._report(result)
+
+    def step(self, name):
+        if not tracemalloc.is_tracing() or self._operation is None:
+            return nullcontext()
+        return self._step(name)
+
+    @contextmanager
+    def _step(self, name):
+        operation = self._operation
+        with self._measure(name) as result:
+            yield
+        operation["steps"].append(result)
+
+    def _report(self, result):
+        if self.path:
+            entry = {"ts": datetime.now(timezone.utc).isoformat(), **result}
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        if not self.verbose:
+            return
+        print(f"\n[MEM] {result['name']}: peak {_kb(result['peak_bytes'])}, "
+              f"retained {_kb(result['retained_bytes'])}")
+        if result["other_threads"]:
+            print(f"[MEM]   includes allocations of {', '.join(result['other_threads'])}")
+        for step in result["steps"]:
+            print(f"[MEM]   {step['name']:<14} peak {_kb(step['peak_bytes'])}, "
+                  f"retained {_kb(step['retained_bytes'])}")
+            for site, size, count in step["top"]:
+                print(f"[MEM]       {_kb(size):>12} in {count:>8} blocks  {site}")
+
+
+def _kb(size):
+    return f"{size / 1024:,.1f} KiB"
+
+
+def summarize(path):
+    # worst peak per operation and step over all logged runs, and how many
+    # of the runs shared the process with other threads
+    worst = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            for name, peak, others in [(entry["name"], entry["peak_bytes"], entry.get("other_threads"))] + [
+                (f"{entry['name']} / {step['name']}", step["peak_bytes"], step.get("other_threads"))
+                for step in entry["steps"]
+            ]:
+                count, best, shared = worst.get(name, (0, 0, 0))
+                worst[name] = (count + 1, max(best, peak), shared + bool(others))
+    return sorted(((name, count, peak, shared) for name, (count, peak, shared) in worst.items()),
+                  key=lambda row: row[2], reverse=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.mem_profile")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="rank logged operations by peak memory")
+    summary.add_argument("path", nargs="?", default="memory.jsonl")
+    args = parser.parse_args(argv)
+
+    print(tabulate(
+        [[name, count, _kb(peak), shared] for name, count, peak, shared in summarize(args.path)],
+        headers=("operation / step", "runs", "max peak", "runs with other threads")
+    ))
+
+
+if __name__ == "__main__":
+    main()
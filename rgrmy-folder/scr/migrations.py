@@ -0,0 +1,226 @@
+import argparse
+
+from psycopg2 import Error, connect
+
+from .change_feed import NOTIFY_FUNCTION_SQL, TABLE_VERSION_SQL, change_triggers_sql
+from .retention import ARCHIVE_TABLES_SQL
+from .model import DB_CONFIG
+
+
+# Databases created from awda.sql already have the three tables, with plain
+# integer ids, an unused consumation_id column and fewer constraints. Version 1
+# adopts them: the ids get an identity that continues after the highest id and
+# the missing constraints are added NOT VALID, so existing rows are kept.
+ADOPT_EXISTING_SQL = """
+    DO $$
+    DECLARE
+        t text;
+        c record;
+    BEGIN
+        FOREACH t IN ARRAY ARRAY['"Product"', 'material', '"Consumation"'] LOOP
+            IF EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = t::regclass AND attname = 'id' AND attidentity = '' AND NOT atthasdef
+            ) THEN
+                EXECUTE format('ALTER TABLE %s ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY', t);
+                EXECUTE format(
+                    'SELECT setval(pg_get_serial_sequence(%L, ''id''), coalesce(max(id), 0) + 1, false) FROM %s',
+                    t, t
+                );
+                IF t <> '"Product"' THEN
+                    EXECUTE format('ALTER TABLE %s SET (fillfactor = 90)', t);
+                END IF;
+            END IF;
+        END LOOP;
+
+        -- the app never writes consumation_id, material_id holds the material
+        IF EXISTS (
+            SELECT 1 FROM pg_attribute
+            WHERE attrelid = '"Consumation"'::regclass AND attname = 'consumation_id' AND NOT attisdropped
+        ) THEN
+            ALTER TABLE "Consumation" ALTER COLUMN consumation_id DROP NOT NULL;
+        END IF;
+
+        FOR c IN
+            SELECT * FROM (VALUES
+                ('"Consumation"', 'FOREIGN KEY (product1_id)%', 'FOREIGN KEY (product1_id) REFERENCES "Product" (id)'),
+                ('"Consumation"', 'FOREIGN KEY (material_id)%', 'FOREIGN KEY (material_id) REFERENCES material (id)'),
+                ('"Consumation"', 'CHECK ((quatity > 0))', 'CHECK (quatity > 0)'),
+                ('material', 'CHECK ((price_per_unit > 0))', 'CHECK (price_per_unit > 0)')
+            ) v(tbl, pattern, definition)
+        LOOP
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_constraint
+                WHERE conrelid = c.tbl::regclass AND pg_get_constraintdef(oid) LIKE c.pattern
+            ) THEN
+                EXECUTE format('ALTER TABLE %s ADD %s NOT VALID', c.tbl, c.definition);
+            END IF;
+        END LOOP;
+    END $$;
+"""
+
+# Every entry is (version, name, sql). Versions are applied in order, each in
+# its own transaction together with the schema_version row that records it.
+MIGRATIONS = [
+    (1, "base tables", """
+        CREATE TABLE IF NOT EXISTS "Product"
+        (
+            id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            name character varying(50) NOT NULL,
+            description character varying(100) NOT NULL
+        );
+
+        CREATE TABLE IF NOT EXISTS material
+        (
+            id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            name character varying(50) NOT NULL,
+            price_per_unit integer NOT NULL CHECK (price_per_unit > 0),
+            unit character varying(20) NOT NULL
+        ) WITH (fillfactor = 90);
+
+        -- quatity is the column update_field touches most, leave room for HOT updates
+        CREATE TABLE IF NOT EXISTS "Consumation"
+        (
+            id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            product1_id integer NOT NULL REFERENCES "Product" (id),
+            material_id integer NOT NULL REFERENCES material (id),
+            quatity integer NOT NULL CHECK (quatity > 0)
+        ) WITH (fillfactor = 90);
+    """ + ADOPT_EXISTING_SQL),
+    # product_bom / material_where_used (which also return c.id) and the BOM
+    # totals read only these columns, so both lookups can be index-only scans;
+    # they also serve the foreign keys
+    (2, "covering bom and where-used indexes", """
+        CREATE INDEX IF NOT EXISTS consumation_product_bom_idx ON "Consumation" (product1_id) INCLUDE (id, material_id, quatity);
+        CREATE INDEX IF NOT EXISTS consumation_material_used_idx ON "Consumation" (material_id) INCLUDE (id, product1_id, quatity);
+    """),
+    (3, "change notification triggers",
+        TABLE_VERSION_SQL
+        + NOTIFY_FUNCTION_SQL
+        + change_triggers_sql("product")
+        + change_triggers_sql("material")
+        + change_triggers_sql("consumation")),
+    # merging duplicates deletes rows, so it is left to the user; until they
+    # are gone the migration stops and says how to review and merge them
+    (4, "unique natural keys", """
+        LOCK TABLE "Product", material IN SHARE ROW EXCLUSIVE MODE;
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM "Product" GROUP BY name HAVING count(*) > 1)
+               OR EXISTS (SELECT 1 FROM material GROUP BY name, unit HAVING count(*) > 1) THEN
+                RAISE EXCEPTION 'Duplicate product names or material (name, unit) pairs exist'
+                    USING HINT = 'Review them with python -m scr.ingest dedupe --dry-run, merge them with '
+                        'python -m scr.ingest dedupe, then run upgrade again';
+            END IF;
+        END $$;
+
+        -- upserts (ON CONFLICT) and generators rely on these
+        ALTER TABLE "Product" ADD CONSTRAINT product_name_key UNIQUE (name);
+        ALTER TABLE material ADD CONSTRAINT material_name_unit_key UNIQUE (name, unit);
+    """),
+    (5, "consumation archive", ARCHIVE_TABLES_SQL),
+]
+
+MIGRATION_LOCK_ID = 20260026
+
+
+class Migrator:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _ensure_version_table(self):
+        with self.connection.cursor() as cur:
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version
+                (
+                    version integer PRIMARY KEY,
+                    name text NOT NULL,
+                    applied_at timestamptz NOT NULL DEFAULT now()
+                )
+            """)
+        self.connection.commit()
+
+    def current_version(self):
+        self._ensure_version_table()
+        with self.connection.cursor() as cur:
+            cur.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+            version = cur.fetchone()[0]
+        self.connection.commit()
+        return version
+
+    def pending(self, target=None):
+        current = self.current_version()
+        return [
+            m for m in MIGRATIONS
+            if m[0] > current and (target is None or m[0] <= target)
+        ]
+
+    def upgrade(self, target=None):
+        applied = []
+        for version, name, sql in self.pending(target):
+            cur = self.connection.cursor()
+            try:
+                # serialize concurrent migrators on the same database
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+                cur.execute("SELECT 1 FROM schema_version WHERE version = %s", (version,))
+                if cur.fetchone() is None:
+                    cur.execute(sql)
+                    cur.execute(
+                        "INSERT INTO schema_version(version, name) VALUES (%s, %s)",
+                        (version, name)
+                    )
+                    applied.append(version)
+                self.connection.commit()
+            except Exception:
+                self.connection.rollback()
+                raise
+            finally:
+                cur.close()
+        return applied
+
+    def status(self):
+        self._ensure_version_table()
+        with self.connection.cursor() as cur:
+            cur.execute("SELECT version, name, applied_at FROM schema_version ORDER BY version")
+            rows = cur.fetchall()
+        self.connection.commit()
+        return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.migrations")
+    parser.add_argument("--database", help="migrate this database instead of the one in DB_CONFIG")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="show applied and pending migrations")
+    upgrade = sub.add_parser("upgrade", help="apply pending migrations")
+    upgrade.add_argument("--to", type=int, default=None, help="stop at this version")
+    args = parser.parse_args(argv)
+
+    config = {**DB_CONFIG, "database": args.database} if args.database else DB_CONFIG
+    connection = connect(**config)
+    try:
+        migrator = Migrator(connection)
+        if args.command == "status":
+            for version, name, applied_at in migrator.status():
+                print(f"[APPLIED] {version:>4}  {name}  ({applied_at:%Y-%m-%d %H:%M:%S})")
+            for version, name, _ in migrator.pending():
+                print(f"[PENDING] {version:>4}  {name}")
+        else:
+            try:
+                applied = migrator.upgrade(args.to)
+            except Error as e:
+                hint = getattr(e.diag, "message_hint", None)
+                print(f"[MIGRATE] Stopped: {e.diag.message_primary or e}" + (f"\n[MIGRATE] {hint}" if hint else ""))
+                print(f"[MIGRATE] Current version: {migrator.current_version()}")
+                return
+            if applied:
+                print(f"[MIGRATE] Applied versions: {', '.join(map(str, applied))}")
+            else:
+                print("[MIGRATE] Schema is up to date")
+            print(f"[MIGRATE] Current version: {migrator.current_version()}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,206 +1,1187 @@
-from psycopg2 import connect
-import time
-
-
-class Model:
-    def __init__(self):
-        self.connection = connect(
-            database="postgres",
-            user="postgres",
-            password="1234",
-            host="localhost",
-            port="5432",
-        )
-
-        # ---------- INSERT ----------
-        self.insert_queries = {
-            "product": 'INSERT INTO "Product"(name, description) VALUES (%s, %s)',
-            "material": 'INSERT INTO material(name, price_per_unit, unit) VALUES (%s, %s, %s)',
-            "consumation": 'INSERT INTO "Consumation"(product1_id, material_id, quatity) VALUES (%s, %s, %s)',
-        }
-
-        # ---------- READ ----------
-        self.read_queries = {
-            "product": 'SELECT id, name, description FROM "Product"',
-            "material": 'SELECT id, name, price_per_unit, unit FROM material',
-            "consumation": """
-                SELECT
-                    c.id,
-                    p.name AS product,
-                    m.name AS material,
-                    c.quatity
-                FROM "Consumation" c
-                JOIN "Product" p ON c.product1_id = p.id
-                JOIN material m ON c.material_id = m.id
-                ORDER BY c.id
-            """
-        }
-
-        # ---------- DELETE ----------
-        self.delete_queries = {
-            "product": 'DELETE FROM "Product" WHERE id = %s',
-            "material": 'DELETE FROM material WHERE id = %s',
-            "consumation": 'DELETE FROM "Consumation" WHERE id = %s',
-        }
-
-        # ---------- UPDATE ----------
-        self.update_queries = {
-            "product": {
-                "name": 'UPDATE "Product" SET name = %s WHERE id = %s',
-                "description": 'UPDATE "Product" SET description = %s WHERE id = %s',
-            },
-            "material": {
-                "name": 'UPDATE material SET name = %s WHERE id = %s',
-                "price_per_unit": 'UPDATE material SET price_per_unit = %s WHERE id = %s',
-                "unit": 'UPDATE material SET unit = %s WHERE id = %s',
-            },
-            "consumation": {
-                "product1_id": 'UPDATE "Consumation" SET product1_id = %s WHERE id = %s',
-                "material_id": 'UPDATE "Consumation" SET material_id = %s WHERE id = %s',
-                "quatity": 'UPDATE "Consumation" SET quatity = %s WHERE id = %s',
-            },
-        }
-
-    # ==================== BASIC ====================
-
-    def disconnect(self):
-        if self.connection and self.connection.closed == 0:
-            self.connection.close()
-
-    def _execute_select(self, query, data=None):
-        cur = self.connection.cursor()
-        try:
-            cur.execute(query, data or ())
-            rows = cur.fetchall()
-            return rows
-        except Exception as e:
-            print("\nSELECT ERROR:", e)
-            self.connection.rollback()
-            return []
-        finally:
-            cur.close()
-
-    def _execute_modify(self, query, data):
-        cur = self.connection.cursor()
-        try:
-            cur.execute(query, data)
-            self.connection.commit()
-            return cur.rowcount
-        except Exception as e:
-            print("\nMODIFY ERROR:", e)
-            self.connection.rollback()
-            return 0
-        finally:
-            cur.close()
-
-    # ==================== CREATE ====================
-
-    def create_product(self, name, description):
-        return self._execute_modify(self.insert_queries["product"], (name, description))
-
-    def create_material(self, name, ppu, unit):
-        return self._execute_modify(self.insert_queries["material"], (name, ppu, unit))
-
-    def create_consumation(self, product_id, material_id, qty):
-        return self._execute_modify(
-            self.insert_queries["consumation"],
-            (product_id, material_id, qty)
-        )
-
-    # ==================== READ ====================
-
-    def read(self, table):
-        return self._execute_select(self.read_queries[table])
-
-    # ==================== UPDATE ====================
-
-    def update_field(self, table, record_id, field, value):
-        query = self.update_queries[table].get(field)
-        if not query:
-            raise ValueError(f"Unknown field {field} for table {table}")
-        return self._execute_modify(query, (value, record_id))
-
-    # ==================== DELETE ====================
-
-    def delete(self, table, record_id):
-        return self._execute_modify(self.delete_queries[table], (record_id,))
-
-    # ==================== SEARCH ====================
-
-    def search_consumation(self, product_like, material_like):
-        sql = """
-        SELECT
-            c.id,
-            p.name AS product,
-            m.name AS material,
-            c.quatity
-        FROM "Consumation" c
-        JOIN "Product" p ON c.product1_id = p.id
-        JOIN material m ON c.material_id = m.id
-        WHERE
-            (%s = '' OR p.name ILIKE %s)
-        AND
-            (%s = '' OR m.name ILIKE %s)
-        ORDER BY c.id
-        """
-
-        args = [
-            product_like, f"%{product_like}%",
-            material_like, f"%{material_like}%"
-        ]
-
-        t0 = time.time()
-        rows = self._execute_select(sql, args)
-        ms = (time.time() - t0) * 1000
-
-        return rows, ms
-
-    # ==================== GENERATORS ====================
-
-    def generate_products(self, n):
-        sql = """
-        INSERT INTO "Product"(name, description)
-        SELECT
-         chr((65 + floor(random()*26))::int) ||
-         chr((65 + floor(random()*26))::int) ||
-         chr((65 + floor(random()*26))::int),
-        'Auto-generated description'
-        FROM generate_series(1, %s)
-         """
-        return self._execute_modify(sql, (n,))
-
-
-    def generate_materials(self, n):
-        sql = """
-        INSERT INTO material(name, price_per_unit, unit)
-        SELECT
-          chr((65 + floor(random()*26))::int) ||
-          chr((65 + floor(random()*26))::int),
-          (random()*100+1)::int,
-            'kg'
-        FROM generate_series(1, %s)
-          """
-        return self._execute_modify(sql, (n,))
-
-
-    def generate_consumations(self, n):
-        product_ids = [p[0] for p in self._execute_select('SELECT id FROM "Product"')]
-        material_ids = [m[0] for m in self._execute_select('SELECT id FROM material')]
-
-        if not product_ids or not material_ids:
-            print("[ERROR] Need at least 1 product and 1 material")
-            return 0
-
-        sql = """
-        WITH params AS (
-            SELECT %s::int[] AS pids, %s::int[] AS mids, %s::int AS n
-        )
-        INSERT INTO "Consumation"(product1_id, material_id, quatity)
-        SELECT
-            params.pids[floor(random()*array_length(params.pids,1))::int + 1],
-            params.mids[floor(random()*array_length(params.mids,1))::int + 1],
-            (random()*20+1)::int
-        FROM params, generate_series(1, params.n)
-        """
-
-        return self._execute_modify(sql, (product_ids, material_ids, n))
+from contextlib import contextmanager, nullcontext
+from psycopg2 import InterfaceError, OperationalError, connect
+from psycopg2.errors import QueryCanceled
+import threading
+import time
+
+from .bom_cache import BomCache
+from .buffered_writer import ConsumationWriter
+from .change_feed import ChangeFeed
+from .lock_diagnostics import LockWatchdog, backoff_delays, is_retryable
+from .name_index import NameIndex
+from .parallel_search import FULL_SEARCH_SQL, ParallelSearch, WaitingPool, search_args
+from .partitioning import ConsumationPartitions, is_missing_partition
+from .routing import ReplicaRouter
+
+
+DB_CONFIG = {
+    "database": "postgres",
+    "user": "postgres",
+    "password": "1234",
+    "host": "localhost",
+    "port": "5432",
+}
+
+# Streaming replicas that serve reads, e.g.
+# [{**DB_CONFIG, "port": "5433"}, {**DB_CONFIG, "port": "5434"}]
+REPLICA_CONFIGS = []
+
+READ_ROUTING = {
+    "strategy": "round_robin",  # or "least_latency"
+    "read_your_writes": True,
+}
+
+
+def like_prefix(prefix):
+    # LIKE pattern matching prefix literally: \ first, it escapes the others
+    return prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+class Model:
+    def __init__(self, slow_log=None, replicas=None, config=None):
+        self.config = config or DB_CONFIG
+        self.connection = connect(**self.config)
+        replicas = REPLICA_CONFIGS if replicas is None else replicas
+        self.router = ReplicaRouter(replicas, **READ_ROUTING) if replicas else None
+        self._active_connection = None
+        self.slow_log = slow_log
+        # verbose=False keeps the error prints quiet for drivers such as the
+        # load tester, which inspect last_error instead
+        self.verbose = True
+        self.last_error = None
+        self.partitions = ConsumationPartitions(self.connection)
+        self.writer = None
+        self.pool = None
+        self.change_feed = None
+        self._tx_depth = 0
+        # strict flag of every open transaction() block, innermost last
+        self._tx_strict = []
+        # name indexes changed inside the current unit of work
+        self._uow_indexes = set()
+        self._cancelled = threading.Event()
+
+        # ---------- TIMEOUTS ----------
+        # statement_timeout in ms per operation (the statement name prefix),
+        # 0 means no limit
+        self.statement_timeouts = {
+            "read": 0,
+            "search": 0,
+            "bom": 0,
+            "generate": 0,
+            "create": 0,
+            "update": 0,
+            "delete": 0,
+        }
+        self.generate_chunk = 100_000
+
+        # ---------- LOCKING ----------
+        # lock_timeout in ms for every statement (0 = wait forever); writes
+        # outside a unit of work that fail with a deadlock, serialization or
+        # lock timeout error are retried lock_retries times with backoff
+        self.lock_timeout = 0
+        self.lock_retries = 3
+        self.lock_retry_count = 0
+        self.lock_watchdog = None
+        # MemoryProfiler (scr/mem_profile.py) measuring the fetch step, or None
+        self.profiler = None
+        self.bom_cache = BomCache(self._load_bom_totals)
+
+        # ---------- INSERT ----------
+        self.insert_queries = {
+            # product/material writes return the id for the name index
+            "product": 'INSERT INTO "Product"(name, description) VALUES (%s, %s) RETURNING id',
+            "material": 'INSERT INTO material(name, price_per_unit, unit) VALUES (%s, %s, %s) RETURNING id',
+            # consumation writes return (product1_id, quatity, cost) for the BOM cache
+            "consumation": """
+                INSERT INTO "Consumation"(product1_id, material_id, quatity) VALUES (%s, %s, %s)
+                RETURNING product1_id, quatity,
+                    quatity * (SELECT price_per_unit FROM material WHERE id = material_id)
+            """,
+        }
+
+        # ---------- READ ----------
+        self.read_queries = {
+            "product": 'SELECT id, name, description FROM "Product"',
+            "material": 'SELECT id, name, price_per_unit, unit FROM material',
+            "consumation": """
+                SELECT
+                    c.id,
+                    p.name AS product,
+                    m.name AS material,
+                    c.quatity
+                FROM "Consumation" c
+                JOIN "Product" p ON c.product1_id = p.id
+                JOIN material m ON c.material_id = m.id
+                ORDER BY c.id
+            """
+        }
+
+        # ---------- DELETE ----------
+        self.delete_queries = {
+            "product": 'DELETE FROM "Product" WHERE id = %s',
+            "material": 'DELETE FROM material WHERE id = %s',
+            "consumation": """
+                DELETE FROM "Consumation" WHERE id = %s
+                RETURNING product1_id, quatity,
+                    quatity * (SELECT price_per_unit FROM material WHERE id = material_id)
+            """,
+        }
+
+        # ---------- UPDATE ----------
+        self.update_queries = {
+            "product": {
+                "name": 'UPDATE "Product" SET name = %s WHERE id = %s',
+                "description": 'UPDATE "Product" SET description = %s WHERE id = %s',
+            },
+            "material": {
+                "name": 'UPDATE material SET name = %s WHERE id = %s',
+                "price_per_unit": 'UPDATE material SET price_per_unit = %s WHERE id = %s',
+                "unit": 'UPDATE material SET unit = %s WHERE id = %s',
+            },
+            # the self-join exposes the row as it was before the update,
+            # so the BOM cache can move the old values out and the new ones in
+            "consumation": {
+                field: f"""
+                    UPDATE "Consumation" c SET {field} = %s
+                    FROM "Consumation" old
+                    JOIN material om ON om.id = old.material_id
+                    WHERE c.id = %s AND old.id = c.id
+                    RETURNING
+                        old.product1_id, old.quatity, old.quatity * om.price_per_unit,
+                        c.product1_id, c.quatity,
+                        c.quatity * (SELECT price_per_unit FROM material WHERE id = c.material_id)
+                """
+                for field in ("product1_id", "material_id", "quatity")
+            },
+        }
+
+        # ---------- VERSIONED UPDATE ----------
+        # Optimistic concurrency: xmin changes with every update of a row, so
+        # an update that also matches the version the caller read touches no
+        # rows once someone else got there first. No row lock is held between
+        # the read and the write.
+        self.version_queries = {
+            "product": 'SELECT xmin::text, id, name, description FROM "Product" WHERE id = %s',
+            "material": 'SELECT xmin::text, id, name, price_per_unit, unit FROM material WHERE id = %s',
+            "consumation": 'SELECT xmin::text, id, product1_id, material_id, quatity FROM "Consumation" WHERE id = %s',
+        }
+        self.versioned_update_queries = {
+            table: {
+                field: query + " AND xmin = %s::xid RETURNING xmin::text"
+                for field, query in self.update_queries[table].items()
+            }
+            for table in ("product", "material")
+        }
+        self.versioned_update_queries["consumation"] = {
+            field: query.replace(
+                "WHERE c.id = %s AND old.id = c.id",
+                "WHERE c.id = %s AND old.id = c.id AND c.xmin = %s::xid"
+            ).rstrip() + ", c.xmin::text"
+            for field, query in self.update_queries["consumation"].items()
+        }
+
+        # ---------- UPSERT ----------
+        # rows arrive as one array per column; "update" only rewrites rows
+        # whose values differ, so a resent record costs no new row version.
+        # RETURNING lists inserted (xmax = 0) and changed rows only.
+        self.upsert_queries = {
+            "product": {
+                "update": """
+                    INSERT INTO "Product"(name, description)
+                    SELECT * FROM unnest(%s::varchar[], %s::varchar[])
+                    ON CONFLICT (name) DO UPDATE SET description = EXCLUDED.description
+                    WHERE "Product".description IS DISTINCT FROM EXCLUDED.description
+                    RETURNING id, name, xmax = 0
+                """,
+                "nothing": """
+                    INSERT INTO "Product"(name, description)
+                    SELECT * FROM unnest(%s::varchar[], %s::varchar[])
+                    ON CONFLICT (name) DO NOTHING
+                    RETURNING id, name, true
+                """,
+            },
+            "material": {
+                "update": """
+                    INSERT INTO material(name, price_per_unit, unit)
+                    SELECT * FROM unnest(%s::varchar[], %s::int[], %s::varchar[])
+                    ON CONFLICT (name, unit) DO UPDATE SET price_per_unit = EXCLUDED.price_per_unit
+                    WHERE material.price_per_unit IS DISTINCT FROM EXCLUDED.price_per_unit
+                    RETURNING id, name, xmax = 0
+                """,
+                "nothing": """
+                    INSERT INTO material(name, price_per_unit, unit)
+                    SELECT * FROM unnest(%s::varchar[], %s::int[], %s::varchar[])
+                    ON CONFLICT (name, unit) DO NOTHING
+                    RETURNING id, name, true
+                """,
+            },
+        }
+
+        # ---------- NAME INDEX ----------
+        # loaded on first use; create/update/delete keep it current
+        self.name_indexes = {"product": NameIndex(), "material": NameIndex()}
+        self.name_queries = {
+            "product": {
+                "all": 'SELECT id, name FROM "Product"',
+                "prefix": 'SELECT DISTINCT name FROM "Product" WHERE name ILIKE %s ORDER BY name LIMIT %s',
+                "exact": 'SELECT id FROM "Product" WHERE lower(name) = lower(%s) ORDER BY id',
+            },
+            "material": {
+                "all": "SELECT id, name FROM material",
+                "prefix": "SELECT DISTINCT name FROM material WHERE name ILIKE %s ORDER BY name LIMIT %s",
+                "exact": "SELECT id FROM material WHERE lower(name) = lower(%s) ORDER BY id",
+            },
+        }
+
+        # ---------- BILL OF MATERIALS ----------
+        self.bom_queries = {
+            "product": """
+                SELECT
+                    c.id,
+                    m.id,
+                    m.name,
+                    c.quatity,
+                    m.unit,
+                    m.price_per_unit,
+                    c.quatity * m.price_per_unit AS cost
+                FROM "Consumation" c
+                JOIN material m ON c.material_id = m.id
+                WHERE c.product1_id = %s
+                ORDER BY c.id
+            """,
+            "material": """
+                SELECT
+                    c.id,
+                    p.id,
+                    p.name,
+                    c.quatity
+                FROM "Consumation" c
+                JOIN "Product" p ON c.product1_id = p.id
+                WHERE c.material_id = %s
+                ORDER BY c.id
+            """,
+            "totals": """
+                SELECT
+                    coalesce(sum(c.quatity), 0),
+                    coalesce(sum(c.quatity * m.price_per_unit), 0),
+                    count(*)
+                FROM "Consumation" c
+                JOIN material m ON c.material_id = m.id
+                WHERE c.product1_id = %s
+            """,
+            "products_using": 'SELECT DISTINCT product1_id FROM "Consumation" WHERE material_id = %s',
+        }
+
+    # ==================== BASIC ====================
+
+    def disconnect(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+        if self.router:
+            self.router.close()
+        if self.lock_watchdog:
+            self.lock_watchdog.close()
+        if self.change_feed:
+            self.change_feed.stop()
+            self.change_feed = None
+        if self.pool:
+            self.pool.closeall()
+            self.pool = None
+        if self.connection and self.connection.closed == 0:
+            self.connection.close()
+
+    def reconnect(self):
+        if self.connection.closed:
+            self.connection = connect(**self.config)
+            self.partitions.connection = self.connection
+            self._tx_depth = 0
+
+    # ==================== CANCELLATION ====================
+
+    def cancel(self):
+        # safe to call from another thread, e.g. the Ctrl-C handler in Controller.run
+        self._cancelled.set()
+        connection = self._active_connection or self.connection
+        if connection.closed == 0:
+            connection.cancel()
+        if self.pool is not None:
+            # parallel search and benchmark queries
+            self.pool.cancel()
+
+    def reset_cancel(self):
+        self._cancelled.clear()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def _apply_timeout(self, cur, name):
+        applied = []
+        timeout = self.statement_timeouts.get((name or "").split(".")[0], 0)
+        for setting, value in (("statement_timeout", timeout), ("lock_timeout", self.lock_timeout)):
+            if value:
+                cur.execute(f"SET LOCAL {setting} = %s", (int(value),))
+                applied.append(setting)
+        return applied
+
+    def _reset_timeout(self, cur, applied):
+        for setting in applied:
+            cur.execute(f"SET LOCAL {setting} TO DEFAULT")
+
+    # ==================== LOCK DIAGNOSTICS ====================
+
+    def enable_lock_diagnostics(self, threshold_ms=1000):
+        if self.lock_watchdog is None:
+            self.lock_watchdog = LockWatchdog(lambda: connect(**self.config), threshold_ms)
+        return self.lock_watchdog
+
+    def lock_snapshots(self):
+        return list(self.lock_watchdog.snapshots) if self.lock_watchdog else []
+
+    def _watch_locks(self):
+        if self.lock_watchdog is None:
+            return nullcontext()
+        return self.lock_watchdog.watch(self.connection.get_backend_pid())
+
+    def _profile(self, step):
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.step(step)
+
+    def _report_error(self, kind, e):
+        self.last_error = e
+        if not self.verbose:
+            return
+        if isinstance(e, QueryCanceled):
+            reason = "cancelled" if self.cancelled else "statement timeout"
+            print(f"\n{kind} {reason.upper()}:", e)
+        else:
+            print(f"\n{kind} ERROR:", e)
+
+    def release(self):
+        # ends whatever a half-read stream left open and reconnects a broken
+        # connection, before a pool hands the Model to its next user
+        try:
+            self.connection.rollback()
+        except Exception:
+            self.connection.close()
+        self.reconnect()
+
+    def get_pool(self, size=8):
+        # grows to the largest size asked for, so a caller wanting size
+        # connections always gets that many
+        if self.pool is not None and self.pool.maxconn < size:
+            self.pool.closeall()
+            self.pool = None
+        if self.pool is None:
+            self.pool = WaitingPool(size, **self.config)
+        return self.pool
+
+    # ==================== UNIT OF WORK ====================
+
+    @property
+    def in_transaction(self):
+        return self._tx_depth > 0
+
+    @property
+    def _strict(self):
+        return bool(self._tx_strict) and self._tx_strict[-1]
+
+    @contextmanager
+    def transaction(self, synchronous_commit=True, strict=True):
+        # Model calls made inside the block share one transaction, each call
+        # guarded by its own savepoint; the outermost block commits once.
+        # Nested blocks become savepoints of the enclosing one. strict: a
+        # failed call raises its error (and so rolls the block back) instead
+        # of returning 0 / None / [] with the error in last_error.
+        outer = self._tx_depth == 0
+        savepoint = f"model_uow_{self._tx_depth}"
+        with self.connection.cursor() as cur:
+            if outer:
+                # close the read-only transaction a previous select left open
+                self.connection.commit()
+                if not synchronous_commit:
+                    cur.execute("SET LOCAL synchronous_commit = off")
+            else:
+                cur.execute(f"SAVEPOINT {savepoint}")
+        self._tx_depth += 1
+        self._tx_strict.append(strict)
+        try:
+            yield self
+        except BaseException:
+            self._tx_depth -= 1
+            self._tx_strict.pop()
+            # cached aggregates and names may include the rolled back writes
+            self.bom_cache.clear()
+            for table in self._uow_indexes:
+                self.name_indexes[table].reset()
+            if outer:
+                self._uow_indexes.clear()
+                self.connection.rollback()
+            else:
+                with self.connection.cursor() as cur:
+                    cur.execute(f"ROLLBACK TO SAVEPOINT {savepoint}")
+            raise
+        else:
+            self._tx_depth -= 1
+            self._tx_strict.pop()
+            if outer:
+                self._uow_indexes.clear()
+                self.connection.commit()
+                self._note_write()
+            else:
+                with self.connection.cursor() as cur:
+                    cur.execute(f"RELEASE SAVEPOINT {savepoint}")
+
+    def _begin_statement(self, cur):
+        if self._tx_depth:
+            cur.execute("SAVEPOINT model_stmt")
+
+    def _commit_statement(self, cur):
+        if self._tx_depth:
+            cur.execute("RELEASE SAVEPOINT model_stmt")
+        else:
+            self.connection.commit()
+            self._note_write()
+
+    def _note_write(self):
+        if self.router:
+            self.router.note_write(self.connection)
+
+    def _rollback_statement(self):
+        if self.connection.closed:
+            return
+        if self._tx_depth:
+            with self.connection.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT model_stmt")
+                cur.execute("RELEASE SAVEPOINT model_stmt")
+        else:
+            self.connection.rollback()
+
+    def start_change_feed(self):
+        # keeps the BOM cache and name indexes in step with writes made by
+        # other app instances
+        if self.change_feed is None:
+            self.change_feed = ChangeFeed(connect(**self.config))
+            self.change_feed.subscribe(self.bom_cache.on_change)
+            for table, index in self.name_indexes.items():
+                self.change_feed.subscribe(index.on_change, [table])
+            self.change_feed.start()
+        return self.change_feed
+
+    def _log_statement(self, name, query, data, rows, t0, connection=None, error=None):
+        # connection: where the statement ran, if not the primary; call it
+        # after a failed statement is rolled back, so EXPLAIN can still run
+        if self.slow_log:
+            ms = (time.time() - t0) * 1000
+            connection = connection or self.connection
+            self.slow_log.record(
+                name or " ".join(query.split())[:60], query, data, rows, ms,
+                None if connection.closed else connection, error
+            )
+
+    # ==================== READ ROUTING ====================
+
+    def _replica_select(self, replica, query, data, name):
+        # None means "replica unusable, ask the primary"
+        try:
+            conn = replica.connection()
+        except (OperationalError, InterfaceError):
+            replica.mark_down()
+            return None
+        cur = conn.cursor()
+        self._active_connection = conn
+        t0 = time.time()
+        try:
+            # the replica transaction ends with the read, so nothing to reset
+            self._apply_timeout(cur, name)
+            with self._profile("fetch"):
+                cur.execute(query, data or ())
+                rows = cur.fetchall()
+            conn.commit()
+            replica.record_latency((time.time() - t0) * 1000)
+            self._log_statement(name, query, data, len(rows), t0, conn)
+            return rows
+        except (OperationalError, InterfaceError) as e:
+            if isinstance(e, QueryCanceled):
+                self._report_error("SELECT", e)
+                conn.rollback()
+                self._log_statement(name, query, data, None, t0, conn, e)
+                return []
+            replica.mark_down()
+            return None
+        except Exception as e:
+            self._report_error("SELECT", e)
+            conn.rollback()
+            self._log_statement(name, query, data, None, t0, conn, e)
+            return []
+        finally:
+            self._active_connection = None
+            cur.close()
+
+    def _execute_select(self, query, data=None, name=None, primary=False):
+        # reads inside a unit of work must see its own uncommitted writes;
+        # primary=True is for reads that must not lag behind any writer
+        if self.router and not self._tx_depth and not primary:
+            replica = self.router.pick()
+            if replica is not None:
+                rows = self._replica_select(replica, query, data, name)
+                if rows is not None:
+                    return rows
+        self.reconnect()
+        cur = self.connection.cursor()
+        t0 = time.time()
+        try:
+            self._begin_statement(cur)
+            applied = self._apply_timeout(cur, name)
+            with self._profile("fetch"):
+                cur.execute(query, data or ())
+                rows = cur.fetchall()
+            self._reset_timeout(cur, applied)
+            if self._tx_depth:
+                cur.execute("RELEASE SAVEPOINT model_stmt")
+            self._log_statement(name, query, data, len(rows), t0)
+            return rows
+        except Exception as e:
+            self._report_error("SELECT", e)
+            self._rollback_statement()
+            self._log_statement(name, query, data, None, t0, error=e)
+            if self._strict:
+                raise
+            return []
+        finally:
+            cur.close()
+
+    def _execute_write(self, query, data, name, fetch):
+        delays = backoff_delays(self.lock_retries)
+        grown = False
+        while True:
+            self.reconnect()
+            cur = self.connection.cursor()
+            t0 = time.time()
+            try:
+                self._begin_statement(cur)
+                applied = self._apply_timeout(cur, name)
+                with self._watch_locks():
+                    cur.execute(query, data)
+                if fetch == "all":
+                    result = cur.fetchall()
+                else:
+                    result = cur.fetchone() if fetch else cur.rowcount
+                rowcount = cur.rowcount
+                self._reset_timeout(cur, applied)
+                self._commit_statement(cur)
+                self._log_statement(name, query, data, rowcount, t0)
+                return result
+            except Exception as e:
+                self._rollback_statement()
+                self._log_statement(name, query, data, None, t0, error=e)
+                # a partitioned "Consumation" got past its last partition:
+                # add the next one (inside the unit of work, if any) and rerun
+                if not grown and is_missing_partition(e):
+                    grown = True
+                    try:
+                        created = self.partitions.ensure_capacity(1, commit=not self._tx_depth)
+                    except Exception:
+                        created = []
+                    if created:
+                        continue
+                # inside a unit of work earlier statements hold locks too,
+                # so only the caller can decide to rerun the whole unit
+                delay = next(delays, None) if is_retryable(e) and not self._tx_depth else None
+                if delay is not None:
+                    self.lock_retry_count += 1
+                    time.sleep(delay)
+                    continue
+                self._report_error("MODIFY", e)
+                if self._strict:
+                    raise
+                return None if fetch else 0
+            finally:
+                cur.close()
+
+    def _execute_modify(self, query, data, name=None):
+        return self._execute_write(query, data, name, fetch=False)
+
+    def _execute_returning(self, query, data, name=None):
+        return self._execute_write(query, data, name, fetch=True)
+
+    def _execute_returning_all(self, query, data, name=None):
+        return self._execute_write(query, data, name, fetch="all")
+
+    # ==================== CREATE ====================
+
+    def create_product(self, name, description):
+        row = self._execute_returning(self.insert_queries["product"], (name, description), "create.product")
+        return self._indexed_insert("product", row, name)
+
+    def create_material(self, name, ppu, unit):
+        row = self._execute_returning(self.insert_queries["material"], (name, ppu, unit), "create.material")
+        return self._indexed_insert("material", row, name)
+
+    def _indexed_insert(self, table, row, name):
+        if row is None:
+            return 0
+        index = self._changed_index(table)
+        if index.loaded:
+            index.add(row[0], name)
+        return 1
+
+    def create_consumation(self, product_id, material_id, qty):
+        row = self._execute_returning(
+            self.insert_queries["consumation"],
+            (product_id, material_id, qty),
+            "create.consumation"
+        )
+        if row is None:
+            return 0
+        pid, qty, cost = row
+        self.bom_cache.apply(pid, qty, cost, 1)
+        return 1
+
+    # ---------- upsert by natural key ----------
+
+    def _upsert(self, table, rows, key, update, batch_size):
+        # -> (inserted, updated, unchanged); within a batch the last row of a
+        # key wins, since one statement may not touch the same row twice
+        query = self.upsert_queries[table]["update" if update else "nothing"]
+        index = self._changed_index(table)
+        totals = [0, 0, 0]
+        batch = {}
+
+        def flush():
+            values = list(batch.values())
+            batch.clear()
+            returned = self._execute_returning_all(
+                query, [list(column) for column in zip(*values)], f"create.{table}.upsert"
+            )
+            if returned is None:
+                raise ValueError(f"Upsert of {len(values)} {table} rows failed: {self.last_error}")
+            inserted = [(record_id, name) for record_id, name, is_new in returned if is_new]
+            totals[0] += len(inserted)
+            totals[1] += len(returned) - len(inserted)
+            totals[2] += len(values) - len(returned)
+            if index.loaded:
+                for record_id, name in inserted:
+                    index.add(record_id, name)
+            if table == "material" and len(returned) > len(inserted):
+                # changed prices move the totals of every product using them
+                self.bom_cache.clear()
+
+        for row in rows:
+            batch[key(row)] = row
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        return tuple(totals)
+
+    def upsert_products(self, rows, update=True, batch_size=1000):
+        # rows: iterable of (name, description); name is the natural key
+        return self._upsert("product", rows, lambda row: row[0], update, batch_size)
+
+    def upsert_materials(self, rows, update=True, batch_size=1000):
+        # rows: iterable of (name, price_per_unit, unit); (name, unit) is the natural key
+        return self._upsert("material", rows, lambda row: (row[0], row[2]), update, batch_size)
+
+    def create_product_with_bom(self, name, description, items):
+        # items: iterable of (material_id, qty)
+        with self.transaction(strict=True):
+            row = self._execute_returning(
+                self.insert_queries["product"], (name, description), "create.product_with_bom"
+            )
+            if not self._indexed_insert("product", row, name):
+                raise ValueError(f"Could not create product {name}")
+            for material_id, qty in items:
+                if not self.create_consumation(row[0], material_id, qty):
+                    raise ValueError(f"Could not add material {material_id} to product {name}")
+        return row[0]
+
+    def replace_bom(self, product_id, items):
+        # strict: a delete that failed (lock or statement timeout) raises, so
+        # the old items are never committed alongside the new ones
+        with self.transaction(strict=True):
+            self._execute_modify(
+                'DELETE FROM "Consumation" WHERE product1_id = %s', (product_id,), "delete.bom"
+            )
+            self.bom_cache.invalidate(product_id)
+            for material_id, qty in items:
+                if not self.create_consumation(product_id, material_id, qty):
+                    raise ValueError(f"Could not add material {material_id} to product {product_id}")
+
+    def start_writer(self, **options):
+        if self.writer is None:
+            self.writer = ConsumationWriter(
+                connect(**self.config),
+                on_flush=lambda product_ids: self.bom_cache.invalidate(*product_ids),
+                **options
+            )
+        return self.writer
+
+    def enqueue_consumation(self, product_id, material_id, qty, timeout=None):
+        self.start_writer().put(product_id, material_id, qty, timeout)
+
+    # ==================== READ ====================
+
+    def read(self, table):
+        return self._execute_select(self.read_queries[table], name=f"read.{table}")
+
+    def read_iter(self, table, chunk_rows=2000):
+        return self.iter_select(self.read_queries[table], name=f"read.{table}", chunk_rows=chunk_rows)
+
+    def iter_select(self, query, data=None, name=None, chunk_rows=2000):
+        # server-side cursor on the primary: rows arrive chunk_rows at a time,
+        # so a caller streaming them out never holds the whole result. Inside
+        # a unit of work the stream runs under a savepoint of its own, so a
+        # failure (or a caller that stops early) rolls back only the stream.
+        # Errors end the stream and are left in last_error (raised, too, in
+        # a strict unit of work).
+        self.reconnect()
+        with self.connection.cursor() as setup:
+            if self._tx_depth:
+                setup.execute("SAVEPOINT model_iter")
+            applied = self._apply_timeout(setup, name)
+        cur = self.connection.cursor(name=f"model_iter_{id(self)}_{time.time_ns()}")
+        cur.itersize = chunk_rows
+        t0 = time.time()
+        rows = 0
+        finished = False
+        try:
+            cur.execute(query, data or ())
+            for row in cur:
+                rows += 1
+                yield row
+            cur.close()
+            with self.connection.cursor() as setup:
+                self._reset_timeout(setup, applied)
+                if self._tx_depth:
+                    setup.execute("RELEASE SAVEPOINT model_iter")
+            if not self._tx_depth:
+                self.connection.commit()
+            finished = True
+            self._log_statement(name, query, data, rows, t0)
+        except Exception as e:
+            self._report_error("SELECT", e)
+            self._end_iter()
+            finished = True
+            self._log_statement(name, query, data, rows, t0, error=e)
+            if self._strict:
+                raise
+        finally:
+            if not cur.closed:
+                cur.close()
+            if not finished:
+                self._end_iter()
+
+    def _end_iter(self):
+        if self.connection.closed:
+            return
+        if self._tx_depth:
+            with self.connection.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT model_iter")
+                cur.execute("RELEASE SAVEPOINT model_iter")
+        else:
+            self.connection.rollback()
+
+    # ==================== UPDATE ====================
+
+    def update_field(self, table, record_id, field, value):
+        query = self.update_queries[table].get(field)
+        if not query:
+            raise ValueError(f"Unknown field {field} for table {table}")
+        if table == "consumation":
+            row = self._execute_returning(query, (value, record_id), f"update.{table}.{field}")
+            if row is None:
+                return 0
+            old_pid, old_qty, old_cost, new_pid, new_qty, new_cost = row
+            self.bom_cache.apply(old_pid, -old_qty, -old_cost, -1)
+            self.bom_cache.apply(new_pid, new_qty, new_cost, 1)
+            return 1
+        affected = self._execute_modify(query, (value, record_id), f"update.{table}.{field}")
+        if affected and table == "material" and field == "price_per_unit":
+            self._invalidate_products_using(record_id)
+        if affected and field == "name":
+            self._rename_indexed(table, record_id, value)
+        return affected
+
+    # ---------- optimistic concurrency ----------
+
+    UPDATED = "updated"
+    CONFLICT = "conflict"
+    NOT_FOUND = "not_found"
+
+    def get_versioned(self, table, record_id):
+        # (version, row) or None; pass the version to update_field_checked.
+        # Always from the primary: a lagging replica's version would make
+        # every checked update conflict and the client retry forever.
+        rows = self._execute_select(
+            self.version_queries[table], (record_id,), f"read.{table}.versioned", primary=True
+        )
+        if not rows:
+            return None
+        return rows[0][0], rows[0][1:]
+
+    def update_field_checked(self, table, record_id, field, value, version):
+        # -> (UPDATED, new_version) | (CONFLICT, current_version) | (NOT_FOUND, None)
+        query = self.versioned_update_queries[table].get(field)
+        if not query:
+            raise ValueError(f"Unknown field {field} for table {table}")
+        self.last_error = None
+        row = self._execute_returning(query, (value, record_id, version), f"update.{table}.{field}")
+        if row is not None:
+            if table == "consumation":
+                old_pid, old_qty, old_cost, new_pid, new_qty, new_cost, new_version = row
+                self.bom_cache.apply(old_pid, -old_qty, -old_cost, -1)
+                self.bom_cache.apply(new_pid, new_qty, new_cost, 1)
+            else:
+                new_version = row[0]
+                if table == "material" and field == "price_per_unit":
+                    self._invalidate_products_using(record_id)
+                if field == "name":
+                    self._rename_indexed(table, record_id, value)
+            return self.UPDATED, new_version
+        if self.last_error is not None:
+            raise self.last_error
+        current = self.get_versioned(table, record_id)
+        if current is None:
+            return self.NOT_FOUND, None
+        return self.CONFLICT, current[0]
+
+    # ==================== DELETE ====================
+
+    def delete(self, table, record_id):
+        if table == "consumation":
+            row = self._execute_returning(self.delete_queries[table], (record_id,), f"delete.{table}")
+            if row is None:
+                return 0
+            pid, qty, cost = row
+            self.bom_cache.apply(pid, -qty, -cost, -1)
+            return 1
+        affected = self._execute_modify(self.delete_queries[table], (record_id,), f"delete.{table}")
+        if affected and table == "product":
+            self.bom_cache.invalidate(record_id)
+        if affected:
+            index = self._changed_index(table)
+            if index.loaded:
+                index.remove(record_id)
+        return affected
+
+    def delete_cascade(self, table, record_id, batch=5000, progress=None):
+        # Deletes a product or material together with its consumations. The
+        # children go in batches of their own committed statements, so no
+        # lock is held for long; cancel() stops between (or inside) batches
+        # and keeps the parent. -> (consumations deleted, parent deleted)
+        # A cancel() left over from an earlier operation must not stop this one.
+        self.reset_cancel()
+        done, complete = self.delete_children(table, record_id, batch, progress)
+        if not complete:
+            return done, 0
+        return done, self.delete(table, record_id)
+
+    def count_children(self, table, record_id):
+        # consumations a cascading delete of the product or material removes
+        column = {"product": "product1_id", "material": "material_id"}[table]
+        rows = self._execute_select(
+            f'SELECT count(*) FROM "Consumation" WHERE {column} = %s', (record_id,), f"delete.{table}.cascade_count"
+        )
+        return rows[0][0] if rows else 0
+
+    def delete_children(self, table, record_id, batch=5000, progress=None):
+        # the consumations of a product or material, batch rows per commit
+        # -> (rows deleted, False if an error or cancel() stopped it early)
+        if self.in_transaction:
+            raise ValueError("delete_cascade commits per batch and cannot run in a unit of work")
+        column = {"product": "product1_id", "material": "material_id"}[table]
+        total = self.count_children(table, record_id)
+        query = f"""
+            DELETE FROM "Consumation" WHERE id IN (
+                SELECT id FROM "Consumation" WHERE {column} = %s ORDER BY id LIMIT %s
+            )
+            RETURNING product1_id
+        """
+        done = 0
+        while not self.cancelled:
+            rows = self._execute_returning_all(query, (record_id, batch), f"delete.{table}.cascade")
+            if rows is None:
+                return done, False
+            self.bom_cache.invalidate(*{pid for (pid,) in rows})
+            if not rows:
+                return done, True
+            done += len(rows)
+            if progress:
+                progress(done, max(total, done))
+        return done, False
+
+    def delete_consumation_range(self, id_from, id_to):
+        self.bom_cache.clear()
+        if self.partitions.is_partitioned():
+            _, deleted = self.partitions.purge(id_from, id_to, commit=not self.in_transaction)
+            return deleted
+        return self._execute_modify(
+            'DELETE FROM "Consumation" WHERE id >= %s AND id < %s',
+            (id_from, id_to),
+            "delete.consumation_range"
+        )
+
+    # ==================== NAME INDEX ====================
+
+    def name_index(self, table):
+        # the loaded index, or None while it is switched off or cannot be
+        # loaded; callers then ask SQL
+        index = self.name_indexes[table]
+        if not index.loaded:
+            # loaded inside a unit of work, it sees the uncommitted rows too
+            index = self._changed_index(table)
+            try:
+                index.load(self._checked(
+                    self.iter_select(self.name_queries[table]["all"], name=f"read.{table}.names")
+                ))
+            except Exception:
+                # a list cut short by a timeout or cancel would answer "no
+                # match" for names that exist, so it is not kept
+                return None
+        return index if index.enabled else None
+
+    def _checked(self, rows):
+        # re-raises the error that ended an iter_select stream early
+        self.last_error = None
+        yield from rows
+        if self.last_error is not None:
+            raise self.last_error
+
+    def _changed_index(self, table):
+        # the index of table, about to change; a unit of work that rolls
+        # back resets it (transaction()), as it cannot undo the change
+        if self._tx_depth:
+            self._uow_indexes.add(table)
+        return self.name_indexes[table]
+
+    def _rename_indexed(self, table, record_id, name):
+        index = self._changed_index(table)
+        if index.loaded:
+            index.rename(record_id, name)
+
+    def complete_name(self, table, prefix, limit=10):
+        # typeahead: distinct names starting with prefix, case-insensitive
+        index = self.name_index(table)
+        if index is not None:
+            return index.complete(prefix, limit)
+        rows = self._execute_select(
+            self.name_queries[table]["prefix"], (like_prefix(prefix), limit), f"read.{table}.complete"
+        )
+        return [name for (name,) in rows]
+
+    def resolve_name(self, table, name):
+        # ids of every row with exactly this name, case-insensitive
+        index = self.name_index(table)
+        if index is not None:
+            return index.resolve(name)
+        rows = self._execute_select(self.name_queries[table]["exact"], (name.strip(),), f"read.{table}.resolve")
+        return [record_id for (record_id,) in rows]
+
+    # ==================== BILL OF MATERIALS ====================
+
+    def product_bom(self, product_id):
+        return self._execute_select(self.bom_queries["product"], (product_id,), "bom.product")
+
+    def material_where_used(self, material_id):
+        return self._execute_select(self.bom_queries["material"], (material_id,), "bom.where_used")
+
+    def product_totals(self, product_id):
+        # (total quantity, total cost, number of consumation lines)
+        return self.bom_cache.get(product_id)
+
+    def _load_bom_totals(self, product_id):
+        rows = self._execute_select(self.bom_queries["totals"], (product_id,), "bom.totals")
+        return tuple(rows[0]) if rows else (0, 0, 0)
+
+    def _invalidate_products_using(self, material_id):
+        cached = set(self.bom_cache.cached_ids())
+        if not cached:
+            return
+        rows = self._execute_select(self.bom_queries["products_using"], (material_id,), "bom.products_using")
+        self.bom_cache.invalidate(*(pid for (pid,) in rows if pid in cached))
+
+    # ==================== SEARCH ====================
+
+    def _search_consumation_query(self, product_like, material_like):
+        return FULL_SEARCH_SQL, search_args(product_like, material_like)
+
+    def search_consumation(self, product_like, material_like):
+        sql, args = self._search_consumation_query(product_like, material_like)
+        t0 = time.time()
+        rows = self._execute_select(sql, args, "search.consumation")
+        ms = (time.time() - t0) * 1000
+
+        return rows, ms
+
+    def search_consumation_iter(self, product_like, material_like, chunk_rows=2000):
+        sql, args = self._search_consumation_query(product_like, material_like)
+        return self.iter_select(sql, args, "search.consumation", chunk_rows)
+
+    def search_consumation_faceted(self, product_like, material_like, limit=50, offset=0, facet_limit=20):
+        # total, per-product and per-material counts and one page of rows
+        # come back as a single row, so the matches never leave the server
+        sql = """
+        WITH matches AS (
+            SELECT
+                c.id,
+                c.product1_id,
+                p.name AS product,
+                c.material_id,
+                m.name AS material,
+                c.quatity
+            FROM "Consumation" c
+            JOIN "Product" p ON c.product1_id = p.id
+            JOIN material m ON c.material_id = m.id
+            WHERE
+                (%s = '' OR p.name ILIKE %s)
+            AND
+                (%s = '' OR m.name ILIKE %s)
+        ),
+        facets AS (
+            SELECT
+                product1_id, product, material_id, material,
+                count(*) AS n,
+                GROUPING(product1_id) AS gp,
+                GROUPING(material_id) AS gm
+            FROM matches
+            GROUP BY GROUPING SETS ((product1_id, product), (material_id, material), ())
+        ),
+        page AS (
+            SELECT id, product, material, quatity
+            FROM matches
+            ORDER BY id
+            LIMIT %s OFFSET %s
+        )
+        SELECT
+            coalesce((SELECT n FROM facets WHERE gp = 1 AND gm = 1), 0),
+            (SELECT coalesce(json_agg(json_build_array(product1_id, product, n) ORDER BY n DESC, product1_id), '[]')
+             FROM (SELECT * FROM facets WHERE gp = 0 ORDER BY n DESC, product1_id LIMIT %s) f),
+            (SELECT coalesce(json_agg(json_build_array(material_id, material, n) ORDER BY n DESC, material_id), '[]')
+             FROM (SELECT * FROM facets WHERE gm = 0 ORDER BY n DESC, material_id LIMIT %s) f),
+            (SELECT coalesce(json_agg(json_build_array(id, product, material, quatity) ORDER BY id), '[]')
+             FROM page)
+        """
+
+        args = [
+            product_like, f"%{product_like}%",
+            material_like, f"%{material_like}%",
+            limit, offset,
+            facet_limit, facet_limit,
+        ]
+
+        t0 = time.time()
+        rows = self._execute_select(sql, args, "search.consumation_faceted")
+        ms = (time.time() - t0) * 1000
+
+        total, by_product, by_material, page = rows[0] if rows else (0, [], [], [])
+        return {
+            "total": total,
+            "by_product": by_product,
+            "by_material": by_material,
+            "rows": page,
+        }, ms
+
+    def search_consumation_parallel(self, product_like, material_like, workers=4):
+        # pooled connections, with the timeouts, slow log and cancel() of
+        # this Model; errors leave [] and last_error like _execute_select
+        try:
+            return ParallelSearch(self.get_pool(workers), workers, self).search(product_like, material_like)
+        except Exception as e:
+            self._report_error("SELECT", e)
+            return [], 0.0
+
+    def benchmark_search(self, product_like, material_like, workers=4):
+        try:
+            return ParallelSearch(self.get_pool(workers), workers, self).benchmark(product_like, material_like)
+        except Exception as e:
+            self._report_error("SELECT", e)
+            return []
+
+    # ==================== GENERATORS ====================
+
+    def _generate_chunked(self, sql, make_args, n, name, progress=None):
+        # one committed statement per chunk: Model.cancel() stops the loop
+        # between chunks and cancels the chunk in flight, keeping what is done
+        done = 0
+        while done < n and not self.cancelled:
+            size = min(self.generate_chunk, n - done)
+            inserted = self._execute_modify(sql, make_args(size), name)
+            if inserted <= 0:
+                break
+            done += inserted
+            if progress:
+                progress(done, n)
+        return done
+
+    def generate_products(self, n, progress=None):
+        sql = """
+        INSERT INTO "Product"(name, description)
+        SELECT
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int),
+        'Auto-generated description'
+        FROM generate_series(1, %s)
+        ON CONFLICT (name) DO NOTHING
+         """
+        created = self._generate_chunked(sql, lambda size: (size,), n, "generate.products", progress)
+        self.name_indexes["product"].reset()
+        return created
+
+
+    def generate_materials(self, n, progress=None):
+        sql = """
+        INSERT INTO material(name, price_per_unit, unit)
+        SELECT
+          chr((65 + floor(random()*26))::int) ||
+          chr((65 + floor(random()*26))::int) ||
+          chr((65 + floor(random()*26))::int),
+          (random()*100+1)::int,
+            'kg'
+        FROM generate_series(1, %s)
+        ON CONFLICT (name, unit) DO NOTHING
+          """
+        created = self._generate_chunked(sql, lambda size: (size,), n, "generate.materials", progress)
+        self.name_indexes["material"].reset()
+        return created
+
+
+    def generate_consumations(self, n, progress=None, product_ids=None):
+        # product_ids narrows the products to draw from (the sharding layer
+        # passes the products a shard owns)
+        if product_ids is None:
+            product_ids = [p[0] for p in self._execute_select('SELECT id FROM "Product"')]
+        material_ids = [m[0] for m in self._execute_select('SELECT id FROM material')]
+
+        if not product_ids or not material_ids:
+            print("[ERROR] Need at least 1 product and 1 material")
+            return 0
+
+        self.partitions.ensure_capacity(n, commit=not self.in_transaction)
+
+        sql = """
+        WITH params AS (
+            SELECT %s::int[] AS pids, %s::int[] AS mids, %s::int AS n
+        )
+        INSERT INTO "Consumation"(product1_id, material_id, quatity)
+        SELECT
+            params.pids[floor(random()*array_length(params.pids,1))::int + 1],
+            params.mids[floor(random()*array_length(params.mids,1))::int + 1],
+            (random()*20+1)::int
+        FROM params, generate_series(1, params.n)
+        """
+
+        inserted = self._generate_chunked(
+            sql,
+            lambda size: (product_ids, material_ids, size),
+            n,
+            "generate.consumations",
+            progress
+        )
+        self.bom_cache.clear()
+        return inserted
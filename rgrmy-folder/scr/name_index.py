@@ -0,0 +1,145 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+def _key(name):
+    return name.strip().casefold()
+
+
+class NameIndex:
+    # Sorted array of names with a parallel array of ids; a prefix is the
+    # slice between two bisections. Memory per entry is one list slot and one
+    # 8-byte id (16 B), plus one str per distinct name (about 49 + len bytes,
+    # duplicates are interned). 1M distinct 20-character names take ~85 MB,
+    # 1M generated 5-letter names ~70 MB; loading needs
+    # about 120 MB more for a moment while it sorts. Past max_names the index
+    # switches itself off and callers fall back to SQL.
+    def __init__(self, max_names=1_000_000):
+        self.max_names = max_names
+        self.loaded = False
+        self.enabled = True
+        self._names = []
+        self._ids = array("q")
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._names)
+
+    def load(self, rows):
+        # rows: iterable of (id, name), e.g. a Model.iter_select stream
+        pairs = []
+        for record_id, name in rows:
+            pairs.append((_key(name), record_id, sys.intern(name.strip())))
+            if len(pairs) > self.max_names:
+                self._disable()
+                return self
+        pairs.sort()
+        with self._lock:
+            self._names = [name for _, _, name in pairs]
+            self._ids = array("q", (record_id for _, record_id, _ in pairs))
+            self.loaded = True
+            self.enabled = True
+        return self
+
+    def reset(self):
+        # forget everything; the next use loads the table again
+        with self._lock:
+            self._names = []
+            self._ids = array("q")
+            self.loaded = False
+            self.enabled = True
+
+    def _disable(self):
+        with self._lock:
+            self._names = []
+            self._ids = array("q")
+            self.loaded = True
+            self.enabled = False
+
+    def _range(self, key):
+        lo = bisect_left(self._names, key, key=_key)
+        # every key starting with the prefix sorts below prefix + U+10FFFF
+        hi = bisect_left(self._names, key + "\U0010ffff", lo, key=_key)
+        return lo, hi
+
+    def add(self, record_id, name):
+        if not self.enabled:
+            return
+        with self._lock:
+            if len(self._names) >= self.max_names:
+                self._disable()
+                return
+            name = sys.intern(name.strip())
+            key = _key(name)
+            # equal names stay ordered by id
+            lo = bisect_left(self._names, key, key=_key)
+            hi = bisect_right(self._names, key, lo, key=_key)
+            pos = lo + bisect_left(self._ids[lo:hi], record_id)
+            if pos < hi and self._ids[pos] == record_id:
+                return
+            self._names.insert(pos, name)
+            self._ids.insert(pos, record_id)
+
+    def remove(self, record_id):
+        # linear scan of the id array in C, a few ms for 1M entries
+        if not self.enabled:
+            return
+        with self._lock:
+            try:
+                pos = self._ids.index(record_id)
+            except ValueError:
+                return
+            del self._names[pos]
+            del self._ids[pos]
+
+    def rename(self, record_id, name):
+        with self._lock:
+            self.remove(record_id)
+            self.add(record_id, name)
+
+    def complete(self, prefix, limit=10):
+        # distinct names starting with prefix, case-insensitive
+        with self._lock:
+            lo, hi = self._range(_key(prefix))
+            # names differing only in case sort together but interleave by id
+            result = []
+            seen = set()
+            for i in range(lo, hi):
+                name = self._names[i]
+                if name not in seen:
+                    seen.add(name)
+                    result.append(name)
+                    if len(result) >= limit:
+                        break
+            return result
+
+    def resolve(self, name):
+        # ids of every row named exactly name, case-insensitive
+        key = _key(name)
+        with self._lock:
+            lo = bisect_left(self._names, key, key=_key)
+            hi = bisect_right(self._names, key, lo, key=_key)
+            return list(self._ids[lo:hi])
+
+    def on_change(self, event):
+        # change feed subscriber; add/remove are idempotent, so events caused
+        # by this process's own writes are harmless
+        if not self.loaded:
+            return
+        if event.op.startswith("BULK_"):
+            self.reset()
+        elif event.op == "INSERT":
+            self.add(event.id, event.new["name"])
+        elif event.op == "UPDATE" and event.old["name"] != event.new["name"]:
+            self.rename(event.id, event.new["name"])
+        elif event.op == "DELETE":
+            self.remove(event.id)
+
+    def memory_bytes(self):
+        # list and array storage plus each distinct str once
+        with self._lock:
+            distinct = {id(name): name for name in self._names}
+            return (sys.getsizeof(self._names) + sys.getsizeof(self._ids)
+                    + sum(sys.getsizeof(name) for name in distinct.values()))
@@ -0,0 +1,171 @@
+import argparse
+import time
+from multiprocessing import Pool
+
+from psycopg2 import connect
+
+from .model import DB_CONFIG
+from .partitioning import ConsumationPartitions
+
+
+# Every statement inserts an explicit id range [%s, %s], so workers never
+# compete for the sequence and never produce overlapping ids. Generated names
+# that already exist are skipped, leaving gaps in the range.
+RANGE_INSERTS = {
+    "product": """
+        INSERT INTO "Product"(id, name, description)
+        SELECT
+         g,
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int) ||
+         chr((65 + floor(random()*26))::int),
+        'Auto-generated description'
+        FROM generate_series(%s, %s) g
+        ON CONFLICT (name) DO NOTHING
+    """,
+    "material": """
+        INSERT INTO material(id, name, price_per_unit, unit)
+        SELECT
+          g,
+          chr((65 + floor(random()*26))::int) ||
+          chr((65 + floor(random()*26))::int) ||
+          chr((65 + floor(random()*26))::int),
+          (random()*100+1)::int,
+            'kg'
+        FROM generate_series(%s, %s) g
+        ON CONFLICT (name, unit) DO NOTHING
+    """,
+    "consumation": """
+        INSERT INTO "Consumation"(id, product1_id, material_id, quatity)
+        SELECT
+            g,
+            params.pids[floor(random()*array_length(params.pids,1))::int + 1],
+            params.mids[floor(random()*array_length(params.mids,1))::int + 1],
+            (random()*20+1)::int
+        FROM gen_params params, generate_series(%s, %s) g
+    """,
+}
+
+TABLES = {
+    "product": '"Product"',
+    "material": "material",
+    "consumation": '"Consumation"',
+}
+
+_connection = None
+
+
+def _init_worker(product_ids, material_ids):
+    global _connection
+    _connection = connect(**DB_CONFIG)
+    with _connection.cursor() as cur:
+        # seeding can be replayed, an fsync per chunk buys nothing here
+        cur.execute("SET synchronous_commit = off")
+        if product_ids is not None:
+            cur.execute(
+                "CREATE TEMP TABLE gen_params AS SELECT %s::int[] AS pids, %s::int[] AS mids",
+                (product_ids, material_ids)
+            )
+    _connection.commit()
+
+
+def _insert_range(job):
+    kind, first_id, last_id = job
+    with _connection.cursor() as cur:
+        cur.execute(RANGE_INSERTS[kind], (first_id, last_id))
+        inserted = cur.rowcount
+    _connection.commit()
+    return inserted
+
+
+class ParallelGenerator:
+    def __init__(self, connection, processes=4, chunk=100_000):
+        self.connection = connection
+        self.processes = processes
+        self.chunk = chunk
+
+    def _reserve_ids(self, kind, n):
+        # Blocking concurrent inserts while the sequence jumps ahead makes
+        # [first, first + n) ours alone; other writers continue after commit.
+        table = TABLES[kind]
+        cur = self.connection.cursor()
+        try:
+            cur.execute(f"LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE")
+            cur.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), nextval(pg_get_serial_sequence(%s, 'id')) + %s - 1)",
+                (table, table, n)
+            )
+            last = cur.fetchone()[0]
+            self.connection.commit()
+            return last - n + 1
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+
+    def _ids(self, table):
+        with self.connection.cursor() as cur:
+            cur.execute(f"SELECT id FROM {table}")
+            ids = [row[0] for row in cur.fetchall()]
+        self.connection.commit()
+        return ids
+
+    def _jobs(self, kind, first_id, n):
+        return [
+            (kind, start, min(start + self.chunk, first_id + n) - 1)
+            for start in range(first_id, first_id + n, self.chunk)
+        ]
+
+    def _run(self, kind, n, initargs):
+        first_id = self._reserve_ids(kind, n)
+        if kind == "consumation":
+            ConsumationPartitions(self.connection).ensure_capacity(0)
+        with Pool(self.processes, initializer=_init_worker, initargs=initargs) as pool:
+            return sum(pool.imap_unordered(_insert_range, self._jobs(kind, first_id, n)))
+
+    def generate(self, products=0, materials=0, consumations=0):
+        stats = []
+        t_all = time.time()
+        for kind, n in (("product", products), ("material", materials)):
+            if n > 0:
+                t0 = time.time()
+                rows = self._run(kind, n, (None, None))
+                stats.append((kind, rows, time.time() - t0))
+        if consumations > 0:
+            product_ids = self._ids('"Product"')
+            material_ids = self._ids("material")
+            if not product_ids or not material_ids:
+                print("[ERROR] Need at least 1 product and 1 material")
+            else:
+                t0 = time.time()
+                rows = self._run("consumation", consumations, (product_ids, material_ids))
+                stats.append(("consumation", rows, time.time() - t0))
+        total_rows = sum(rows for _, rows, _ in stats)
+        stats.append(("total", total_rows, time.time() - t_all))
+        return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.parallel_generate")
+    parser.add_argument("--products", type=int, default=0)
+    parser.add_argument("--materials", type=int, default=0)
+    parser.add_argument("--consumations", type=int, default=0)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--chunk", type=int, default=100_000, help="rows per worker transaction")
+    args = parser.parse_args(argv)
+
+    connection = connect(**DB_CONFIG)
+    try:
+        generator = ParallelGenerator(connection, args.processes, args.chunk)
+        for kind, rows, seconds in generator.generate(args.products, args.materials, args.consumations):
+            rate = rows / seconds if seconds else 0.0
+            print(f"[TASK2] {kind:<12} {rows:>12} rows  {seconds:9.2f} s  {rate:12.0f} rows/s")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
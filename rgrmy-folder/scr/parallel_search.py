@@ -0,0 +1,175 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+
+from psycopg2.pool import PoolError, ThreadedConnectionPool
+
+
+# The consumation search of Model.search_consumation; the shard version only
+# adds the id range of its shard in front of the filters.
+SEARCH_SQL = """
+    SELECT
+        c.id,
+        p.name AS product,
+        m.name AS material,
+        c.quatity
+    FROM "Consumation" c
+    JOIN "Product" p ON c.product1_id = p.id
+    JOIN material m ON c.material_id = m.id
+    WHERE {id_range}
+        (%s = '' OR p.name ILIKE %s)
+    AND
+        (%s = '' OR m.name ILIKE %s)
+    ORDER BY c.id
+"""
+
+FULL_SEARCH_SQL = SEARCH_SQL.format(id_range="")
+SHARD_SEARCH_SQL = SEARCH_SQL.format(id_range="c.id >= %s AND c.id < %s AND")
+
+
+def search_args(product_like, material_like):
+    return [
+        product_like, f"%{product_like}%",
+        material_like, f"%{material_like}%"
+    ]
+
+
+class SearchCancelled(Exception):
+    pass
+
+
+class WaitingPool:
+    # ThreadedConnectionPool that makes getconn wait up to timeout seconds
+    # for a free connection instead of raising PoolError at once, and keeps
+    # the connections it handed out so cancel() can reach their queries.
+    def __init__(self, maxconn, timeout=30, **config):
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._pool = ThreadedConnectionPool(1, maxconn, **config)
+        self._free = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._out = set()
+
+    def getconn(self):
+        if not self._free.acquire(timeout=self.timeout):
+            raise PoolError(f"No free pooled connection within {self.timeout} s")
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._free.release()
+            raise
+        with self._lock:
+            self._out.add(conn)
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            self._out.discard(conn)
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            self._free.release()
+
+    def cancel(self):
+        with self._lock:
+            busy = list(self._out)
+        for conn in busy:
+            if conn.closed == 0:
+                conn.cancel()
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class ParallelSearch:
+    # Splits the consumation id range into `workers` shards and runs the
+    # search for each shard on its own pooled connection. With model, every
+    # query gets the model's statement timeouts and goes to its slow log,
+    # and none starts once the model is cancelled (Model.cancel() cancels
+    # the running ones through the pool).
+    def __init__(self, pool, workers=4, model=None):
+        self.pool = pool
+        self.workers = workers
+        self.model = model
+
+    def _with_connection(self, fn):
+        conn = self.pool.getconn()
+        try:
+            return fn(conn)
+        finally:
+            conn.rollback()
+            self.pool.putconn(conn)
+
+    def _run(self, conn, name, query, data=None, gather_workers=None):
+        # -> (rows, ms) of one query in conn's current transaction
+        model = self.model
+        if model is not None and model.cancelled:
+            raise SearchCancelled("Search cancelled")
+        with conn.cursor() as cur:
+            if gather_workers is not None:
+                cur.execute("SET LOCAL max_parallel_workers_per_gather = %s", (gather_workers,))
+            if model is not None:
+                model._apply_timeout(cur, name)
+            t0 = time.time()
+            try:
+                cur.execute(query, data)
+                rows = cur.fetchall()
+            except Exception as e:
+                if model is not None:
+                    conn.rollback()
+                    model._log_statement(name, query, data, None, t0, conn, e)
+                raise
+            ms = (time.time() - t0) * 1000
+            if model is not None:
+                model._log_statement(name, query, data, len(rows), t0, conn)
+            return rows, ms
+
+    def _id_range(self):
+        return self._with_connection(lambda conn: self._run(
+            conn, "search.consumation.id_range", 'SELECT min(id), max(id) FROM "Consumation"'
+        )[0][0])
+
+    def shards(self):
+        lo, hi = self._id_range()
+        if lo is None:
+            return []
+        step = max(1, -(-(hi - lo + 1) // self.workers))
+        return [(start, min(start + step, hi + 1)) for start in range(lo, hi + 1, step)]
+
+    def _search_shard(self, shard, product_like, material_like):
+        # one backend per shard, postgres' own gather would only compete with us
+        return self._with_connection(lambda conn: self._run(
+            conn, "search.consumation.parallel", SHARD_SEARCH_SQL,
+            list(shard) + search_args(product_like, material_like), 0
+        )[0])
+
+    def search(self, product_like, material_like):
+        t0 = time.time()
+        shards = self.shards()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(
+                lambda shard: self._search_shard(shard, product_like, material_like),
+                shards
+            ))
+        # shards are disjoint ascending id ranges, so concatenating them in
+        # shard order yields the same c.id ordering as the single query
+        rows = list(chain.from_iterable(results))
+        ms = (time.time() - t0) * 1000
+        return rows, ms
+
+    def _timed_full_search(self, product_like, material_like, gather_workers):
+        return self._with_connection(lambda conn: self._run(
+            conn, "search.consumation.benchmark", FULL_SEARCH_SQL,
+            search_args(product_like, material_like), gather_workers
+        ))
+
+    def benchmark(self, product_like, material_like):
+        serial_rows, serial_ms = self._timed_full_search(product_like, material_like, 0)
+        pg_rows, pg_ms = self._timed_full_search(product_like, material_like, self.workers)
+        sharded_rows, sharded_ms = self.search(product_like, material_like)
+        return [
+            ("single backend", len(serial_rows), serial_ms),
+            (f"postgres parallel query ({self.workers} gather workers)", len(pg_rows), pg_ms),
+            (f"sharded thread pool ({self.workers} connections)", len(sharded_rows), sharded_ms),
+        ]
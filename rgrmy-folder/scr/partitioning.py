@@ -0,0 +1,263 @@
+import argparse
+import re
+
+from psycopg2 import connect
+
+from .change_feed import change_triggers_sql
+
+
+DEFAULT_PARTITION_SIZE = 1_000_000
+
+_BOUND_RE = re.compile(r"FROM \((\d+)\) TO \((\d+)\)")
+_SIZE_RE = re.compile(r"partition size (\d+)")
+
+
+def is_missing_partition(error):
+    # an insert past the last partition fails with check_violation but,
+    # unlike a CHECK constraint, names no constraint
+    diag = getattr(error, "diag", None)
+    return getattr(error, "pgcode", None) == "23514" and diag is not None and diag.constraint_name is None
+
+
+class ConsumationPartitions:
+    # "Consumation" is range partitioned by id: partition k holds
+    # ids [k * size + 1, (k + 1) * size + 1) and is named consumation_p<k>.
+    def __init__(self, connection):
+        self.connection = connection
+
+    def _select(self, query, data=None):
+        with self.connection.cursor() as cur:
+            cur.execute(query, data or ())
+            return cur.fetchall()
+
+    def is_partitioned(self):
+        rows = self._select("""
+            SELECT 1 FROM pg_partitioned_table
+            WHERE partrelid = to_regclass('"Consumation"')
+        """)
+        return bool(rows)
+
+    def partitions(self):
+        rows = self._select("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = '"Consumation"'::regclass
+        """)
+        result = []
+        for name, bound in rows:
+            match = _BOUND_RE.search(bound)
+            if match:
+                result.append((name, int(match.group(1)), int(match.group(2))))
+        return sorted(result, key=lambda p: p[1])
+
+    def partition_size(self):
+        # convert() records the size in the table comment, which outlives
+        # every partition purge may drop
+        rows = self._select("""SELECT obj_description('"Consumation"'::regclass, 'pg_class')""")
+        match = _SIZE_RE.search(rows[0][0] or "") if rows else None
+        if match:
+            return int(match.group(1))
+        parts = self.partitions()
+        if not parts:
+            return DEFAULT_PARTITION_SIZE
+        _, lo, hi = parts[0]
+        return hi - lo
+
+    def _last_id(self, cur):
+        cur.execute("""
+            SELECT coalesce(
+                pg_sequence_last_value(pg_get_serial_sequence('"Consumation"', 'id')),
+                0
+            )
+        """)
+        return cur.fetchone()[0]
+
+    def _increment(self, cur):
+        # N on a shard of N (sharding.prepare), so n rows use up n * N ids
+        cur.execute("""
+            SELECT seqincrement FROM pg_sequence
+            WHERE seqrelid = pg_get_serial_sequence('"Consumation"', 'id')::regclass
+        """)
+        row = cur.fetchone()
+        return row[0] if row else 1
+
+    def _create_partitions(self, cur, size, upto_id, last_id=0):
+        # only above the highest partition and from the one the next id
+        # (last_id + 1) falls in: ranges that purge dropped stay dropped,
+        # even when it dropped every partition
+        k = max([(hi - 1) // size for _, _, hi in self.partitions()] + [last_id // size])
+        created = []
+        while k * size + 1 <= upto_id:
+            name = f"consumation_p{k}"
+            cur.execute(
+                f'CREATE TABLE {name} PARTITION OF "Consumation" '
+                f'FOR VALUES FROM ({k * size + 1}) TO ({(k + 1) * size + 1}) '
+                f'WITH (fillfactor = 90)'
+            )
+            created.append(name)
+            k += 1
+        return created
+
+    # ==================== CONVERSION ====================
+
+    def convert(self, size=DEFAULT_PARTITION_SIZE):
+        if self.is_partitioned():
+            raise ValueError('"Consumation" is already partitioned')
+        cur = self.connection.cursor()
+        try:
+            cur.execute('LOCK TABLE "Consumation" IN ACCESS EXCLUSIVE MODE')
+            cur.execute('SELECT coalesce(max(id), 0) FROM "Consumation"')
+            max_id = cur.fetchone()[0]
+            last_id = max(max_id, self._last_id(cur))
+
+            cur.execute('ALTER TABLE "Consumation" RENAME TO "Consumation_unpartitioned"')
+            cur.execute("""
+                CREATE TABLE "Consumation"
+                (
+                    id integer NOT NULL,
+                    product1_id integer NOT NULL,
+                    material_id integer NOT NULL,
+                    quatity integer NOT NULL CHECK (quatity > 0)
+                ) PARTITION BY RANGE (id)
+            """)
+            cur.execute(f"""COMMENT ON TABLE "Consumation" IS 'Range partitioned by id, partition size {int(size)}'""")
+            # one spare partition; inserts that run past it have
+            # Model._execute_write create the next one
+            self._create_partitions(cur, size, last_id + size)
+
+            cur.execute("""
+                INSERT INTO "Consumation"(id, product1_id, material_id, quatity)
+                SELECT id, product1_id, material_id, quatity
+                FROM "Consumation_unpartitioned"
+            """)
+            moved = cur.rowcount
+            cur.execute('DROP TABLE "Consumation_unpartitioned"')
+
+            # constraints and indexes are built once, after the bulk copy
+            cur.execute('ALTER TABLE "Consumation" ADD PRIMARY KEY (id)')
+            cur.execute("""
+                ALTER TABLE "Consumation"
+                    ADD FOREIGN KEY (product1_id) REFERENCES "Product" (id),
+                    ADD FOREIGN KEY (material_id) REFERENCES material (id)
+            """)
+            cur.execute("""
+                CREATE INDEX consumation_product_bom_idx
+                ON "Consumation" (product1_id) INCLUDE (id, material_id, quatity)
+            """)
+            cur.execute("""
+                CREATE INDEX consumation_material_used_idx
+                ON "Consumation" (material_id) INCLUDE (id, product1_id, quatity)
+            """)
+
+            cur.execute("CREATE SEQUENCE consumation_id_seq AS integer")
+            cur.execute('ALTER SEQUENCE consumation_id_seq OWNED BY "Consumation".id')
+            cur.execute("""
+                ALTER TABLE "Consumation"
+                    ALTER COLUMN id SET DEFAULT nextval('consumation_id_seq')
+            """)
+            if last_id:
+                cur.execute("SELECT setval('consumation_id_seq', %s)", (last_id,))
+
+            # the change feed triggers went away with the old table
+            cur.execute("SELECT to_regprocedure('notify_change()') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute(change_triggers_sql("consumation"))
+            self.connection.commit()
+            return moved
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+
+    # ==================== GENERATION ====================
+
+    def ensure_capacity(self, n, commit=True):
+        # commit=False leaves the caller's transaction (a Model unit of work) open
+        if not self.is_partitioned():
+            if commit:
+                self.connection.commit()
+            return []
+        size = self.partition_size()
+        cur = self.connection.cursor()
+        try:
+            last_id = self._last_id(cur)
+            created = self._create_partitions(cur, size, last_id + n * self._increment(cur) + size, last_id)
+            if commit:
+                self.connection.commit()
+            return created
+        except Exception:
+            if commit:
+                self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+
+    # ==================== PURGE ====================
+
+    def purge(self, id_from, id_to, commit=True):
+        # ids in [id_from, id_to): whole partitions are dropped,
+        # only the partially covered edges fall back to DELETE.
+        # -> (dropped partition names, rows removed in all)
+        dropped = []
+        deleted = 0
+        cur = self.connection.cursor()
+        try:
+            for name, lo, hi in self.partitions():
+                if lo >= id_from and hi <= id_to:
+                    cur.execute(f'ALTER TABLE "Consumation" DETACH PARTITION {name}')
+                    # counted once detached, when no insert can reach it any more
+                    cur.execute(f"SELECT count(*) FROM {name}")
+                    deleted += cur.fetchone()[0]
+                    cur.execute(f"DROP TABLE {name}")
+                    dropped.append(name)
+            cur.execute(
+                'DELETE FROM "Consumation" WHERE id >= %s AND id < %s',
+                (id_from, id_to)
+            )
+            deleted += cur.rowcount
+            if commit:
+                self.connection.commit()
+            return dropped, deleted
+        except Exception:
+            if commit:
+                self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+
+
+def main(argv=None):
+    from .model import DB_CONFIG
+
+    parser = argparse.ArgumentParser(prog="python -m scr.partitioning")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help='partition the existing "Consumation" table')
+    convert.add_argument("--size", type=int, default=DEFAULT_PARTITION_SIZE,
+                         help="ids per partition")
+    sub.add_parser("list", help="show partitions and their id ranges")
+    purge = sub.add_parser("purge", help="remove consumations with id in [from, to)")
+    purge.add_argument("--from", dest="id_from", type=int, required=True)
+    purge.add_argument("--to", dest="id_to", type=int, required=True)
+    args = parser.parse_args(argv)
+
+    connection = connect(**DB_CONFIG)
+    try:
+        partitions = ConsumationPartitions(connection)
+        if args.command == "convert":
+            moved = partitions.convert(args.size)
+            print(f"[PARTITION] Moved {moved} rows into {len(partitions.partitions())} partitions")
+        elif args.command == "list":
+            for name, lo, hi in partitions.partitions():
+                print(f"{name:<24} [{lo}, {hi})")
+        else:
+            dropped, deleted = partitions.purge(args.id_from, args.id_to)
+            print(f"[PARTITION] Dropped partitions: {', '.join(dropped) or '-'}")
+            print(f"[PARTITION] Rows removed: {deleted}")
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
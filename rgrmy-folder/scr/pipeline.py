@@ -0,0 +1,191 @@
+import argparse
+import json
+import time
+from collections import namedtuple
+
+try:
+    import psycopg
+except ImportError:  # psycopg 3 is optional, the rest of the app runs on psycopg2
+    psycopg = None
+
+
+# kind is create/update/delete; args as for the Model method:
+#   create:  the column values, e.g. (name, description)
+#   update:  (record_id, field, value)
+#   delete:  (record_id,)
+Operation = namedtuple("Operation", "kind table args")
+
+# rows: what the statement returned (empty when nothing matched); error is
+# set instead when the operation failed
+OperationResult = namedtuple("OperationResult", "operation rows error")
+
+
+class PipelineExecutor:
+    # Sends a batch of Model operations over one psycopg 3 connection in
+    # libpq pipeline mode: every statement goes out before the first result
+    # is read, so a batch costs one round trip instead of one per operation.
+    # The batch is one transaction. If an operation fails, the others are
+    # rolled back with it and sent again without it, so the committed rows
+    # are exactly those of the operations reported without an error. Only
+    # the first failure of a send is known (the rest of the pipeline is
+    # aborted), so a batch with k failing operations costs k + 1 round
+    # trips; keep batches small where many operations are expected to fail.
+    def __init__(self, model):
+        if psycopg is None:
+            raise ImportError("pipeline mode needs psycopg 3: pip install 'psycopg[binary]'")
+        self.model = model
+        config = {("dbname" if key == "database" else key): value for key, value in model.config.items()}
+        self.connection = psycopg.connect(**config)
+        self.round_trips = 0
+
+    def close(self):
+        self.connection.close()
+
+    def _statement(self, op):
+        # every statement returns rows, so fetching them pins each result
+        # (or error) to its operation
+        if op.kind == "create":
+            sql, params = self.model.insert_queries[op.table], tuple(op.args)
+        elif op.kind == "update":
+            record_id, field, value = op.args
+            sql = self.model.update_queries[op.table].get(field)
+            if not sql:
+                raise ValueError(f"Unknown field {field} for table {op.table}")
+            params = (value, record_id)
+        elif op.kind == "delete":
+            sql, params = self.model.delete_queries[op.table], (op.args[0],)
+        else:
+            raise ValueError(f"Unknown operation {op.kind}")
+        if "RETURNING" not in sql:
+            sql = sql.rstrip() + " RETURNING id"
+        return sql, params
+
+    def _send(self, statements, pending):
+        # -> (rows by index, (index, error) of the first failure or None)
+        rows = {}
+        failed = None
+        # a server error of an earlier statement that surfaced in a later
+        # execute() instead of in its own fetch
+        earlier = None
+        try:
+            with self.connection.pipeline():
+                cursors = []
+                for i in pending:
+                    cur = self.connection.cursor()
+                    try:
+                        cur.execute(*statements[i])
+                    except psycopg.Error as e:
+                        if e.sqlstate is None and not isinstance(e, psycopg.errors.PipelineAborted):
+                            # refused before it was sent, e.g. a value that
+                            # cannot be adapted; nothing after it is queued
+                            failed = (i, e)
+                        else:
+                            earlier = e
+                        break
+                    cursors.append((i, cur))
+                for i, cur in cursors:
+                    try:
+                        rows[i] = cur.fetchall()
+                    except psycopg.errors.PipelineAborted:
+                        pass
+                    except psycopg.Error as e:
+                        if failed is None or i < failed[0]:
+                            # the cursor of a statement whose error was
+                            # already raised only reports a missing result
+                            failed = (i, earlier if earlier is not None and e.sqlstate is None else e)
+        except psycopg.Error:
+            if failed is None:
+                raise
+        if failed is None and earlier is not None:
+            raise earlier
+        self.round_trips += 1
+        return rows, failed
+
+    def execute(self, operations):
+        operations = list(operations)
+        results = [None] * len(operations)
+        statements = {}
+        for i, op in enumerate(operations):
+            try:
+                statements[i] = self._statement(op)
+            except (ValueError, KeyError) as e:
+                results[i] = OperationResult(op, None, e)
+        pending = list(statements)
+        while pending:
+            rows, failed = self._send(statements, pending)
+            if failed is None:
+                self.connection.commit()
+                if self.model.router:
+                    # replica reads must wait for these writes too
+                    self.model.router.note_write(self.connection)
+                for i in pending:
+                    results[i] = OperationResult(operations[i], rows[i], None)
+                break
+            self.connection.rollback()
+            i, error = failed
+            results[i] = OperationResult(operations[i], None, error)
+            pending.remove(i)
+        self._apply_to_model([r for r in results if r.error is None])
+        return results
+
+    def _apply_to_model(self, committed):
+        # the same bookkeeping Model does after its own writes
+        clear_bom = False
+        for op, rows, _ in committed:
+            if not rows:
+                continue
+            index = self.model.name_indexes.get(op.table)
+            if index is not None and index.loaded:
+                if op.kind == "create":
+                    index.add(rows[0][0], op.args[0])
+                elif op.kind == "update" and op.args[1] == "name":
+                    index.rename(op.args[0], op.args[2])
+                elif op.kind == "delete":
+                    index.remove(op.args[0])
+            if op.table == "consumation" or (op.table == "material" and op.kind == "update") \
+                    or (op.table == "product" and op.kind == "delete"):
+                clear_bom = True
+        if clear_bom:
+            self.model.bom_cache.clear()
+
+
+def read_script(path):
+    # one JSON object per line: {"op": "update", "table": "material", "args": [3, "unit", "t"]}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield Operation(entry["op"], entry["table"], tuple(entry["args"]))
+
+
+def main(argv=None):
+    from .model import Model
+
+    parser = argparse.ArgumentParser(prog="python -m scr.pipeline")
+    parser.add_argument("script", help="JSON-lines file of operations")
+    parser.add_argument("--batch", type=int, default=500, help="operations per pipeline (and transaction)")
+    args = parser.parse_args(argv)
+
+    model = Model()
+    executor = PipelineExecutor(model)
+    done = failed = 0
+    t0 = time.time()
+    try:
+        operations = list(read_script(args.script))
+        for start in range(0, len(operations), args.batch):
+            for n, result in enumerate(executor.execute(operations[start:start + args.batch]), start + 1):
+                if result.error is not None:
+                    failed += 1
+                    print(f"[PIPELINE] #{n} {result.operation.kind} {result.operation.table} "
+                          f"{list(result.operation.args)}: {type(result.error).__name__}: {result.error}")
+                else:
+                    done += 1
+    finally:
+        executor.close()
+        model.disconnect()
+    print(f"[PIPELINE] {done} operations done, {failed} failed, "
+          f"{executor.round_trips} round trips, {(time.time() - t0) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+import argparse
+import csv
+import os
+import time
+
+from psycopg2 import connect
+
+
+ARCHIVE_COLUMNS = ("id", "product1_id", "material_id", "quatity")
+
+# More rows than change_feed.BULK_THRESHOLD per batch, so listeners get one
+# BULK_DELETE event per batch instead of one notification per row.
+DEFAULT_BATCH = 5000
+
+ARCHIVE_TABLES_SQL = """
+    -- no foreign keys: archived rows may outlive their product or material
+    CREATE TABLE consumation_archive
+    (
+        id integer PRIMARY KEY,
+        product1_id integer NOT NULL,
+        material_id integer NOT NULL,
+        quatity integer NOT NULL,
+        archived_at timestamptz NOT NULL DEFAULT now()
+    );
+
+    -- keyset position of every retention run, committed with each batch
+    CREATE TABLE retention_progress
+    (
+        job text PRIMARY KEY,
+        last_id integer NOT NULL,
+        moved bigint NOT NULL DEFAULT 0,
+        updated_at timestamptz NOT NULL DEFAULT now()
+    );
+"""
+
+
+class Retention:
+    # Moves consumations with id in [id_from, id_to) (and, if the table has a
+    # created_at column, older than older_than) out of the live table, batch
+    # rows per committed transaction, in id order. Each batch also stores the
+    # last id it moved under the job name, so a stopped run resumes there.
+    # With path the rows go to a CSV file instead of consumation_archive; a
+    # crash between writing a batch and committing it repeats that batch in
+    # the file on resume.
+    def __init__(self, connection, job, id_from=1, id_to=2 ** 31 - 1, older_than=None,
+                 batch=DEFAULT_BATCH, pause=0.0, max_rows_per_sec=None, path=None):
+        self.connection = connection
+        self.job = job
+        self.id_from = id_from
+        self.id_to = id_to
+        self.older_than = older_than
+        self.batch = batch
+        self.pause = pause
+        self.max_rows_per_sec = max_rows_per_sec
+        self.path = path
+
+    def _where(self, cur):
+        conditions = ["id > %s", "id < %s"]
+        if self.older_than is not None:
+            cur.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'Consumation' AND column_name = 'created_at'
+            """)
+            if cur.fetchone() is None:
+                raise ValueError('"Consumation" has no created_at column, use an id range')
+            conditions.append("created_at < now() - %s::interval")
+        return " AND ".join(conditions)
+
+    def _params(self, last_id):
+        params = [last_id, self.id_to]
+        if self.older_than is not None:
+            params.append(self.older_than)
+        return params
+
+    def position(self):
+        with self.connection.cursor() as cur:
+            cur.execute("SELECT last_id, moved FROM retention_progress WHERE job = %s", (self.job,))
+            row = cur.fetchone()
+        self.connection.commit()
+        return row or (self.id_from - 1, 0)
+
+    def dry_run(self):
+        # -> (rows, first id, last id) that a run would move from where it stands
+        last_id, _ = self.position()
+        with self.connection.cursor() as cur:
+            where = self._where(cur)
+            cur.execute(
+                f'SELECT count(*), min(id), max(id) FROM "Consumation" WHERE {where}',
+                self._params(last_id)
+            )
+            result = cur.fetchone()
+        self.connection.commit()
+        return result
+
+    def _move_batch(self, cur, where, last_id, writer):
+        columns = ", ".join(ARCHIVE_COLUMNS)
+        select = f"""
+            SELECT id FROM "Consumation" WHERE {where}
+            ORDER BY id LIMIT %s
+        """
+        params = self._params(last_id) + [self.batch]
+        if writer is None:
+            cur.execute(f"""
+                WITH moved AS (
+                    DELETE FROM "Consumation" WHERE id IN ({select})
+                    RETURNING {columns}
+                )
+                INSERT INTO consumation_archive({columns})
+                SELECT {columns} FROM moved
+                RETURNING id
+            """, params)
+            ids = [row[0] for row in cur.fetchall()]
+        else:
+            cur.execute(f"""
+                DELETE FROM "Consumation" WHERE id IN ({select})
+                RETURNING {columns}
+            """, params)
+            rows = sorted(cur.fetchall())
+            writer.writerows(rows)
+            ids = [row[0] for row in rows]
+        return ids
+
+    def run(self, progress=None, should_stop=None):
+        # -> rows moved by this call; progress(moved so far in the job, last id)
+        last_id, moved_total = self.position()
+        out = None
+        writer = None
+        if self.path:
+            new_file = not os.path.exists(self.path)
+            out = open(self.path, "a", newline="", encoding="utf-8")
+            writer = csv.writer(out)
+            if new_file:
+                writer.writerow(ARCHIVE_COLUMNS)
+        moved = 0
+        cur = self.connection.cursor()
+        try:
+            where = self._where(cur)
+            while not (should_stop and should_stop()):
+                t0 = time.time()
+                ids = self._move_batch(cur, where, last_id, writer)
+                if not ids:
+                    break
+                last_id = max(ids)
+                moved += len(ids)
+                moved_total += len(ids)
+                cur.execute("""
+                    INSERT INTO retention_progress(job, last_id, moved) VALUES (%s, %s, %s)
+                    ON CONFLICT (job) DO UPDATE
+                    SET last_id = EXCLUDED.last_id, moved = EXCLUDED.moved, updated_at = now()
+                """, (self.job, last_id, moved_total))
+                if out:
+                    # the file holds the batch before the database forgets it
+                    out.flush()
+                    os.fsync(out.fileno())
+                self.connection.commit()
+                if progress:
+                    progress(moved_total, last_id)
+                self._throttle(len(ids), time.time() - t0)
+            self.connection.commit()
+            return moved
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cur.close()
+            if out:
+                out.close()
+
+    def _throttle(self, rows, elapsed):
+        # pause between batches gives other writers the locks and autovacuum
+        # time to catch up; max_rows_per_sec stretches it further if needed
+        delay = self.pause
+        if self.max_rows_per_sec:
+            delay = max(delay, rows / self.max_rows_per_sec - elapsed)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def main(argv=None):
+    from .model import DB_CONFIG
+
+    parser = argparse.ArgumentParser(prog="python -m scr.retention")
+    parser.add_argument("--job", help="name under which the position is kept (default: derived from the policy)")
+    parser.add_argument("--from", dest="id_from", type=int, default=1, help="first id to move")
+    parser.add_argument("--to", dest="id_to", type=int, default=2 ** 31 - 1, help="move ids below this one")
+    parser.add_argument("--older-than", help="age policy, e.g. '90 days' (needs a created_at column)")
+    parser.add_argument("--file", help="append the rows to this CSV file instead of consumation_archive")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH, help="rows per committed batch")
+    parser.add_argument("--pause", type=float, default=0.1, help="seconds to wait between batches")
+    parser.add_argument("--max-rows-per-sec", type=float, help="upper bound on the move rate")
+    parser.add_argument("--dry-run", action="store_true", help="only count what would be moved")
+    parser.add_argument("--vacuum", action="store_true", help='VACUUM ANALYZE "Consumation" when done')
+    args = parser.parse_args(argv)
+
+    job = args.job or f"{args.id_from}-{args.id_to}-{args.older_than or 'all'}-{'file' if args.file else 'table'}"
+    connection = connect(**DB_CONFIG)
+    try:
+        retention = Retention(connection, job, args.id_from, args.id_to, args.older_than,
+                              args.batch, args.pause, args.max_rows_per_sec, args.file)
+        last_id, moved = retention.position()
+        if moved:
+            print(f"[RETENTION] Resuming job {job} after id {last_id} ({moved} rows moved before)")
+        if args.dry_run:
+            rows, first, last = retention.dry_run()
+            print(f"[RETENTION] Would move {rows} rows (ids {first}..{last}) in batches of {args.batch}")
+            return
+        try:
+            moved = retention.run(
+                lambda total, last: print(f"\r[RETENTION] {total} rows moved, up to id {last}", end="", flush=True)
+            )
+            print(f"\n[RETENTION] Done: {moved} rows moved")
+        except KeyboardInterrupt:
+            print(f"\n[RETENTION] Stopped; run again with --job {job} to resume")
+            return
+        if args.vacuum:
+            connection.autocommit = True
+            with connection.cursor() as cur:
+                cur.execute('VACUUM (ANALYZE) "Consumation"')
+            print('[RETENTION] VACUUM ANALYZE "Consumation" done')
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
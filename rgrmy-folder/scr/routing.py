@@ -0,0 +1,103 @@
+import itertools
+import threading
+import time
+
+from psycopg2 import connect
+
+
+class Replica:
+    def __init__(self, config, retry_after=30.0):
+        self.config = config
+        self.retry_after = retry_after
+        self.latency_ms = None
+        self.down_until = 0.0
+        self._connection = None
+
+    @property
+    def name(self):
+        return f"{self.config.get('host')}:{self.config.get('port')}"
+
+    @property
+    def available(self):
+        return time.time() >= self.down_until
+
+    def connection(self):
+        if self._connection is None or self._connection.closed:
+            self._connection = connect(**self.config)
+            self._connection.set_session(readonly=True)
+        return self._connection
+
+    def mark_down(self):
+        self.down_until = time.time() + self.retry_after
+        self.close()
+
+    def record_latency(self, ms, alpha=0.2):
+        # exponentially weighted, so one slow query does not flip the choice
+        self.latency_ms = ms if self.latency_ms is None else (1 - alpha) * self.latency_ms + alpha * ms
+
+    def close(self):
+        if self._connection is not None and self._connection.closed == 0:
+            self._connection.close()
+        self._connection = None
+
+
+class ReplicaRouter:
+    # Picks a streaming replica for reads. With read_your_writes, a replica is
+    # only used once it has replayed the WAL position of this process's last
+    # committed write; until then reads stay on the primary.
+    STRATEGIES = ("round_robin", "least_latency")
+
+    def __init__(self, replica_configs, strategy="round_robin", read_your_writes=True):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown routing strategy {strategy}")
+        self.replicas = [Replica(config) for config in replica_configs]
+        self.strategy = strategy
+        self.read_your_writes = read_your_writes
+        self.last_write_lsn = None
+        self.routed = {"primary": 0}
+        self._cycle = itertools.cycle(self.replicas)
+        self._lock = threading.Lock()
+
+    def note_write(self, primary_connection):
+        if not self.read_your_writes:
+            return
+        with primary_connection.cursor() as cur:
+            cur.execute("SELECT pg_current_wal_lsn()::text")
+            self.last_write_lsn = cur.fetchone()[0]
+        primary_connection.commit()
+
+    def _caught_up(self, replica):
+        if self.last_write_lsn is None:
+            return True
+        conn = replica.connection()
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn", (self.last_write_lsn,))
+            caught_up = cur.fetchone()[0]
+        conn.commit()
+        return bool(caught_up)
+
+    def _candidates(self):
+        available = [r for r in self.replicas if r.available]
+        if self.strategy == "least_latency":
+            # unmeasured replicas go first so every one gets a latency sample
+            return sorted(available, key=lambda r: -1 if r.latency_ms is None else r.latency_ms)
+        with self._lock:
+            start = next(self._cycle)
+        index = self.replicas.index(start)
+        ordered = self.replicas[index:] + self.replicas[:index]
+        return [r for r in ordered if r.available]
+
+    def pick(self):
+        for replica in self._candidates():
+            try:
+                if self._caught_up(replica):
+                    self.routed[replica.name] = self.routed.get(replica.name, 0) + 1
+                    return replica
+            except Exception:
+                replica.mark_down()
+        self.routed["primary"] += 1
+        return None
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
@@ -0,0 +1,375 @@
+import argparse
+import json
+import queue
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .lock_diagnostics import is_retryable
+from .model import Model
+from .sharding import open_model
+
+
+# ETag of a whole reference table: its change counter (migration 3), bumped
+# in the same transaction as every write, so a 304 costs one index lookup.
+# It is read before the rows, so a write committed in between only makes the
+# next request download again.
+TABLE_ETAG_SQL = "SELECT version FROM table_version WHERE name = %s"
+ETAG_TABLES = ("product", "material")
+
+TABLES = ("product", "material", "consumation")
+
+GENERATORS = {
+    "products": "generate_products",
+    "materials": "generate_materials",
+    "consumations": "generate_consumations",
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class ModelPool:
+    # Every Model owns one connection (a ShardedModel one per shard), so a
+    # pooled Model is a pooled connection. Models are opened on demand up to
+    # size; a request that finds none free waits for one to come back.
+    def __init__(self, size=8, slow_log=None, timeout=30):
+        self.size = size
+        self.slow_log = slow_log
+        self.timeout = timeout
+        self._free = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        model = open_model(slow_log=self.slow_log)
+        model.verbose = False
+        # one private BOM cache per connection would miss the writes made
+        # through the others, so pooled models always read the totals
+        model.bom_cache.max_entries = 0
+        return model
+
+    @contextmanager
+    def model(self):
+        try:
+            model = self._free.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                grow = self._opened < self.size
+                if grow:
+                    self._opened += 1
+            if grow:
+                try:
+                    model = self._open()
+                except Exception:
+                    with self._lock:
+                        self._opened -= 1
+                    raise
+            else:
+                try:
+                    model = self._free.get(timeout=self.timeout)
+                except queue.Empty:
+                    raise HttpError(503, "No free database connection", {"Retry-After": "1"})
+        model.last_error = None
+        model.reset_cancel()
+        try:
+            yield model
+        finally:
+            model.release()
+            self._free.put(model)
+
+    def close(self):
+        while True:
+            try:
+                self._free.get_nowait().disconnect()
+            except queue.Empty:
+                break
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # Routes mirror Controller.available:
+    #   POST   /create/<table>                JSON object of column values
+    #   GET    /read/<table>                  NDJSON stream, ETag for product/material
+    #   GET    /read/<table>/<id>             one row, ETag = row version
+    #   PATCH  /update/<table>/<id>           {"field": ..., "value": ...}, optional If-Match
+    #   DELETE /delete/<table>/<id>           ?cascade=1 also deletes its consumations
+    #   POST   /task_2/<products|materials|consumations>   {"n": ...}
+    #   GET    /task_3/search_consumations?product=&material=   NDJSON stream
+    #   GET    /task_3/faceted_search?product=&material=&limit=&offset=
+    #   GET    /task_3/product_bom/<id>
+    #   GET    /task_3/material_where_used/<id>
+    protocol_version = "HTTP/1.1"
+    pool = None
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    # ---------- plumbing ----------
+
+    def _route(self, method):
+        url = urlsplit(self.path)
+        parts = [p for p in url.path.split("/") if p]
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self._streaming = False
+        try:
+            handler = getattr(self, f"_{method}_{parts[0]}", None) if parts else None
+            if handler is None:
+                raise HttpError(404, f"No route for {method} {url.path}")
+            with self.pool.model() as model:
+                handler(model, parts[1:], query)
+        except Exception as e:
+            if self._streaming:
+                # headers are gone already, all that is left is to hang up
+                self.close_connection = True
+            elif isinstance(e, HttpError):
+                self._send_json(e.status, {"error": str(e)}, e.headers)
+            elif isinstance(e, (ValueError, KeyError, IndexError)):
+                self._send_json(400, {"error": f"{type(e).__name__}: {e}"})
+            else:
+                self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def do_GET(self):
+        self._route("get")
+
+    def do_POST(self):
+        self._route("post")
+
+    def do_PATCH(self):
+        self._route("patch")
+
+    def do_DELETE(self):
+        self._route("delete")
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, rows, model, headers=None):
+        # one JSON array per line, sent with chunked transfer encoding;
+        # a failure after the headers went out ends the stream with an
+        # {"error": ...} line
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self._streaming = True
+        buf = []
+        try:
+            for row in rows:
+                buf.append(json.dumps(row, default=str))
+                if len(buf) >= 500:
+                    self._write_chunk(buf)
+                    buf = []
+        finally:
+            # a client that went away leaves the generator (and its
+            # server-side cursor) half read
+            rows.close()
+        if model.last_error is not None:
+            buf.append(json.dumps({"error": str(model.last_error)}))
+        self._write_chunk(buf)
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, lines):
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode()
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+    def _not_modified(self, etag):
+        if self.headers.get("If-None-Match") != etag:
+            return False
+        self.send_response(304)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        return True
+
+    @staticmethod
+    def _check_error(model):
+        error = model.last_error
+        if error is None:
+            return
+        if is_retryable(error):
+            raise HttpError(503, str(error), {"Retry-After": "1"})
+        # 23xxx: integrity constraint violations (foreign keys, checks)
+        if (getattr(error, "pgcode", None) or "").startswith("23"):
+            raise HttpError(409, str(error))
+        raise HttpError(500, str(error))
+
+    @staticmethod
+    def _table(parts):
+        if not parts or parts[0] not in TABLES:
+            raise HttpError(404, f"Unknown table {parts[0] if parts else ''}")
+        return parts[0]
+
+    # ---------- create / read / update / delete ----------
+
+    def _post_create(self, model, parts, query):
+        table = self._table(parts)
+        body = self._body()
+        if table == "product":
+            created = model.create_product(body["name"], body.get("description", ""))
+        elif table == "material":
+            created = model.create_material(body["name"], body["price_per_unit"], body["unit"])
+        else:
+            created = model.create_consumation(
+                int(body["product1_id"]), int(body["material_id"]), body["quatity"]
+            )
+        self._check_error(model)
+        self._send_json(201, {"created": created})
+
+    def _get_read(self, model, parts, query):
+        table = self._table(parts)
+        if len(parts) > 1:
+            found = model.get_versioned(table, int(parts[1]))
+            self._check_error(model)
+            if found is None:
+                raise HttpError(404, f"No {table} with id={parts[1]}")
+            version, row = found
+            etag = f'"{version}"'
+            if self._not_modified(etag):
+                return
+            self._send_json(200, row, {"ETag": etag})
+            return
+        headers = {}
+        if table in ETAG_TABLES:
+            rows = model._execute_select(TABLE_ETAG_SQL, (table,), f"read.{table}.etag", primary=True)
+            self._check_error(model)
+            if rows:
+                etag = f'"{table}-{rows[0][0]}"'
+                if self._not_modified(etag):
+                    return
+                headers["ETag"] = etag
+        self._send_stream(model.read_iter(table), model, headers)
+
+    def _patch_update(self, model, parts, query):
+        table = self._table(parts)
+        record_id = int(parts[1])
+        body = self._body()
+        field, value = body["field"], body["value"]
+        if field not in model.update_queries[table]:
+            raise HttpError(400, f"Unknown field {field} for table {table}")
+        if_match = self.headers.get("If-Match")
+        if if_match is None:
+            affected = model.update_field(table, record_id, field, value)
+            self._check_error(model)
+            if not affected:
+                raise HttpError(404, f"No {table} with id={record_id}")
+            self._send_json(200, {"updated": affected})
+            return
+        status, version = model.update_field_checked(table, record_id, field, value, if_match.strip('"'))
+        if status == Model.NOT_FOUND:
+            raise HttpError(404, f"No {table} with id={record_id}")
+        if status == Model.CONFLICT:
+            raise HttpError(412, "Record was changed by someone else", {"ETag": f'"{version}"'})
+        self._send_json(200, {"updated": 1}, {"ETag": f'"{version}"'})
+
+    def _delete_delete(self, model, parts, query):
+        table = self._table(parts)
+        record_id = int(parts[1])
+        children = 0
+        if query.get("cascade") == "1" and table != "consumation":
+            children, deleted = model.delete_cascade(table, record_id)
+        else:
+            deleted = model.delete(table, record_id)
+        self._check_error(model)
+        if not deleted:
+            raise HttpError(404, f"No {table} with id={record_id}")
+        self._send_json(200, {"deleted": deleted, "consumations_deleted": children})
+
+    # ---------- task 2: generation ----------
+
+    def _post_task_2(self, model, parts, query):
+        if not parts or parts[0] not in GENERATORS:
+            raise HttpError(404, f"Unknown generator {parts[0] if parts else ''}")
+        n = int(self._body()["n"])
+        created = getattr(model, GENERATORS[parts[0]])(n)
+        self._check_error(model)
+        self._send_json(201, {"created": created})
+
+    # ---------- task 3: search ----------
+
+    def _get_task_3(self, model, parts, query):
+        action = parts[0] if parts else ""
+        product_like, material_like = query.get("product", ""), query.get("material", "")
+        if action == "search_consumations":
+            self._send_stream(model.search_consumation_iter(product_like, material_like), model)
+            return
+        if action == "faceted_search":
+            result, ms = model.search_consumation_faceted(
+                product_like, material_like, int(query.get("limit", 50)), int(query.get("offset", 0))
+            )
+            self._check_error(model)
+            self._send_json(200, {**result, "ms": ms})
+            return
+        if action == "product_bom":
+            product_id = int(parts[1])
+            rows = model.product_bom(product_id)
+            qty, cost, lines = model.product_totals(product_id)
+            self._check_error(model)
+            self._send_json(200, {"rows": rows, "quantity": qty, "cost": cost, "lines": lines})
+            return
+        if action == "material_where_used":
+            rows = model.material_where_used(int(parts[1]))
+            self._check_error(model)
+            self._send_json(200, {"rows": rows})
+            return
+        raise HttpError(404, f"Unknown search {action}")
+
+
+class Service(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, pool, verbose=True):
+        handler = type("BoundServiceHandler", (ServiceHandler,), {"pool": pool})
+        super().__init__(address, handler)
+        self.pool = pool
+        self.verbose = verbose
+
+    def server_close(self):
+        super().server_close()
+        self.pool.close()
+
+
+def main(argv=None):
+    from .slow_log import SlowQueryLog
+
+    parser = argparse.ArgumentParser(prog="python -m scr.service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pool-size", type=int, default=8, help="database connections shared by all requests")
+    parser.add_argument("--slow-log", metavar="PATH", help="log slow statements to this JSON-lines file")
+    parser.add_argument("--quiet", action="store_true", help="do not log every request")
+    args = parser.parse_args(argv)
+
+    slow_log = SlowQueryLog(args.slow_log) if args.slow_log else None
+    service = Service((args.host, args.port), ModelPool(args.pool_size, slow_log), not args.quiet)
+    print(f"[HTTP] Serving on http://{args.host}:{args.port} with {args.pool_size} connections")
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,586 @@
+import argparse
+import heapq
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .model import Model
+
+
+# One entry per shard database, e.g.
+# [{**DB_CONFIG, "database": "shard0"}, {**DB_CONFIG, "database": "shard1"}]
+SHARD_CONFIGS = []
+
+# tables copied in full to every shard -> (table, columns)
+REPLICATED = {
+    "product": ('"Product"', "id, name, description"),
+    "material": ("material", "id, name, price_per_unit, unit"),
+}
+
+
+class ShardMismatch(Exception):
+    # a write reached some shards and not others and could not be undone;
+    # python -m scr.sharding resync copies shard 0's tables over again
+    def __init__(self, message, table, shards):
+        hint = f"; run python -m scr.sharding resync {table}" if table in REPLICATED else ""
+        super().__init__(f"{message} (shards {', '.join(map(str, shards))}){hint}")
+        self.table = table
+        self.shards = shards
+
+
+def open_model(slow_log=None):
+    # the Model the app works with: sharded once SHARD_CONFIGS lists shards
+    if SHARD_CONFIGS:
+        return ShardedModel(slow_log=slow_log)
+    return Model(slow_log=slow_log)
+
+
+class _BomCaches:
+    # the shards' BOM caches, as far as Controller and the service use one
+    def __init__(self, shards):
+        self.shards = shards
+
+    def clear(self):
+        for shard in self.shards:
+            shard.bom_cache.clear()
+
+    @property
+    def max_entries(self):
+        return self.shards[0].bom_cache.max_entries
+
+    @max_entries.setter
+    def max_entries(self, value):
+        for shard in self.shards:
+            shard.bom_cache.max_entries = value
+
+
+class ShardedModel:
+    # "Consumation" rows live on shard product1_id % N, together with every
+    # row of the small "Product" and material tables, which are replicated to
+    # all shards with identical ids. Shard 0 owns the product/material id
+    # sequences; each shard's consumation sequence hands out ids k+1, k+1+N,
+    # ... so consumation ids never collide across shards.
+    # It offers the Model methods Controller, the jobs and the HTTP service
+    # call (open_model picks it when shards are configured); reads of the
+    # replicated tables, the name index and typeahead use shard 0.
+    NOT_FOUND = Model.NOT_FOUND
+    CONFLICT = Model.CONFLICT
+    UPDATED = Model.UPDATED
+
+    def __init__(self, shard_configs=None, slow_log=None):
+        configs = shard_configs or SHARD_CONFIGS
+        if not configs:
+            raise ValueError("No shards configured")
+        self.shards = [Model(slow_log=slow_log, replicas=[], config=config) for config in configs]
+        self.executor = ThreadPoolExecutor(max_workers=len(self.shards))
+        self.bom_cache = _BomCaches(self.shards)
+        # (table, where, params, shard numbers) of writes left diverged
+        self.diverged = []
+
+    @property
+    def reference(self):
+        return self.shards[0]
+
+    def shard_for(self, product_id):
+        return self.shards[int(product_id) % len(self.shards)]
+
+    def _scatter(self, fn):
+        return list(self.executor.map(fn, self.shards))
+
+    # ==================== BASIC ====================
+
+    def disconnect(self):
+        for shard in self.shards:
+            shard.disconnect()
+        self.executor.shutdown()
+
+    def cancel(self):
+        for shard in self.shards:
+            shard.cancel()
+
+    def reset_cancel(self):
+        for shard in self.shards:
+            shard.reset_cancel()
+
+    @property
+    def cancelled(self):
+        return any(shard.cancelled for shard in self.shards)
+
+    def release(self):
+        for shard in self.shards:
+            shard.release()
+
+    @property
+    def verbose(self):
+        return self.reference.verbose
+
+    @verbose.setter
+    def verbose(self, value):
+        for shard in self.shards:
+            shard.verbose = value
+
+    @property
+    def profiler(self):
+        return self.reference.profiler
+
+    @profiler.setter
+    def profiler(self, value):
+        for shard in self.shards:
+            shard.profiler = value
+
+    @property
+    def update_queries(self):
+        return self.reference.update_queries
+
+    def _execute_select(self, query, data=None, name=None, primary=False):
+        # for the replicated tables, which every shard holds in full
+        return self.reference._execute_select(query, data, name, primary)
+
+    @property
+    def last_error(self):
+        return next((s.last_error for s in self.shards if s.last_error is not None), None)
+
+    @last_error.setter
+    def last_error(self, value):
+        for shard in self.shards:
+            shard.last_error = value
+
+    @property
+    def lock_retries(self):
+        return self.reference.lock_retries
+
+    def lock_snapshots(self):
+        return [snap for shard in self.shards for snap in shard.lock_snapshots()]
+
+    def enable_lock_diagnostics(self, threshold_ms=1000):
+        for shard in self.shards:
+            shard.enable_lock_diagnostics(threshold_ms)
+
+    def prepare(self):
+        # interleave the consumation sequences: shard k hands out ids = k+1 (mod N)
+        n = len(self.shards)
+        for k, shard in enumerate(self.shards):
+            with shard.connection.cursor() as cur:
+                cur.execute("""SELECT pg_get_serial_sequence('"Consumation"', 'id')""")
+                sequence = cur.fetchone()[0]
+                cur.execute('SELECT coalesce(max(id), 0) FROM "Consumation"')
+                max_id = cur.fetchone()[0]
+                start = max_id + 1 + (k - max_id) % n
+                cur.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY {n}")
+                cur.execute("SELECT setval(%s, %s, false)", (sequence, start))
+            shard.connection.commit()
+
+    # ==================== REPLICATED TABLES ====================
+
+    @staticmethod
+    def _run(shard, fn):
+        # fn(cursor) in one committed transaction of shard, rolled back on error
+        try:
+            with shard.connection.cursor() as cur:
+                result = fn(cur)
+            shard.connection.commit()
+            return result
+        except Exception:
+            shard.connection.rollback()
+            raise
+
+    def _replicate(self, kind, where, params):
+        # Copies rows just committed on shard 0 to every other shard, same
+        # ids. If a shard fails, the rows are deleted again everywhere they
+        # landed, shard 0 included, and the error is raised; a shard that
+        # cannot be cleaned up either is recorded and raises ShardMismatch.
+        table, columns = REPLICATED[kind]
+        buf = io.StringIO()
+        landed = [0]
+        try:
+            self._run(self.reference, lambda cur: cur.copy_expert(
+                cur.mogrify(f"COPY (SELECT {columns} FROM {table} WHERE {where}) TO STDOUT", params).decode(),
+                buf
+            ))
+            for k, shard in enumerate(self.shards[1:], 1):
+                buf.seek(0)
+                self._run(shard, lambda cur: cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN", buf))
+                landed.append(k)
+        except Exception as e:
+            self.reference._report_error("MODIFY", e)
+            left = []
+            for k in landed:
+                try:
+                    self._run(self.shards[k], lambda cur: cur.execute(f"DELETE FROM {table} WHERE {where}", params))
+                except Exception:
+                    left.append(k)
+            if left:
+                self.diverged.append((kind, where, params, left))
+                raise ShardMismatch(f"Could not copy {kind} rows where {where} {params} to every shard "
+                                    f"nor remove them again", kind, left) from e
+            raise
+
+    def _replicated_insert(self, kind, data):
+        row = self.reference._execute_returning(self.reference.insert_queries[kind], data, f"create.{kind}")
+        if row is None:
+            return 0
+        try:
+            self._replicate(kind, "id = %s", (row[0],))
+        except ShardMismatch:
+            raise
+        except Exception:
+            # removed from every shard again, reported in last_error
+            return 0
+        return self.reference._indexed_insert(kind, row, data[0])
+
+    def create_product(self, name, description):
+        return self._replicated_insert("product", (name, description))
+
+    def create_material(self, name, ppu, unit):
+        return self._replicated_insert("material", (name, ppu, unit))
+
+    def _replicated_write(self, table, record_id, write, first=None):
+        # write(shard) -> rows affected on one shard. It runs on first (shard
+        # 0 unless given) and, if that affected the row, on every other shard.
+        first = first or self.reference
+        affected = write(first)
+        if affected:
+            self._write_others(table, record_id, write, first, affected)
+        return affected
+
+    def _write_others(self, table, record_id, write, first, expected):
+        # a shard whose result differs from first's is recorded and raises
+        # ShardMismatch: the copies no longer agree
+        others = [shard for shard in self.shards if shard is not first]
+        results = self.executor.map(write, others)
+        failed = [self.shards.index(shard) for shard, result in zip(others, results) if result != expected]
+        if failed:
+            self.diverged.append((table, "id = %s", (record_id,), failed))
+            raise ShardMismatch(f"{table} id={record_id} was changed on shard {self.shards.index(first)} "
+                                f"but not on every other ({self.last_error})", table, failed)
+
+    def resync(self, kind):
+        # makes every shard's copy of a replicated table equal to shard 0's:
+        # rows are upserted by id and rows shard 0 does not have are deleted
+        # (which fails while consumations still point at them)
+        table, columns = REPLICATED[kind]
+        buf = io.StringIO()
+        self._run(self.reference, lambda cur: cur.copy_expert(
+            f"COPY (SELECT {columns} FROM {table}) TO STDOUT", buf
+        ))
+        values = columns.split(", ")[1:]
+        assignments = ", ".join(f"{c} = EXCLUDED.{c}" for c in values)
+        current = ", ".join(f"t.{c}" for c in values)
+        excluded = ", ".join(f"EXCLUDED.{c}" for c in values)
+        changed = []
+
+        def apply(cur):
+            buf.seek(0)
+            cur.execute(f"CREATE TEMP TABLE resync (LIKE {table}) ON COMMIT DROP")
+            cur.copy_expert(f"COPY resync ({columns}) FROM STDIN", buf)
+            cur.execute(f"""
+                INSERT INTO {table} AS t ({columns}) SELECT {columns} FROM resync
+                ON CONFLICT (id) DO UPDATE SET {assignments}
+                WHERE ({current}) IS DISTINCT FROM ({excluded})
+            """)
+            upserted = cur.rowcount
+            cur.execute(f"DELETE FROM {table} t WHERE NOT EXISTS (SELECT 1 FROM resync r WHERE r.id = t.id)")
+            return upserted + cur.rowcount
+
+        for shard in self.shards[1:]:
+            changed.append(self._run(shard, apply))
+        self.diverged = [entry for entry in self.diverged if entry[0] != kind]
+        return changed
+
+    # ==================== CONSUMATION ====================
+
+    def create_consumation(self, product_id, material_id, qty):
+        return self.shard_for(product_id).create_consumation(product_id, material_id, qty)
+
+    def _locate_consumation(self, record_id):
+        found = self._scatter(
+            lambda shard: shard._execute_select('SELECT 1 FROM "Consumation" WHERE id = %s', (record_id,))
+        )
+        return next((shard for shard, rows in zip(self.shards, found) if rows), None)
+
+    def _move_consumation(self, source, record_id, product_id):
+        # product1_id decides the shard, so changing it moves the row
+        target = self.shard_for(product_id)
+        rows = source._execute_select(
+            'SELECT material_id, quatity FROM "Consumation" WHERE id = %s', (record_id,)
+        )
+        if not rows:
+            return 0
+        material_id, qty = rows[0]
+        inserted = target._execute_modify(
+            'INSERT INTO "Consumation"(id, product1_id, material_id, quatity) VALUES (%s, %s, %s, %s)',
+            (record_id, product_id, material_id, qty),
+            "update.consumation.product1_id"
+        )
+        if not inserted:
+            return 0
+        target.bom_cache.invalidate(product_id)
+        if source.delete("consumation", record_id):
+            return 1
+        # two committed transactions: take the copy back out, so the id is
+        # never left on two shards
+        error = source.last_error
+        if not target.delete("consumation", record_id):
+            left = [self.shards.index(target)]
+            self.diverged.append(("consumation", "id = %s", (record_id,), left))
+            raise ShardMismatch(f"Consumation id={record_id} was copied to its new shard but could not be "
+                                f"deleted from the old one ({error}) nor from the new one again",
+                                "consumation", left)
+        source.last_error = error
+        return 0
+
+    # ==================== READ ====================
+
+    def read(self, table):
+        if table != "consumation":
+            return self.reference.read(table)
+        parts = self._scatter(lambda shard: shard.read(table))
+        return list(heapq.merge(*parts, key=lambda row: row[0]))
+
+    @staticmethod
+    def _merge_iters(iters):
+        # every shard streams on its own connection; merged by id as they come
+        try:
+            yield from heapq.merge(*iters, key=lambda row: row[0])
+        finally:
+            for rows in iters:
+                rows.close()
+
+    def read_iter(self, table, chunk_rows=2000):
+        if table != "consumation":
+            return self.reference.read_iter(table, chunk_rows)
+        return self._merge_iters([shard.read_iter(table, chunk_rows) for shard in self.shards])
+
+    def get_versioned(self, table, record_id):
+        if table != "consumation":
+            return self.reference.get_versioned(table, record_id)
+        shard = self._locate_consumation(record_id)
+        return shard.get_versioned(table, record_id) if shard else None
+
+    # ==================== UPDATE ====================
+
+    def update_field(self, table, record_id, field, value):
+        if table == "consumation":
+            shard = self._locate_consumation(record_id)
+            if shard is None:
+                return 0
+            if field == "product1_id" and self.shard_for(value) is not shard:
+                return self._move_consumation(shard, record_id, value)
+            return shard.update_field(table, record_id, field, value)
+        return self._replicated_write(
+            table, record_id, lambda shard: shard.update_field(table, record_id, field, value)
+        )
+
+    def update_field_checked(self, table, record_id, field, value, version):
+        # versions are row versions of one database: shard 0's for the
+        # replicated tables, the owning shard's for a consumation
+        if table != "consumation":
+            status, new_version = self.reference.update_field_checked(table, record_id, field, value, version)
+            if status == self.UPDATED:
+                self._write_others(
+                    table, record_id, lambda shard: shard.update_field(table, record_id, field, value),
+                    self.reference, 1
+                )
+            return status, new_version
+        shard = self._locate_consumation(record_id)
+        if shard is None:
+            return self.NOT_FOUND, None
+        if field == "product1_id" and self.shard_for(value) is not shard:
+            # a move is an insert plus a delete: check the version first
+            current = shard.get_versioned(table, record_id)
+            if current is None:
+                return self.NOT_FOUND, None
+            if current[0] != version:
+                return self.CONFLICT, current[0]
+            if not self._move_consumation(shard, record_id, value):
+                if self.last_error is not None:
+                    raise self.last_error
+                return self.NOT_FOUND, None
+            return self.UPDATED, self.shard_for(value).get_versioned(table, record_id)[0]
+        return shard.update_field_checked(table, record_id, field, value, version)
+
+    # ==================== DELETE ====================
+
+    def delete(self, table, record_id):
+        if table == "consumation":
+            shard = self._locate_consumation(record_id)
+            return shard.delete(table, record_id) if shard else 0
+        if table == "product":
+            # only the owning shard can hold consumations referencing it
+            return self._replicated_write(
+                table, record_id, lambda shard: shard.delete(table, record_id), self.shard_for(record_id)
+            )
+        used = self._scatter(lambda shard: shard._execute_select(
+            'SELECT 1 FROM "Consumation" WHERE material_id = %s LIMIT 1', (record_id,)
+        ))
+        if any(used):
+            print(f"[ERROR] Material id={record_id} is still used by consumations")
+            return 0
+        return self._replicated_write(table, record_id, lambda shard: shard.delete(table, record_id))
+
+    def count_children(self, table, record_id):
+        if table == "product":
+            return self.shard_for(record_id).count_children(table, record_id)
+        return sum(self._scatter(lambda shard: shard.count_children(table, record_id)))
+
+    def delete_cascade(self, table, record_id, batch=5000, progress=None):
+        # a product's consumations are all on its own shard; a material's
+        # are spread, so every shard deletes its share before any copy of
+        # the material goes. Stopped early, every shard keeps the parent.
+        self.reset_cancel()
+        if table == "product":
+            owner = self.shard_for(record_id)
+            children, deleted = owner.delete_cascade(table, record_id, batch, progress)
+            if deleted:
+                self._write_others(table, record_id, lambda shard: shard.delete(table, record_id), owner, deleted)
+            return children, deleted
+        done = 0
+        for shard in self.shards:
+            def shard_progress(count, total, before=done):
+                if progress:
+                    progress(before + count, before + total)
+            children, complete = shard.delete_children(table, record_id, batch, shard_progress)
+            done += children
+            if not complete:
+                return done, 0
+        return done, self._replicated_write(table, record_id, lambda shard: shard.delete(table, record_id))
+
+    # ==================== SEARCH ====================
+
+    def search_consumation(self, product_like, material_like):
+        t0 = time.time()
+        parts = self._scatter(lambda shard: shard.search_consumation(product_like, material_like)[0])
+        rows = list(heapq.merge(*parts, key=lambda row: row[0]))
+        return rows, (time.time() - t0) * 1000
+
+    def search_consumation_iter(self, product_like, material_like, chunk_rows=2000):
+        return self._merge_iters([
+            shard.search_consumation_iter(product_like, material_like, chunk_rows) for shard in self.shards
+        ])
+
+    def search_consumation_parallel(self, product_like, material_like, workers=4):
+        # every shard runs its own id-range split on workers connections
+        t0 = time.time()
+        parts = self._scatter(
+            lambda shard: shard.search_consumation_parallel(product_like, material_like, workers)[0]
+        )
+        rows = list(heapq.merge(*parts, key=lambda row: row[0]))
+        return rows, (time.time() - t0) * 1000
+
+    def benchmark_search(self, product_like, material_like, workers=4):
+        rows, ms = self.search_consumation(product_like, material_like)
+        parallel_rows, parallel_ms = self.search_consumation_parallel(product_like, material_like, workers)
+        return [
+            (f"{len(self.shards)} shards, one connection each", len(rows), ms),
+            (f"{len(self.shards)} shards, {workers} connections each", len(parallel_rows), parallel_ms),
+        ]
+
+    def search_consumation_faceted(self, product_like, material_like, limit=50, offset=0, facet_limit=20):
+        # Each shard counts all its facets (LIMIT NULL) and returns its first
+        # offset + limit rows; a product's rows are all on one shard, the
+        # material counts are summed over the shards.
+        t0 = time.time()
+        parts = self._scatter(lambda shard: shard.search_consumation_faceted(
+            product_like, material_like, offset + limit, 0, None
+        )[0])
+        by_material = {}
+        for part in parts:
+            for material_id, material, n in part["by_material"]:
+                by_material[material_id] = (material, by_material.get(material_id, (None, 0))[1] + n)
+        by_product = [facet for part in parts for facet in part["by_product"]]
+        rows = list(heapq.merge(*(part["rows"] for part in parts), key=lambda row: row[0]))
+        result = {
+            "total": sum(part["total"] for part in parts),
+            "by_product": sorted(by_product, key=lambda f: (-f[2], f[0]))[:facet_limit],
+            "by_material": sorted(
+                ([material_id, material, n] for material_id, (material, n) in by_material.items()),
+                key=lambda f: (-f[2], f[0])
+            )[:facet_limit],
+            "rows": rows[offset:offset + limit],
+        }
+        return result, (time.time() - t0) * 1000
+
+    def product_bom(self, product_id):
+        return self.shard_for(product_id).product_bom(product_id)
+
+    def product_totals(self, product_id):
+        return self.shard_for(product_id).product_totals(product_id)
+
+    def material_where_used(self, material_id):
+        parts = self._scatter(lambda shard: shard.material_where_used(material_id))
+        return list(heapq.merge(*parts, key=lambda row: row[0]))
+
+    # ==================== NAME INDEX ====================
+
+    def complete_name(self, table, prefix, limit=10):
+        return self.reference.complete_name(table, prefix, limit)
+
+    def resolve_name(self, table, name):
+        return self.reference.resolve_name(table, name)
+
+    # ==================== GENERATORS ====================
+
+    def _max_id(self, table):
+        return self.reference._execute_select(f"SELECT coalesce(max(id), 0) FROM {table}")[0][0]
+
+    def generate_products(self, n, progress=None):
+        before = self._max_id('"Product"')
+        created = self.reference.generate_products(n, progress)
+        self._replicate("product", "id > %s", (before,))
+        return created
+
+    def generate_materials(self, n, progress=None):
+        before = self._max_id("material")
+        created = self.reference.generate_materials(n, progress)
+        self._replicate("material", "id > %s", (before,))
+        return created
+
+    def generate_consumations(self, n, progress=None):
+        count = len(self.shards)
+        product_ids = [row[0] for row in self.reference._execute_select('SELECT id FROM "Product"')]
+        owned = [[pid for pid in product_ids if pid % count == k] for k in range(count)]
+        # split n in proportion to how many products each shard owns
+        total = sum(len(ids) for ids in owned) or 1
+        quotas = [n * len(ids) // total for ids in owned]
+        quotas[max(range(count), key=lambda k: len(owned[k]))] += n - sum(quotas)
+        results = self.executor.map(
+            lambda k: self.shards[k].generate_consumations(quotas[k], None, owned[k]) if quotas[k] else 0,
+            range(count)
+        )
+        created = sum(results)
+        if progress:
+            progress(created, n)
+        return created
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.sharding")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("prepare", help="interleave the consumation id sequences of all shards")
+    sub.add_parser("status", help="show row counts per shard")
+    resync = sub.add_parser("resync", help="copy shard 0's product/material rows to every other shard")
+    resync.add_argument("table", choices=sorted(REPLICATED))
+    args = parser.parse_args(argv)
+
+    model = ShardedModel()
+    try:
+        if args.command == "prepare":
+            model.prepare()
+            print(f"[SHARD] Prepared {len(model.shards)} shards")
+        elif args.command == "resync":
+            for k, changed in enumerate(model.resync(args.table), 1):
+                print(f"[SHARD] {k} {model.shards[k].config.get('database')}: {changed} {args.table} rows fixed")
+        else:
+            for k, shard in enumerate(model.shards):
+                counts = [
+                    shard._execute_select(f"SELECT count(*) FROM {table}")[0][0]
+                    for table in ('"Product"', "material", '"Consumation"')
+                ]
+                print(f"[SHARD] {k} {shard.config.get('database')}: "
+                      f"products={counts[0]} materials={counts[1]} consumations={counts[2]}")
+    finally:
+        model.disconnect()
+
+
+if __name__ == "__main__":
+    main()
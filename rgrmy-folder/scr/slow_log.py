@@ -0,0 +1,113 @@
+import argparse
+import glob
+import json
+import logging
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler
+
+from tabulate import tabulate
+
+
+class SlowQueryLog:
+    # Statements slower than threshold_ms are appended as JSON lines to a
+    # rotating file. redact=True replaces bound parameters by their type
+    # names; explain=True adds the statement's plan (EXPLAIN, not ANALYZE,
+    # so the statement is not executed twice). Statements that failed, e.g.
+    # on statement_timeout or a cancel, are logged with the error class.
+    def __init__(self, path="slow_queries.jsonl", threshold_ms=200, redact=False,
+                 explain=False, max_bytes=10 * 1024 * 1024, backups=5):
+        self.path = path
+        self.threshold_ms = threshold_ms
+        self.redact = redact
+        self.explain = explain
+        self.logger = logging.getLogger(f"slow_query_log.{path}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+        if not self.logger.handlers:
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    def _params(self, params):
+        if params is None:
+            return None
+        if self.redact:
+            return [type(value).__name__ for value in params]
+        # arrays such as the generator's id lists are cut short
+        return [value if isinstance(value, (int, float, str, bool, type(None))) else repr(value)[:200]
+                for value in params]
+
+    def _plan(self, connection, query, params):
+        cur = connection.cursor()
+        try:
+            cur.execute("SAVEPOINT slow_log_explain")
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params or ())
+            plan = cur.fetchone()[0]
+            cur.execute("RELEASE SAVEPOINT slow_log_explain")
+            return plan
+        except Exception as e:
+            if not connection.closed:
+                cur.execute("ROLLBACK TO SAVEPOINT slow_log_explain")
+            return f"EXPLAIN failed: {e}"
+        finally:
+            cur.close()
+
+    def record(self, name, query, params, rows, ms, connection=None, error=None):
+        # connection: the one that ran the statement, EXPLAIN runs there too
+        if ms < self.threshold_ms:
+            return False
+        entry = {
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "name": name,
+            "ms": round(ms, 3),
+            "rows": rows,
+            "params": self._params(params),
+            "sql": " ".join(query.split()),
+        }
+        if error is not None:
+            entry["error"] = type(error).__name__
+        if self.explain and connection is not None:
+            entry["plan"] = self._plan(connection, query, params)
+        self.logger.info(json.dumps(entry, default=str))
+        return True
+
+
+def summarize(path, top=10):
+    stats = {}
+    for file in sorted(glob.glob(path) + glob.glob(path + ".*")):
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                s = stats.setdefault(entry["name"], {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "errors": 0})
+                s["count"] += 1
+                s["errors"] += "error" in entry
+                s["total_ms"] += entry["ms"]
+                s["max_ms"] = max(s["max_ms"], entry["ms"])
+                s["rows"] += entry["rows"] or 0
+    ranked = sorted(stats.items(), key=lambda item: item[1]["total_ms"], reverse=True)
+    return [
+        (name, s["count"], s["total_ms"], s["total_ms"] / s["count"], s["max_ms"], s["rows"] / s["count"], s["errors"])
+        for name, s in ranked[:top]
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.slow_log")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="rank logged statements by total time")
+    summary.add_argument("path", nargs="?", default="slow_queries.jsonl")
+    summary.add_argument("--top", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    print(tabulate(
+        [[name, count, f"{total:.1f}", f"{avg:.1f}", f"{worst:.1f}", f"{rows:.0f}", errors]
+         for name, count, total, avg, worst, rows, errors in summarize(args.path, args.top)],
+        headers=("name", "count", "total_ms", "avg_ms", "max_ms", "avg_rows", "errors")
+    ))
+
+
+if __name__ == "__main__":
+    main()
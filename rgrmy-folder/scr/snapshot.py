@@ -0,0 +1,294 @@
+import argparse
+import json
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from psycopg2 import connect
+
+from .migrations import Migrator
+from .model import DB_CONFIG
+from .partitioning import ConsumationPartitions
+
+
+SNAPSHOT_FORMAT = 1
+
+# Load order matters only for the FK checks that are re-added afterwards,
+# but parents first keeps the manifest readable.
+SNAPSHOT_TABLES = [
+    ("product", '"Product"', ("id", "name", "description")),
+    ("material", "material", ("id", "name", "price_per_unit", "unit")),
+    ("consumation", '"Consumation"', ("id", "product1_id", "material_id", "quatity")),
+]
+
+
+class Snapshot:
+    # A snapshot is one zip file: manifest.json plus Postgres binary COPY
+    # streams, "Consumation" split into id-range chunks so it can be restored
+    # by several connections at once.
+    def __init__(self, connection_factory, jobs=4, chunk_rows=1_000_000):
+        self.connection_factory = connection_factory
+        self.jobs = jobs
+        self.chunk_rows = chunk_rows
+
+    # ==================== EXPORT ====================
+
+    def export(self, path):
+        connection = self.connection_factory()
+        # one repeatable-read snapshot so all tables are mutually consistent
+        connection.set_session(isolation_level="REPEATABLE READ", readonly=True)
+        manifest = {
+            "format": SNAPSHOT_FORMAT,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "tables": {},
+        }
+        try:
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as zf:
+                with connection.cursor() as cur:
+                    cur.execute("SELECT coalesce(max(version), 0) FROM schema_version")
+                    manifest["schema_version"] = cur.fetchone()[0]
+                    for name, table, columns in SNAPSHOT_TABLES:
+                        cur.execute(f"SELECT coalesce(min(id), 1), coalesce(max(id), 0), count(*) FROM {table}")
+                        lo, hi, rows = cur.fetchone()
+                        members = []
+                        for k, start in enumerate(range(lo, hi + 1, self.chunk_rows)):
+                            member = f"{name}/part-{k:05d}.bin"
+                            with zf.open(member, "w", force_zip64=True) as out:
+                                cur.copy_expert(
+                                    f"COPY (SELECT {', '.join(columns)} FROM {table} "
+                                    f"WHERE id >= {start} AND id < {start + self.chunk_rows}) "
+                                    f"TO STDOUT (FORMAT binary)",
+                                    out
+                                )
+                            members.append(member)
+                        manifest["tables"][name] = {
+                            "columns": list(columns),
+                            "rows": rows,
+                            "max_id": hi,
+                            "members": members,
+                        }
+                zf.writestr("manifest.json", json.dumps(manifest, indent=2))
+        finally:
+            connection.rollback()
+            connection.close()
+        return manifest
+
+    # ==================== RESTORE ====================
+
+    @staticmethod
+    def read_manifest(path):
+        with zipfile.ZipFile(path) as zf:
+            return json.loads(zf.read("manifest.json"))
+
+    def _load_member(self, path, table, columns, member):
+        connection = self.connection_factory()
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SET synchronous_commit = off")
+                with zipfile.ZipFile(path) as zf, zf.open(member) as stream:
+                    cur.copy_expert(
+                        f"COPY {table} ({', '.join(columns)}) FROM STDIN (FORMAT binary)",
+                        stream
+                    )
+            connection.commit()
+        finally:
+            connection.close()
+
+    def _run_parallel(self, fn, items):
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            list(executor.map(lambda item: fn(*item), items))
+
+    def _execute_on_new_connection(self, sql):
+        connection = self.connection_factory()
+        try:
+            with connection.cursor() as cur:
+                cur.execute(sql)
+            connection.commit()
+        finally:
+            connection.close()
+
+    # ---------- schema put aside during the load ----------
+
+    @staticmethod
+    def pending_path(path):
+        # the indexes, FKs and triggers restore() took away, kept next to the
+        # snapshot until they are back so a crashed restore can be finished
+        return f"{path}.pending.json"
+
+    def _rebuild(self, connection, ddl, validate=True):
+        # every step skips what is already there, so it can run again after
+        # an interruption; validate=False re-adds the FKs NOT VALID, for
+        # tables whose load did not complete
+        self._run_parallel(self._execute_on_new_connection, [(sql,) for sql in ddl["indexes"]])
+        with connection.cursor() as cur:
+            for table, constraint, definition in ddl["foreign_keys"]:
+                cur.execute(
+                    "SELECT 1 FROM pg_constraint WHERE conrelid = %s::regclass AND conname = %s",
+                    (table, constraint)
+                )
+                if cur.fetchone() is not None:
+                    continue
+                if not validate and not definition.endswith("NOT VALID"):
+                    definition += " NOT VALID"
+                cur.execute(f'ALTER TABLE {table} ADD CONSTRAINT "{constraint}" {definition}')
+            for table in ddl["tables"]:
+                cur.execute(f"ALTER TABLE {table} ENABLE TRIGGER USER")
+            # TRUNCATE and the load ran without the triggers that bump these
+            cur.execute("SELECT to_regclass('table_version') IS NOT NULL")
+            if cur.fetchone()[0]:
+                cur.execute("UPDATE table_version SET version = version + 1")
+        connection.commit()
+
+    def finish(self, path):
+        # puts back what an interrupted restore of path left out
+        pending = self.pending_path(path)
+        with open(pending, encoding="utf-8") as f:
+            ddl = json.load(f)
+        connection = self.connection_factory()
+        try:
+            self._rebuild(connection, ddl, validate=False)
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        os.remove(pending)
+        return ddl
+
+    def restore(self, path):
+        manifest = self.read_manifest(path)
+        if manifest["format"] != SNAPSHOT_FORMAT:
+            raise ValueError(f"Unsupported snapshot format {manifest['format']}")
+
+        pending = self.pending_path(path)
+        if os.path.exists(pending):
+            raise ValueError(f"An earlier restore did not finish, run 'finish {path}' first")
+        connection = self.connection_factory()
+        timings = {}
+        try:
+            current = Migrator(connection).current_version()
+            if current != manifest["schema_version"]:
+                raise ValueError(
+                    f"Snapshot has schema version {manifest['schema_version']}, database has {current}"
+                )
+            names = [table for _, table, _ in SNAPSHOT_TABLES]
+
+            t0 = time.time()
+            with connection.cursor() as cur:
+                cur.execute(f"TRUNCATE {', '.join(names)} RESTART IDENTITY")
+                # secondary indexes and FKs are rebuilt once after the load,
+                # which is far cheaper than maintaining them row by row
+                cur.execute("""
+                    SELECT i.indexrelid::regclass::text, pg_get_indexdef(i.indexrelid)
+                    FROM pg_index i
+                    LEFT JOIN pg_constraint c ON c.conindid = i.indexrelid
+                    WHERE i.indrelid = ANY(%s::regclass[]) AND c.oid IS NULL
+                """, (names,))
+                # pg_get_indexdef renders partitioned indexes as ON ONLY, which
+                # would not cascade to the partitions when rebuilt
+                indexes = [
+                    (index, sql.replace(" ON ONLY ", " ON ", 1).replace(" INDEX ", " INDEX IF NOT EXISTS ", 1))
+                    for index, sql in cur.fetchall()
+                ]
+                cur.execute("""
+                    SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+                    FROM pg_constraint
+                    WHERE contype = 'f' AND conrelid = ANY(%s::regclass[])
+                """, (names,))
+                ddl = {"indexes": [sql for _, sql in indexes], "foreign_keys": cur.fetchall(), "tables": names}
+                for index, _ in indexes:
+                    cur.execute(f"DROP INDEX {index}")
+                for table, constraint, _ in ddl["foreign_keys"]:
+                    cur.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"')
+                for table in names:
+                    cur.execute(f"ALTER TABLE {table} DISABLE TRIGGER USER")
+                for name, table, _ in SNAPSHOT_TABLES:
+                    max_id = manifest["tables"][name]["max_id"]
+                    if max_id:
+                        cur.execute("SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)", (table, max_id))
+            ConsumationPartitions(connection).ensure_capacity(0, commit=False)
+            # on disk before the drops commit, in case this process dies
+            with open(pending, "w", encoding="utf-8") as f:
+                json.dump(ddl, f, indent=2)
+            try:
+                connection.commit()
+            except Exception:
+                os.remove(pending)
+                raise
+            timings["prepare"] = time.time() - t0
+
+            t0 = time.time()
+            try:
+                self._run_parallel(
+                    lambda table, columns, member: self._load_member(path, table, columns, member),
+                    [
+                        (table, manifest["tables"][name]["columns"], member)
+                        for name, table, _ in SNAPSHOT_TABLES
+                        for member in manifest["tables"][name]["members"]
+                    ]
+                )
+            except BaseException:
+                # the tables are incomplete, but they get their indexes, FKs
+                # and triggers back; if even that fails, 'finish' retries it
+                connection.rollback()
+                self._rebuild(connection, ddl, validate=False)
+                os.remove(pending)
+                raise
+            timings["load"] = time.time() - t0
+
+            t0 = time.time()
+            self._rebuild(connection, ddl)
+            os.remove(pending)
+            timings["indexes"] = time.time() - t0
+
+            t0 = time.time()
+            connection.autocommit = True
+            with connection.cursor() as cur:
+                cur.execute(f"ANALYZE {', '.join(names)}")
+            timings["analyze"] = time.time() - t0
+        except Exception:
+            if not connection.autocommit and not connection.closed:
+                connection.rollback()
+            raise
+        finally:
+            connection.close()
+        return manifest, timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m scr.snapshot")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="dump all tables into a snapshot file")
+    export.add_argument("path")
+    export.add_argument("--chunk-rows", type=int, default=1_000_000,
+                        help="ids per consumation chunk")
+    restore = sub.add_parser("restore", help="replace all table contents with a snapshot")
+    restore.add_argument("path")
+    restore.add_argument("--jobs", type=int, default=4, help="parallel COPY connections")
+    finish = sub.add_parser("finish", help="put back the indexes, FKs and triggers of an interrupted restore")
+    finish.add_argument("path")
+    args = parser.parse_args(argv)
+
+    snapshot = Snapshot(lambda: connect(**DB_CONFIG), getattr(args, "jobs", 4), getattr(args, "chunk_rows", 1_000_000))
+    t0 = time.time()
+    if args.command == "export":
+        manifest = snapshot.export(args.path)
+        for name, info in manifest["tables"].items():
+            print(f"[SNAPSHOT] {name:<12} {info['rows']:>12} rows in {len(info['members'])} chunks")
+    elif args.command == "finish":
+        ddl = snapshot.finish(args.path)
+        print(f"[SNAPSHOT] Restored {len(ddl['indexes'])} indexes and {len(ddl['foreign_keys'])} foreign keys "
+              f"(added NOT VALID); restore the snapshot again for complete data")
+    else:
+        manifest, timings = snapshot.restore(args.path)
+        for name, info in manifest["tables"].items():
+            print(f"[SNAPSHOT] {name:<12} {info['rows']:>12} rows restored")
+        for step, seconds in timings.items():
+            print(f"[SNAPSHOT] {step:<12} {seconds:9.2f} s")
+    print(f"[TIME] {args.command} took {time.time() - t0:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
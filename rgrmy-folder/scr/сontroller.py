@@ -1,227 +1,430 @@
-from .model import Model
-from .view import View
-from functools import wraps
-from psycopg2.errors import StringDataRightTruncation
-
-
-def catch_db_error(option):
-    @wraps(option)
-    def inner(self, *args, **kwargs):
-        try:
-            option(self, *args, **kwargs)
-        except (IndexError, StringDataRightTruncation, ValueError, AssertionError) as e:
-            print(f"\n Known DB error: {type(e).__name__} — {e}\n")
-            self.view.output_error_message()
-        except Exception as e:
-            print(f"\n Unexpected error in {option.__name__}: {type(e).__name__} — {e}\n")
-            self.view.output_error_message()
-    return inner
-
-
-class Controller:
-    def __init__(self):
-        self.available = {
-            "create": {
-                "product": self.create_product,
-                "material": self.create_material,
-                "consumation": self.create_consumation,
-            },
-            "read": {
-                "product": self.read,
-                "material": self.read,
-                "consumation": self.read,
-            },
-            "update": {
-                "product": self.update_product,
-                "material": self.update_material,
-                "consumation": self.update_consumation,
-            },
-            "delete": {
-                "product": self.delete_product,
-                "material": self.delete_material,
-                "consumation": self.delete_consumation,
-            },
-            "task_2": {
-                "generate_products": self.task_generate_products,
-                "generate_materials": self.task_generate_materials,
-                "generate_consumations": self.task_generate_consumations,
-
-            },
-            "task_3": {
-                "search_products": self.task3_search_products,
-                "search_materials": self.task3_search_materials,
-                "search_consumations": self.task3_search_consumptions,
-            },
-        }
-        self.model = Model()
-        self.view = View()
-
-    def run(self):
-        while True:
-            chosen_mode_viewer, chosen_mode = self.view.show_menu()
-            if not chosen_mode_viewer:
-                self.model.disconnect()
-                break
-            chosen_option_viewer, chosen_option = chosen_mode_viewer()
-            args_or_command = chosen_option_viewer()
-
-            # call mapped function
-            self.available[chosen_mode][chosen_option](args_or_command)
-
-    # --- CREATE ---
-    @catch_db_error
-    def create_product(self, args):
-        name, description = args
-        self.model.create_product(name, description)
-
-    @catch_db_error
-    def create_material(self, args):
-        name, unit, price = args
-        self.model.create_material(name, unit, price)
-
-    @catch_db_error
-    def create_consumation(self, args):
-        product1_id, material_id, quantity = args
-        self.model.create_consumation(product1_id, material_id, quantity)
-
-    # --- READ ---
-    def read(self, read_from):
-        original_name = read_from
-        
-        
-        # Створюємо мапу відповідності: [те, що приходить з View] -> [ключ у Model]
-        table_mapping = {
-            "product": "product",
-            "material": "material",
-            "consumation": "consumation"
-        }
-
-
-        db_table_name = table_mapping.get(read_from)
-        
-        if not db_table_name:
-            print(f"[ERROR] Unknown table key: {read_from}")
-            self.view.output_error_message()
-            return
-            
-        try:
-            table = self.model.read(db_table_name)
-            self.view.output_table(table, original_name)
-        except Exception as e:
-            print(f"[ERROR] Database error during READ: {e}")
-            self.view.output_error_message()
-
-    # --- UPDATE ---
-    @catch_db_error
-    def update_product(self, args):
-        prod_id, what_to_change, new_value = args
-        field_map = {
-            "name": "name",
-            "description": "description",
-        }
-        field = field_map.get(what_to_change)
-        if not field:
-            raise ValueError(f"Unknown field: {what_to_change}")
-        affected = self.model.update_field("product", int(prod_id), field, new_value)
-        if affected == 0:
-            print(f"[INFO] No Product with id={prod_id} — nothing was updated.")
-        else:
-            print(f"[SUCCESS] Product id={prod_id} updated: set {field} = {new_value}")
-
-    @catch_db_error
-    def update_material(self, args):
-        mat_id, what_to_change, new_value = args
-        field_map = {
-            "name": "name",
-            "unit": "unit",
-            "price_per_unit": "price_per_unit",
-        }
-        field = field_map.get(what_to_change)
-        if not field:
-            raise ValueError(f"Unknown field: {what_to_change}")
-        # convert price to numeric if needed
-        if field == "price_per_unit":
-            new_value = float(new_value)
-        affected = self.model.update_field("material", int(mat_id), field, new_value)
-        if affected == 0:
-            print(f"[INFO] No material with id={mat_id} — nothing was updated.")
-        else:
-            print(f"[SUCCESS] Material id={mat_id} updated: set {field} = {new_value}")
-
-    @catch_db_error
-    def update_consumation(self, args):
-        cons_id, what_to_change, new_value = args
-        field_map = {
-            "product1_id": "product1_id",
-            "material_id": "material_id",
-            "quatity": "quatity",
-        }
-        field = field_map.get(what_to_change)
-        if not field:
-            raise ValueError(f"Unknown field: {what_to_change}")
-        if field in ("product1_id", "material_id"):
-            new_value = int(new_value)
-        if field == "quatity":
-            new_value = float(new_value)
-        affected = self.model.update_field("consumation", int(cons_id), field, new_value)
-        if affected == 0:
-            print(f"[INFO] No consumption with id={cons_id} — nothing was updated.")
-        else:
-            print(f"[SUCCESS] Consumption id={cons_id} updated: set {field} = {new_value}")
-
-    # --- DELETE ---
-    @catch_db_error
-    def delete_product(self, record_id):
-         self.model.delete("product", int(record_id))
-
-    @catch_db_error
-    def delete_material(self, record_id):
-        self.model.delete("material", int(record_id))
-
-    @catch_db_error
-    def delete_consumation(self, record_id):
-        self.model.delete("consumation", int(record_id))
-
-    # --- TASK 2: GENERATION ---
-    @catch_db_error
-    def task_generate_products(self, args):
-        n = int(args)
-        print(f"[TASK2] Generating {n} products...")
-        created = self.model.generate_products(n)
-        print(f"[TASK2] Products inserted (approx): {created}")
-
-    @catch_db_error
-    def task_generate_materials(self, args):
-        n = int(args)
-        print(f"[TASK2] Generating {n} materials...")
-        created = self.model.generate_materials(n)
-        print(f"[TASK2] Materials inserted (approx): {created}")
-
-    @catch_db_error
-    def task_generate_consumations(self, args):
-        n = int(args)
-        print(f"[TASK2] Generating {n} consumption records...")
-        created = self.model.generate_consumations(n)
-        print(f"[TASK2] Consumptions inserted (approx): {created}")
-
-    # --- TASK 3: SEARCH ---
-    @catch_db_error
-    def task3_search_products(self, args):
-
-        table, ms = self.model.search_products(*args)
-        self.view.output_table(table, "products")
-        print(f"[TIME] Query executed in {ms:.3f} ms")
-
-    @catch_db_error
-    def task3_search_materials(self, args):
-        # args: name_like, price_min_max
-        table, ms = self.model.search_materials(*args)
-        self.view.output_table(table, "materials")
-        print(f"[TIME] Query executed in {ms:.3f} ms")
-
-    @catch_db_error
-    def task3_search_consumptions(self, args):
-        # args: product_like, material_like, qty_min_max
-        table, ms = self.model.search_consumation(*args)
-        self.view.output_table(table, "consumptions")
-        print(f"[TIME] Query executed in {ms:.3f} ms")
+from .jobs import JobManager, collect_rows
+from .lock_diagnostics import classify
+from .sharding import open_model
+from .view import View
+from functools import wraps
+import threading
+from psycopg2.errors import StringDataRightTruncation
+
+
+def catch_db_error(option):
+    @wraps(option)
+    def inner(self, *args, **kwargs):
+        self.model.last_error = None
+        try:
+            option(self, *args, **kwargs)
+            kind = classify(self.model.last_error)
+            if kind and kind != "query_canceled":
+                print(f"\n[LOCK] {option.__name__} failed with {kind} after {self.model.lock_retries} retries")
+                for snap in self.model.lock_snapshots()[-1:]:
+                    print(f"[LOCK] last lock wait snapshot at {snap['ts']}:")
+                    for pid, blocked_by, _, wait_event, ms, _, query in snap["activity"]:
+                        print(f"    pid={pid} blocked_by={blocked_by} {wait_event or ''} {ms} ms: {query}")
+        except (IndexError, StringDataRightTruncation, ValueError, AssertionError) as e:
+            print(f"\n Known DB error: {type(e).__name__} — {e}\n")
+            self.view.output_error_message()
+        except Exception as e:
+            print(f"\n Unexpected error in {option.__name__}: {type(e).__name__} — {e}\n")
+            self.view.output_error_message()
+    return inner
+
+
+class Controller:
+    def __init__(self, slow_log=None, lock_wait_ms=None, profiler=None):
+        self.available = {
+            "create": {
+                "product": self.create_product,
+                "material": self.create_material,
+                "consumation": self.create_consumation,
+            },
+            "read": {
+                "product": self.read,
+                "material": self.read,
+                "consumation": self.read,
+            },
+            "update": {
+                "product": self.update_product,
+                "material": self.update_material,
+                "consumation": self.update_consumation,
+            },
+            "delete": {
+                "product": self.delete_product,
+                "material": self.delete_material,
+                "consumation": self.delete_consumation,
+                "product_with_consumations": self.delete_product_cascade,
+                "material_with_consumations": self.delete_material_cascade,
+            },
+            "task_2": {
+                "generate_products": self.task_generate_products,
+                "generate_materials": self.task_generate_materials,
+                "generate_consumations": self.task_generate_consumations,
+
+            },
+            "task_3": {
+                "search_products": self.task3_search_products,
+                "search_materials": self.task3_search_materials,
+                "search_consumations": self.task3_search_consumptions,
+                "parallel_search_consumations": self.task3_parallel_search,
+                "benchmark_search": self.task3_benchmark_search,
+                "product_bom": self.task3_product_bom,
+                "material_where_used": self.task3_material_where_used,
+                "faceted_search": self.task3_faceted_search,
+            },
+            "jobs": {
+                "generate_products": self.jobs_generate_products,
+                "generate_materials": self.jobs_generate_materials,
+                "generate_consumations": self.jobs_generate_consumations,
+                "read_table": self.jobs_read_table,
+                "search_consumations": self.jobs_search_consumations,
+                "status": self.jobs_status,
+                "result": self.jobs_result,
+                "cancel": self.jobs_cancel,
+            },
+        }
+        # a ShardedModel once sharding.SHARD_CONFIGS lists shards
+        self.model = open_model(slow_log=slow_log)
+        if lock_wait_ms:
+            self.model.enable_lock_diagnostics(lock_wait_ms)
+        self.view = View()
+        self.view.completer = self.model.complete_name
+        self.profiler = profiler
+        self.model.profiler = self.view.profiler = profiler
+        # background jobs write through their own connections, so totals
+        # cached by the menu's Model may be stale once one finishes
+        self.jobs = JobManager(
+            lambda: open_model(slow_log=slow_log),
+            on_finish=lambda job: self.model.bom_cache.clear()
+        )
+
+    def run(self):
+        while True:
+            for job in self.jobs.unseen_finished():
+                self.view.output_job_finished(job)
+            try:
+                chosen_mode_viewer, chosen_mode = self.view.show_menu()
+            except KeyboardInterrupt:
+                chosen_mode_viewer = None
+            if not chosen_mode_viewer:
+                self.jobs.close()
+                self.model.disconnect()
+                break
+            try:
+                chosen_option_viewer, chosen_option = chosen_mode_viewer()
+                args_or_command = chosen_option_viewer()
+            except KeyboardInterrupt:
+                print("\n[CANCEL] Back to main menu")
+                continue
+
+            # call mapped function
+            self._run_interruptible(self.available[chosen_mode][chosen_option], args_or_command)
+
+    def _run_interruptible(self, action, args):
+        # The action runs on a worker thread so Ctrl-C reaches this one while
+        # a query is in flight; Model.cancel() then cancels it on the server
+        # and the action's own error handling rolls the connection back.
+        self.model.reset_cancel()
+        if self.profiler:
+            action = self._profiled(action)
+        worker = threading.Thread(target=action, args=(args,), daemon=True)
+        worker.start()
+        while worker.is_alive():
+            try:
+                worker.join(0.2)
+            except KeyboardInterrupt:
+                print("\n[CANCEL] Cancelling the running query...")
+                self.model.cancel()
+
+    def _profiled(self, action):
+        def run(args):
+            with self.profiler.operation(action.__name__):
+                action(args)
+        return run
+
+    # --- CREATE ---
+    @catch_db_error
+    def create_product(self, args):
+        name, description = args
+        self.model.create_product(name, description)
+
+    @catch_db_error
+    def create_material(self, args):
+        name, unit, price = args
+        self.model.create_material(name, unit, price)
+
+    @catch_db_error
+    def create_consumation(self, args):
+        product1_id, material_id, quantity = args
+        self.model.create_consumation(
+            self._resolve_id("product", product1_id), self._resolve_id("material", material_id), quantity
+        )
+
+    def _resolve_id(self, table, text):
+        # an id as typed, or the id of the only row with that exact name
+        text = text.strip()
+        if text.isdigit():
+            return int(text)
+        ids = self.model.resolve_name(table, text)
+        if len(ids) != 1:
+            shown = ", ".join(map(str, ids[:10])) + (", ..." if len(ids) > 10 else "")
+            raise ValueError(f"{len(ids)} {table} rows named '{text}'" + (f": ids {shown}" if ids else ""))
+        return ids[0]
+
+    # --- READ ---
+    def read(self, read_from):
+        original_name = read_from
+        
+        
+        # Створюємо мапу відповідності: [те, що приходить з View] -> [ключ у Model]
+        table_mapping = {
+            "product": "product",
+            "material": "material",
+            "consumation": "consumation"
+        }
+
+
+        db_table_name = table_mapping.get(read_from)
+        
+        if not db_table_name:
+            print(f"[ERROR] Unknown table key: {read_from}")
+            self.view.output_error_message()
+            return
+            
+        try:
+            table = self.model.read(db_table_name)
+            self.view.output_table(table, original_name)
+        except Exception as e:
+            print(f"[ERROR] Database error during READ: {e}")
+            self.view.output_error_message()
+
+    # --- UPDATE ---
+    @catch_db_error
+    def update_product(self, args):
+        prod_id, what_to_change, new_value = args
+        field_map = {
+            "name": "name",
+            "description": "description",
+        }
+        field = field_map.get(what_to_change)
+        if not field:
+            raise ValueError(f"Unknown field: {what_to_change}")
+        affected = self.model.update_field("product", int(prod_id), field, new_value)
+        if affected == 0:
+            print(f"[INFO] No Product with id={prod_id} — nothing was updated.")
+        else:
+            print(f"[SUCCESS] Product id={prod_id} updated: set {field} = {new_value}")
+
+    @catch_db_error
+    def update_material(self, args):
+        mat_id, what_to_change, new_value = args
+        field_map = {
+            "name": "name",
+            "unit": "unit",
+            "price_per_unit": "price_per_unit",
+        }
+        field = field_map.get(what_to_change)
+        if not field:
+            raise ValueError(f"Unknown field: {what_to_change}")
+        # convert price to numeric if needed
+        if field == "price_per_unit":
+            new_value = float(new_value)
+        affected = self.model.update_field("material", int(mat_id), field, new_value)
+        if affected == 0:
+            print(f"[INFO] No material with id={mat_id} — nothing was updated.")
+        else:
+            print(f"[SUCCESS] Material id={mat_id} updated: set {field} = {new_value}")
+
+    @catch_db_error
+    def update_consumation(self, args):
+        cons_id, what_to_change, new_value = args
+        field_map = {
+            "product1_id": "product1_id",
+            "material_id": "material_id",
+            "quatity": "quatity",
+        }
+        field = field_map.get(what_to_change)
+        if not field:
+            raise ValueError(f"Unknown field: {what_to_change}")
+        if field in ("product1_id", "material_id"):
+            new_value = int(new_value)
+        if field == "quatity":
+            new_value = float(new_value)
+        affected = self.model.update_field("consumation", int(cons_id), field, new_value)
+        if affected == 0:
+            print(f"[INFO] No consumption with id={cons_id} — nothing was updated.")
+        else:
+            print(f"[SUCCESS] Consumption id={cons_id} updated: set {field} = {new_value}")
+
+    # --- DELETE ---
+    # a plain delete of a product or material still in use fails on the
+    # foreign key; the *_with_consumations entries delete those first
+    @catch_db_error
+    def delete_product(self, record_id):
+        self.model.delete("product", int(record_id))
+
+    @catch_db_error
+    def delete_material(self, record_id):
+        self.model.delete("material", int(record_id))
+
+    @catch_db_error
+    def delete_product_cascade(self, record_id):
+        self._delete_cascade("product", int(record_id))
+
+    @catch_db_error
+    def delete_material_cascade(self, record_id):
+        self._delete_cascade("material", int(record_id))
+
+    def _delete_cascade(self, table, record_id):
+        count = self.model.count_children(table, record_id)
+        if count and not self.view.confirm_cascade(table, record_id, count):
+            print(f"[INFO] {table} id={record_id} kept")
+            return
+        children, deleted = self.model.delete_cascade(table, record_id, progress=self.view.output_progress)
+        if deleted:
+            print(f"[SUCCESS] {table} id={record_id} deleted with {children} consumations")
+        elif self.model.cancelled:
+            print(f"\n[CANCEL] {table} id={record_id} kept, {children} of its consumations deleted")
+        elif not self.model.last_error:
+            print(f"[INFO] No {table} with id={record_id} — {children} consumations deleted")
+
+    @catch_db_error
+    def delete_consumation(self, record_id):
+        self.model.delete("consumation", int(record_id))
+
+    # --- TASK 2: GENERATION ---
+    @catch_db_error
+    def task_generate_products(self, args):
+        n = int(args)
+        print(f"[TASK2] Generating {n} products...")
+        created = self.model.generate_products(n, self.view.output_progress)
+        print(f"[TASK2] Products inserted (approx): {created}")
+
+    @catch_db_error
+    def task_generate_materials(self, args):
+        n = int(args)
+        print(f"[TASK2] Generating {n} materials...")
+        created = self.model.generate_materials(n, self.view.output_progress)
+        print(f"[TASK2] Materials inserted (approx): {created}")
+
+    @catch_db_error
+    def task_generate_consumations(self, args):
+        n = int(args)
+        print(f"[TASK2] Generating {n} consumption records...")
+        created = self.model.generate_consumations(n, self.view.output_progress)
+        print(f"[TASK2] Consumptions inserted (approx): {created}")
+
+    # --- TASK 3: SEARCH ---
+    @catch_db_error
+    def task3_search_products(self, args):
+
+        table, ms = self.model.search_products(*args)
+        self.view.output_table(table, "products")
+        print(f"[TIME] Query executed in {ms:.3f} ms")
+
+    @catch_db_error
+    def task3_search_materials(self, args):
+        # args: name_like, price_min_max
+        table, ms = self.model.search_materials(*args)
+        self.view.output_table(table, "materials")
+        print(f"[TIME] Query executed in {ms:.3f} ms")
+
+    @catch_db_error
+    def task3_search_consumptions(self, args):
+        # args: product_like, material_like, qty_min_max
+        table, ms = self.model.search_consumation(*args)
+        self.view.output_table(table, "consumptions")
+        print(f"[TIME] Query executed in {ms:.3f} ms")
+
+    @catch_db_error
+    def task3_parallel_search(self, args):
+        product_like, material_like, workers = args
+        table, ms = self.model.search_consumation_parallel(product_like, material_like, workers)
+        self.view.output_table(table, "consumation")
+        print(f"[TIME] Query executed in {ms:.3f} ms on {workers} connections")
+
+    @catch_db_error
+    def task3_benchmark_search(self, args):
+        product_like, material_like, workers = args
+        results = self.model.benchmark_search(product_like, material_like, workers)
+        self.view.output_benchmark(results)
+
+    @catch_db_error
+    def task3_product_bom(self, args):
+        product_id = self._resolve_id("product", args)
+        table = self.model.product_bom(product_id)
+        self.view.output_table(table, "bom")
+        qty, cost, lines = self.model.product_totals(product_id)
+        print(f"[BOM] Product id={product_id}: {lines} lines, total quantity {qty}, total cost {cost}")
+
+    @catch_db_error
+    def task3_material_where_used(self, args):
+        material_id = self._resolve_id("material", args)
+        table = self.model.material_where_used(material_id)
+        self.view.output_table(table, "where_used")
+        print(f"[BOM] Material id={material_id} is used in {len(table)} consumations")
+
+    @catch_db_error
+    def task3_faceted_search(self, args):
+        product_like, material_like, limit, offset = args
+        result, ms = self.model.search_consumation_faceted(product_like, material_like, limit, offset)
+        self.view.output_facets(result, offset)
+        print(f"[TIME] Query executed in {ms:.3f} ms")
+
+    # --- BACKGROUND JOBS ---
+    def _submit(self, name, action, result_table=None):
+        job = self.jobs.submit(name, action, result_table)
+        print(f"[JOB] #{job.id} {name} started in the background")
+
+    @catch_db_error
+    def jobs_generate_products(self, args):
+        n = int(args)
+        self._submit(f"generate {n} products", lambda model, progress: model.generate_products(n, progress))
+
+    @catch_db_error
+    def jobs_generate_materials(self, args):
+        n = int(args)
+        self._submit(f"generate {n} materials", lambda model, progress: model.generate_materials(n, progress))
+
+    @catch_db_error
+    def jobs_generate_consumations(self, args):
+        n = int(args)
+        self._submit(
+            f"generate {n} consumations",
+            lambda model, progress: model.generate_consumations(n, progress)
+        )
+
+    @catch_db_error
+    def jobs_read_table(self, table):
+        self._submit(
+            f"read {table}",
+            lambda model, progress: collect_rows(model.read_iter(table), progress),
+            table
+        )
+
+    @catch_db_error
+    def jobs_search_consumations(self, args):
+        product_like, material_like = args
+        self._submit(
+            f"search '{product_like}' / '{material_like}'",
+            lambda model, progress: collect_rows(
+                model.search_consumation_iter(product_like, material_like), progress
+            ),
+            "consumation"
+        )
+
+    @catch_db_error
+    def jobs_status(self, args):
+        self.view.output_jobs(self.jobs.list())
+
+    @catch_db_error
+    def jobs_result(self, job_id):
+        job = self.jobs.take_result(job_id)
+        self.view.output_job_finished(job)
+        if job.result_table and job.result is not None:
+            self.view.output_table(job.result, job.result_table)
+        elif job.result is not None:
+            print(f"[JOB] Rows inserted (approx): {job.result}")
+
+    @catch_db_error
+    def jobs_cancel(self, job_id):
+        job = self.jobs.cancel(job_id)
+        print(f"[JOB] #{job.id} {job.name}: {'cancelling' if job.active else job.status}")
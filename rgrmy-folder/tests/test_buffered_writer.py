@@ -0,0 +1,49 @@
+import threading
+import time
+
+import pytest
+
+from scr.buffered_writer import ConsumationWriter
+
+
+def copied(connection):
+    return "".join(data for query, data in connection.cur.executed if query.startswith("COPY"))
+
+
+def test_close_flushes_what_is_queued(fake_connection):
+    connection = fake_connection()
+    writer = ConsumationWriter(connection, flush_interval=0.01)
+    writer.put(1, 2, 3)
+    writer.put("4", "5", "6")
+    writer.close(timeout=2)
+    assert copied(connection) == "1\t2\t3\n4\t5\t6\n"
+    assert writer.rows_written == 2
+    assert connection.closed
+    with pytest.raises(RuntimeError):
+        writer.put(1, 2, 3)
+
+
+def test_close_waits_for_a_put_that_is_still_enqueuing(fake_connection):
+    connection = fake_connection()
+    writer = ConsumationWriter(connection, flush_interval=0.01)
+    release = threading.Event()
+    enqueue = writer.queue.put
+
+    def slow_put(row, timeout=None):
+        release.wait()
+        enqueue(row, timeout=timeout)
+
+    writer.queue.put = slow_put
+    putter = threading.Thread(target=writer.put, args=(7, 8, 9))
+    putter.start()
+    while not writer._puts:
+        time.sleep(0.001)
+    closer = threading.Thread(target=writer.close, args=(2,))
+    closer.start()
+    time.sleep(0.05)
+    assert closer.is_alive()
+    release.set()
+    putter.join()
+    closer.join()
+    assert copied(connection) == "7\t8\t9\n"
+    assert connection.closed
@@ -0,0 +1,65 @@
+import pytest
+
+from scr.ingest import NATURAL_KEYS, dedupe, dedupe_sql, dedupe_steps, read_csv
+
+
+def squash(sql):
+    return " ".join(sql.split())
+
+
+def test_product_steps_key_on_name():
+    map_sql, repoint_sql, delete_sql = map(squash, dedupe_steps("product"))
+    assert "CREATE TEMP TABLE dedupe_product ON COMMIT DROP" in map_sql
+    assert 'min(id) OVER (PARTITION BY name) AS keep FROM "Product"' in map_sql
+    assert "WHERE id <> keep" in map_sql
+    assert 'UPDATE "Consumation" c SET product1_id = d.keep FROM dedupe_product d' in repoint_sql
+    assert "WHERE c.product1_id = d.id" in repoint_sql
+    assert delete_sql == 'DELETE FROM "Product" t USING dedupe_product d WHERE t.id = d.id'
+
+
+def test_material_steps_key_on_name_and_unit():
+    map_sql, repoint_sql, delete_sql = map(squash, dedupe_steps("material"))
+    assert "PARTITION BY name, unit) AS keep FROM material" in map_sql
+    assert "SET material_id = d.keep FROM dedupe_material d" in repoint_sql
+    assert delete_sql == "DELETE FROM material t USING dedupe_material d WHERE t.id = d.id"
+
+
+def test_unknown_kind():
+    with pytest.raises(KeyError):
+        dedupe_steps("consumation")
+
+
+def test_dedupe_sql_is_the_steps_as_one_script():
+    script = dedupe_sql("product")
+    assert script.endswith(";\n")
+    assert [s.strip() for s in script.split(";") if s.strip()] == [s.strip() for s in dedupe_steps("product")]
+
+
+def test_dedupe_reports_removed_and_repointed_per_kind(fake_connection):
+    connection = fake_connection(counts=[7, 2, 0, 0])
+    cur = connection.cur
+    assert dedupe(connection) == {"product": (2, 7), "material": (0, 0)}
+    assert cur.executed[0][0].startswith("LOCK TABLE")
+    assert len(cur.executed) == 1 + 3 * len(NATURAL_KEYS)
+    assert connection.calls == ["commit"]
+    assert cur.closed
+
+
+def test_dry_run_rolls_back(fake_connection):
+    connection = fake_connection(counts=[1, 1, 1, 1])
+    assert dedupe(connection, dry_run=True) == {"product": (1, 1), "material": (1, 1)}
+    assert connection.calls == ["rollback"]
+
+
+def test_failure_rolls_back_and_raises(fake_connection):
+    connection = fake_connection(counts=[1, 1], fail_on="dedupe_material ON COMMIT")
+    with pytest.raises(RuntimeError):
+        dedupe(connection)
+    assert connection.calls == ["rollback"]
+    assert connection.cur.closed
+
+
+def test_read_csv_picks_columns_in_order(tmp_path):
+    path = tmp_path / "materials.csv"
+    path.write_text("unit,name,price_per_unit\nkg,Steel,3\nm3,Oak,12\n", encoding="utf-8")
+    assert list(read_csv(path, ("name", "price_per_unit", "unit"))) == [("Steel", "3", "kg"), ("Oak", "12", "m3")]
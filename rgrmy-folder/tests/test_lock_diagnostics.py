@@ -0,0 +1,44 @@
+import random
+
+from scr.lock_diagnostics import backoff_delays, classify, is_retryable
+
+
+class PgError(Exception):
+    def __init__(self, pgcode):
+        super().__init__(pgcode)
+        self.pgcode = pgcode
+
+
+def test_classify_by_sqlstate():
+    assert classify(PgError("40P01")) == "deadlock"
+    assert classify(PgError("40001")) == "serialization"
+    assert classify(PgError("55P03")) == "lock_timeout"
+    assert classify(PgError("57014")) == "query_canceled"
+    assert classify(PgError("23505")) is None
+    assert classify(ValueError("no pgcode")) is None
+
+
+def test_only_rolled_back_failures_are_retryable():
+    assert is_retryable(PgError("40P01"))
+    assert is_retryable(PgError("40001"))
+    assert is_retryable(PgError("55P03"))
+    # a cancelled statement was stopped on purpose
+    assert not is_retryable(PgError("57014"))
+    assert not is_retryable(PgError("23503"))
+    assert not is_retryable(RuntimeError())
+
+
+def test_backoff_delays_grow_and_are_capped():
+    random.seed(1)
+    assert list(backoff_delays(0)) == []
+    for _ in range(200):
+        delays = list(backoff_delays(8, base=0.05, cap=1.0))
+        assert len(delays) == 8
+        for attempt, delay in enumerate(delays):
+            assert 0 <= delay <= min(1.0, 0.05 * 2 ** attempt)
+
+
+def test_backoff_delays_use_full_jitter():
+    random.seed(2)
+    first = [next(backoff_delays(1, base=1.0)) for _ in range(200)]
+    assert min(first) < 0.2 and max(first) > 0.8
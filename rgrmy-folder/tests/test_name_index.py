@@ -0,0 +1,105 @@
+from types import SimpleNamespace
+
+from scr.name_index import NameIndex
+
+
+def loaded(*rows, **kwargs):
+    return NameIndex(**kwargs).load(rows)
+
+
+def test_load_sorts_case_insensitively():
+    index = loaded((3, "bolt"), (1, "Axle"), (2, " beam "))
+    assert index.loaded and index.enabled
+    assert index.complete("") == ["Axle", "beam", "bolt"]
+    assert len(index) == 3
+
+
+def test_complete_returns_distinct_names_with_prefix():
+    index = loaded((1, "Steel"), (2, "steel"), (3, "Steel"), (4, "Stone"), (5, "Wood"))
+    # equal keys stay in id order, each spelling once
+    assert index.complete("st") == ["Steel", "steel", "Stone"]
+    assert index.complete("ST", limit=1) == index.complete("st")[:1]
+    assert index.complete("x") == []
+
+
+def test_resolve_returns_every_id_of_a_name():
+    index = loaded((4, "Steel"), (1, "steel"), (2, "Stone"))
+    assert index.resolve(" STEEL ") == [1, 4]
+    assert index.resolve("Ste") == []
+
+
+def test_add_keeps_order_and_ignores_duplicates():
+    index = loaded((1, "b"))
+    index.add(3, "a")
+    index.add(2, "a")
+    index.add(2, "a")
+    assert index.resolve("a") == [2, 3]
+    assert index.complete("") == ["a", "b"]
+    assert len(index) == 3
+
+
+def test_rename_and_remove():
+    index = loaded((1, "Oak"), (2, "Pine"))
+    index.rename(1, "Ash")
+    assert index.resolve("oak") == []
+    assert index.resolve("ash") == [1]
+    index.remove(2)
+    index.remove(99)
+    assert index.complete("") == ["Ash"]
+
+
+def test_switches_off_past_max_names():
+    index = loaded((1, "a"), (2, "b"), (3, "c"), max_names=2)
+    assert index.loaded and not index.enabled
+    assert len(index) == 0
+    index = loaded((1, "a"), (2, "b"), max_names=2)
+    index.add(3, "c")
+    assert not index.enabled
+    index.add(4, "d")
+    assert len(index) == 0
+
+
+def test_reset_forgets_everything():
+    index = loaded((1, "a"), max_names=0)
+    index.reset()
+    assert not index.loaded and index.enabled
+    assert len(index) == 0
+
+
+def test_failed_load_keeps_nothing():
+    def rows():
+        yield 1, "a"
+        raise TimeoutError
+
+    index = NameIndex()
+    try:
+        index.load(rows())
+    except TimeoutError:
+        pass
+    assert not index.loaded
+    assert len(index) == 0
+
+
+def test_change_events():
+    def event(op, record_id=None, old=None, new=None):
+        return SimpleNamespace(op=op, id=record_id, old=old, new=new)
+
+    index = NameIndex()
+    index.on_change(event("INSERT", 1, new={"name": "a"}))
+    assert len(index) == 0  # not loaded: nothing to keep in step
+    index.load([(1, "a")])
+    index.on_change(event("INSERT", 2, new={"name": "b"}))
+    index.on_change(event("UPDATE", 1, old={"name": "a"}, new={"name": "c"}))
+    assert index.complete("") == ["b", "c"]
+    index.on_change(event("DELETE", 2, old={"name": "b"}))
+    assert index.complete("") == ["c"]
+    index.on_change(event("BULK_DELETE"))
+    assert not index.loaded
+
+
+def test_sql_fallback_matches_wildcards_literally():
+    from scr.model import like_prefix
+
+    assert like_prefix("A_") == r"A\_%"
+    assert like_prefix("50%") == r"50\%%"
+    assert like_prefix("C:\\x_") == r"C:\\x\_%"
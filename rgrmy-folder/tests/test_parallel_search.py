@@ -0,0 +1,70 @@
+import threading
+import time
+
+import pytest
+from psycopg2.pool import PoolError
+
+import scr.parallel_search as parallel_search
+from scr.parallel_search import ParallelSearch, SearchCancelled, WaitingPool
+
+
+class FakePool:
+    # hands out up to maxconn connections and, like ThreadedConnectionPool,
+    # raises PoolError at once when all are out
+    def __init__(self, connections):
+        self.free = list(connections)
+
+    def getconn(self):
+        if not self.free:
+            raise PoolError("connection pool exhausted")
+        return self.free.pop()
+
+    def putconn(self, conn, close=False):
+        self.free.append(conn)
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture
+def pool(monkeypatch, fake_connection):
+    monkeypatch.setattr(
+        parallel_search, "ThreadedConnectionPool",
+        lambda minconn, maxconn, **config: FakePool(fake_connection() for _ in range(maxconn))
+    )
+    return WaitingPool(2, timeout=2)
+
+
+def test_getconn_waits_for_a_connection_to_come_back(pool):
+    first, second = pool.getconn(), pool.getconn()
+    threading.Timer(0.1, pool.putconn, (first,)).start()
+    t0 = time.time()
+    assert pool.getconn() is first
+    assert time.time() - t0 >= 0.05
+    pool.putconn(first)
+    pool.putconn(second)
+
+
+def test_getconn_gives_up_after_the_timeout(pool):
+    pool.timeout = 0.05
+    pool.getconn(), pool.getconn()
+    with pytest.raises(PoolError):
+        pool.getconn()
+
+
+def test_cancel_reaches_only_checked_out_connections(pool):
+    busy = pool.getconn()
+    idle = pool.getconn()
+    pool.putconn(idle)
+    pool.cancel()
+    assert busy.calls == ["cancel"]
+    assert idle.calls == []
+
+
+def test_no_query_starts_once_the_model_is_cancelled(pool, fake_connection):
+    class Model:
+        cancelled = True
+
+    search = ParallelSearch(pool, 2, Model())
+    with pytest.raises(SearchCancelled):
+        search._run(fake_connection(), "search.consumation.parallel", "SELECT 1")
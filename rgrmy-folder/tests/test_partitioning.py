@@ -0,0 +1,56 @@
+from scr.partitioning import ConsumationPartitions, is_missing_partition
+
+
+class Partitions(ConsumationPartitions):
+    # partitions and the table comment as the catalog would report them
+    def __init__(self, parts=(), comment=None):
+        super().__init__(None)
+        self.parts = list(parts)
+        self.comment = comment
+
+    def partitions(self):
+        return self.parts
+
+    def _select(self, query, data=None):
+        return [(self.comment,)]
+
+
+def created_ranges(cur):
+    return [q.split("FOR VALUES ")[1].split(" WITH")[0] for q, _ in cur.executed]
+
+
+def test_new_partitions_start_above_the_highest(fake_connection):
+    partitions = Partitions([("consumation_p0", 1, 11), ("consumation_p1", 11, 21)])
+    cur = fake_connection().cur
+    assert partitions._create_partitions(cur, 10, 35) == ["consumation_p2", "consumation_p3"]
+    assert created_ranges(cur) == ["FROM (21) TO (31)", "FROM (31) TO (41)"]
+
+
+def test_purged_ranges_stay_dropped_when_no_partition_is_left(fake_connection):
+    # purge dropped p0..p4; the sequence has handed out ids up to 47
+    cur = fake_connection().cur
+    assert Partitions()._create_partitions(cur, 10, 47 + 10, last_id=47) == ["consumation_p4", "consumation_p5"]
+    assert created_ranges(cur) == ["FROM (41) TO (51)", "FROM (51) TO (61)"]
+
+
+def test_size_comes_from_the_table_comment():
+    assert Partitions(comment="Range partitioned by id, partition size 250000").partition_size() == 250000
+    # older conversions: the first partition, else the default
+    assert Partitions([("consumation_p0", 1, 501)]).partition_size() == 500
+    assert Partitions().partition_size() == 1_000_000
+
+
+def test_missing_partition_is_told_apart_from_a_check_constraint():
+    class Diag:
+        def __init__(self, constraint_name):
+            self.constraint_name = constraint_name
+
+    class Error(Exception):
+        def __init__(self, pgcode, constraint_name):
+            self.pgcode = pgcode
+            self.diag = Diag(constraint_name)
+
+    assert is_missing_partition(Error("23514", None))
+    assert not is_missing_partition(Error("23514", "Consumation_quatity_check"))
+    assert not is_missing_partition(Error("23505", None))
+    assert not is_missing_partition(ValueError())
@@ -0,0 +1,238 @@
+from contextlib import contextmanager
+
+import psycopg
+import pytest
+
+from scr.name_index import NameIndex
+from scr.pipeline import Operation, PipelineExecutor, read_script
+
+
+class Cache:
+    def __init__(self):
+        self.cleared = 0
+
+    def clear(self):
+        self.cleared += 1
+
+
+class Model:
+    insert_queries = {"product": 'INSERT INTO "Product"(name, description) VALUES (%s, %s) RETURNING id'}
+    update_queries = {"material": {
+        "name": "UPDATE material SET name = %s WHERE id = %s",
+        "unit": "UPDATE material SET unit = %s WHERE id = %s",
+    }}
+    delete_queries = {"consumation": 'DELETE FROM "Consumation" WHERE id = %s'}
+
+    def __init__(self):
+        self.router = None
+        self.bom_cache = Cache()
+        self.name_indexes = {"product": NameIndex().load([]), "material": NameIndex().load([])}
+
+
+class Router:
+    def __init__(self):
+        self.noted = []
+
+    def note_write(self, connection):
+        self.noted.append(connection)
+
+
+class PipelineConnection:
+    # stands in for a psycopg 3 connection in pipeline mode. The server
+    # fails the statements whose parameters are keys of fail and aborts
+    # everything queued after them; with late, the error surfaces in the
+    # next execute() instead of in the statement's own fetch. refuse raises
+    # in execute(), before the statement is sent, as adaptation errors do.
+    def __init__(self, fail=None, refuse=None, late=False):
+        self.fail = fail or {}
+        self.refuse = refuse or {}
+        self.late = late
+        self.calls = []
+        self.sent = []
+
+    @contextmanager
+    def pipeline(self):
+        self.sent.append([])
+        self.error = None
+        self.raised = False
+        yield
+        if self.error is not None and not self.raised:
+            raise self.error[1]
+
+    def cursor(self):
+        return PipelineCursor(self)
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+class PipelineCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.position = None
+
+    def execute(self, sql, params):
+        conn = self.connection
+        if params in conn.refuse:
+            raise conn.refuse[params]
+        if conn.late and conn.error is not None:
+            if not conn.raised:
+                conn.raised = True
+                raise conn.error[1]
+            raise psycopg.errors.PipelineAborted("pipeline aborted")
+        self.position = len(conn.sent[-1])
+        conn.sent[-1].append(params[0])
+        if params in conn.fail and conn.error is None:
+            conn.error = (self.position, conn.fail[params])
+
+    def fetchall(self):
+        conn = self.connection
+        if conn.error is None or self.position < conn.error[0]:
+            return [(100 + self.position,)]
+        if self.position > conn.error[0]:
+            raise psycopg.errors.PipelineAborted("pipeline aborted")
+        if conn.raised:
+            raise psycopg.ProgrammingError("the last operation didn't produce a result")
+        conn.raised = True
+        raise conn.error[1]
+
+
+def duplicate(key):
+    return psycopg.errors.UniqueViolation(f"duplicate key {key}")
+
+
+class Executor(PipelineExecutor):
+    # a PipelineExecutor on a PipelineConnection instead of a server
+    def __init__(self, model, **connection):
+        self.model = model
+        self.connection = PipelineConnection(**connection)
+        self.round_trips = 0
+
+
+def test_statements():
+    executor = Executor(Model())
+    assert executor._statement(Operation("create", "product", ["Frame", "Steel"])) == (
+        Model.insert_queries["product"], ("Frame", "Steel")
+    )
+    assert executor._statement(Operation("update", "material", (3, "unit", "t"))) == (
+        "UPDATE material SET unit = %s WHERE id = %s RETURNING id", ("t", 3)
+    )
+    assert executor._statement(Operation("delete", "consumation", (42,))) == (
+        'DELETE FROM "Consumation" WHERE id = %s RETURNING id', (42,)
+    )
+    with pytest.raises(ValueError):
+        executor._statement(Operation("update", "material", (3, "colour", "red")))
+    with pytest.raises(ValueError):
+        executor._statement(Operation("merge", "material", ()))
+
+
+def test_all_succeed_in_one_round_trip():
+    executor = Executor(Model())
+    ops = [Operation("delete", "consumation", (i,)) for i in range(3)]
+    results = executor.execute(ops)
+    assert [r.operation for r in results] == ops
+    assert [r.rows for r in results] == [[(100,)], [(101,)], [(102,)]]
+    assert all(r.error is None for r in results)
+    assert executor.round_trips == 1
+    assert executor.connection.calls == ["commit"]
+
+
+def test_failures_are_resent_without_them():
+    executor = Executor(Model(), fail={(1,): duplicate(1), (3,): duplicate(3)})
+    ops = [Operation("delete", "consumation", (i,)) for i in range(5)]
+    results = executor.execute(ops)
+    assert [r.error is None for r in results] == [True, False, True, False, True]
+    assert str(results[3].error) == "duplicate key 3"
+    assert results[1].rows is None
+    assert [r.rows for r in results if r.error is None] == [[(100,)], [(101,)], [(102,)]]
+    # k failures cost k + 1 round trips; the rest of the pipeline still went out
+    assert executor.connection.sent == [[0, 1, 2, 3, 4], [0, 2, 3, 4], [0, 2, 4]]
+    assert executor.round_trips == 3
+    assert executor.connection.calls == ["rollback", "rollback", "commit"]
+
+
+def test_error_surfacing_in_a_later_execute_is_pinned_to_its_statement():
+    executor = Executor(Model(), fail={(1,): duplicate(1)}, late=True)
+    results = executor.execute([Operation("delete", "consumation", (i,)) for i in range(4)])
+    assert isinstance(results[1].error, psycopg.errors.UniqueViolation)
+    assert [r.error is None for r in results] == [True, False, True, True]
+    # nothing after the failure was queued in the first send
+    assert executor.connection.sent == [[0, 1], [0, 2, 3]]
+
+
+def test_refused_statement_fails_alone():
+    error = psycopg.DataError("cannot adapt")
+    executor = Executor(Model(), refuse={(1,): error})
+    results = executor.execute([Operation("delete", "consumation", (i,)) for i in range(3)])
+    assert results[1].error is error
+    assert [r.error is None for r in results] == [True, False, True]
+    assert executor.connection.sent == [[0], [0, 2]]
+
+
+def test_invalid_operations_are_never_sent():
+    executor = Executor(Model())
+    ops = [Operation("update", "material", (1, "colour", "red")), Operation("delete", "consumation", (7,))]
+    results = executor.execute(ops)
+    assert isinstance(results[0].error, ValueError)
+    assert executor.connection.sent == [[7]]
+
+
+def test_nothing_left_to_commit():
+    executor = Executor(Model(), fail={(1,): duplicate(1)})
+    results = executor.execute([Operation("delete", "consumation", (1,))])
+    assert results[0].error is not None
+    assert executor.connection.calls == ["rollback"]
+
+
+def test_commit_is_noted_for_replica_routing():
+    model = Model()
+    model.router = Router()
+    executor = Executor(model)
+    executor.execute([Operation("delete", "consumation", (1,))])
+    assert model.router.noted == [executor.connection]
+
+
+def test_committed_operations_update_the_name_index_and_bom_cache():
+    model = Model()
+    model.name_indexes["material"].add(5, "Oak")
+    model.name_indexes["material"].add(6, "Pine")
+    executor = Executor(model, fail={("Lost", ""): duplicate("Lost")})
+    executor.execute([
+        Operation("create", "product", ("Frame", "")),
+        Operation("update", "material", (5, "name", "Ash")),
+        Operation("create", "product", ("Lost", "")),
+    ])
+    assert model.name_indexes["product"].resolve("frame") == [100]
+    assert model.name_indexes["product"].resolve("lost") == []
+    assert model.name_indexes["material"].complete("") == ["Ash", "Pine"]
+    assert model.bom_cache.cleared == 1
+
+
+def test_bom_cache_kept_when_totals_cannot_change():
+    model = Model()
+    Executor(model).execute([Operation("create", "product", ("Frame", ""))])
+    assert model.bom_cache.cleared == 0
+
+
+def test_unmatched_operations_change_nothing():
+    model = Model()
+    model.name_indexes["material"].add(5, "Oak")
+    executor = Executor(model)
+    executor._apply_to_model([(Operation("delete", "material", (5,)), [], None)])
+    assert model.name_indexes["material"].resolve("oak") == [5]
+
+
+def test_read_script(tmp_path):
+    path = tmp_path / "ops.jsonl"
+    path.write_text(
+        '{"op": "create", "table": "material", "args": ["Oak", 12, "m3"]}\n\n'
+        '{"op": "delete", "table": "consumation", "args": [4]}\n',
+        encoding="utf-8",
+    )
+    assert list(read_script(path)) == [
+        Operation("create", "material", ("Oak", 12, "m3")),
+        Operation("delete", "consumation", (4,)),
+    ]
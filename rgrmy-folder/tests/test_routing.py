@@ -0,0 +1,92 @@
+import pytest
+
+from scr.routing import ReplicaRouter
+
+
+def router(n=3, **kwargs):
+    return ReplicaRouter([{"host": f"r{i}", "port": 5432} for i in range(n)], **kwargs)
+
+
+def names(replicas):
+    return [r.config["host"] for r in replicas]
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        router(strategy="random")
+
+
+def test_round_robin_rotates_the_start():
+    r = router()
+    assert names(r._candidates()) == ["r0", "r1", "r2"]
+    assert names(r._candidates()) == ["r1", "r2", "r0"]
+    assert names(r._candidates()) == ["r2", "r0", "r1"]
+    assert names(r._candidates()) == ["r0", "r1", "r2"]
+
+
+def test_round_robin_skips_replicas_marked_down():
+    r = router()
+    r.replicas[1].mark_down()
+    assert names(r._candidates()) == ["r0", "r2"]
+    assert names(r._candidates()) == ["r2", "r0"]
+
+
+def test_least_latency_tries_unmeasured_replicas_first():
+    r = router(strategy="least_latency")
+    r.replicas[0].record_latency(5.0)
+    r.replicas[2].record_latency(2.0)
+    assert names(r._candidates()) == ["r1", "r2", "r0"]
+    r.replicas[1].record_latency(9.0)
+    assert names(r._candidates()) == ["r2", "r0", "r1"]
+
+
+def test_latency_is_smoothed():
+    r = router(1)
+    replica = r.replicas[0]
+    replica.record_latency(10.0)
+    replica.record_latency(110.0)
+    assert replica.latency_ms == pytest.approx(30.0)
+
+
+def test_pick_counts_routed_reads():
+    r = router(2)
+    assert r.pick() is r.replicas[0]
+    assert r.pick() is r.replicas[1]
+    assert r.routed == {"primary": 0, "r0:5432": 1, "r1:5432": 1}
+
+
+def test_pick_falls_back_to_primary_when_all_are_down():
+    r = router(2)
+    for replica in r.replicas:
+        replica.mark_down()
+    assert r.pick() is None
+    assert r.routed["primary"] == 1
+
+
+def test_lagging_replica_is_skipped_after_a_write(fake_connection):
+    r = router(2)
+    primary = fake_connection(rows=[("0/16B3748",)])
+    r.note_write(primary)
+    assert r.last_write_lsn == "0/16B3748"
+    assert primary.calls == ["commit"]
+    r.replicas[0]._connection = fake_connection(rows=[(False,)])
+    r.replicas[1]._connection = fake_connection(rows=[(True,)])
+    assert r.pick() is r.replicas[1]
+    assert r.replicas[0]._connection.cur.executed[0][1] == ("0/16B3748",)
+
+
+def test_failing_replica_is_marked_down(fake_connection):
+    r = router(1)
+    r.last_write_lsn = "0/1"
+    broken = fake_connection()
+    broken.cursor = lambda: 1 / 0
+    r.replicas[0]._connection = broken
+    assert r.pick() is None
+    assert broken.closed
+    assert not r.replicas[0].available
+
+
+def test_without_read_your_writes_no_lsn_is_kept(fake_connection):
+    r = router(1, read_your_writes=False)
+    r.note_write(fake_connection(rows=[("0/1",)]))
+    assert r.last_write_lsn is None